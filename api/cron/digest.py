@@ -1,17 +1,26 @@
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
 from http.server import BaseHTTPRequestHandler
 import asyncio
 import json
 import logging
 import os
 import sys
+from contextlib import nullcontext
 from datetime import datetime
 
 # Добавляем корневую директорию проекта в путь для импорта
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
-from telegram import Bot
-from src.config import TOKEN, SITEMAP_URL, DIGEST_CHAT_ID, MAX_ARTICLES_IN_DIGEST
-from src.sitemap_parser import SitemapParser
+from src.config import TOKEN, SOURCE_TYPE, SITEMAP_URL, FEED_URL, DIGEST_CHAT_ID, MAX_ARTICLES_IN_DIGEST
+from src.sources import create_parser
+from src.metrics import track_run, incr
+from src.subscriptions import DEFAULT_SOURCE, SourceRegistry, deliver_subscriptions
+from src.profiling import PROFILE_HEADER, profile, should_profile
+from src.startup import record_import
+from api.utils.storage import set_value, get_subscriptions, seed_subscription
 
 # Настройка логирования
 logging.basicConfig(
@@ -21,45 +30,43 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Глобальные переменные
-sitemap_parser = SitemapParser(SITEMAP_URL)
+sitemap_parser = create_parser(SOURCE_TYPE, SITEMAP_URL, FEED_URL)
+sources = SourceRegistry(sitemap_parser)
+
+# Ключ хранилища для последнего отчета профилирования
+PROFILE_STORAGE_KEY = 'profile:cron'
 
 async def send_digest():
     """Отправляет дайджест в Telegram"""
-    # Проверяем, задан ли ID чата для отправки
-    chat_id = os.environ.get('DIGEST_CHAT_ID', DIGEST_CHAT_ID)
+    with track_run('cron'):
+        return await _send_digest()
+
+async def _send_digest():
+    """Собирает и рассылает дайджесты по подпискам в рамках отслеживаемого запуска"""
+    # Чат из DIGEST_CHAT_ID подписывается на источник по умолчанию, если подписок еще нет
+    if DIGEST_CHAT_ID:
+        await seed_subscription(DIGEST_CHAT_ID, DEFAULT_SOURCE)
+    subscriptions = await get_subscriptions()
     
-    if not chat_id:
-        logger.warning("Не указан ID чата для отправки дайджеста")
-        return {"status": "error", "message": "Не указан ID чата для отправки дайджеста"}
+    if not subscriptions:
+        logger.warning("Нет подписанных чатов для отправки дайджеста")
+        return {"status": "error", "message": "Нет подписанных чатов для отправки дайджеста"}
     
     try:
-        logger.info("Начинаем парсинг sitemap.xml...")
-        articles = sitemap_parser.parse_sitemap()
-        
-        if not articles:
-            logger.info("Нет новых статей для отправки")
-            return {"status": "success", "message": "Нет новых статей для отправки"}
+        logger.info(f"Начинаем получение новых статей для {len(subscriptions)} чатов...")
         
-        logger.info(f"Найдено {len(articles)} новых статей")
-        
-        # Форматируем дайджест
-        digest_text = sitemap_parser.format_digest(articles, MAX_ARTICLES_IN_DIGEST)
-        
-        # Создаем экземпляр бота
+        # Создаем экземпляр бота (telegram импортируется лениво ради быстрого холодного старта)
+        from telegram import Bot
         bot = Bot(token=TOKEN)
         
-        # Отправляем дайджест в Telegram
-        await bot.send_message(
-            chat_id=chat_id,
-            text=digest_text,
-            parse_mode='Markdown',
-            disable_web_page_preview=True
-        )
-        
-        logger.info(f"Дайджест отправлен в чат {chat_id}")
-        return {"status": "success", "message": f"Дайджест отправлен в чат {chat_id}"}
+        # Каждый источник собирается один раз (и только одним процессом), дайджест рассылается всем подписчикам
+        delivered = await deliver_subscriptions(sources, subscriptions, bot.send_message, MAX_ARTICLES_IN_DIGEST)
+        message = f"Дайджесты отправлены в {sum(delivered.values())} чатов из {len(delivered)} источников"
+        logger.info(message)
+        return {"status": "success", "message": message}
         
     except Exception as e:
+        incr('errors')
         error_message = f"Ошибка при формировании и отправке дайджеста: {e}"
         logger.error(error_message)
         return {"status": "error", "message": error_message}
@@ -79,8 +86,14 @@ class handler(BaseHTTPRequestHandler):
             "message": f"Запуск обработки дайджеста в {now}"
         }).encode('utf-8'))
         
-        # Выполняем отправку дайджеста асинхронно
-        result = asyncio.run(send_digest())
+        # Выполняем отправку дайджеста асинхронно (при необходимости под профилировщиком)
+        profiling = profile('cron') if should_profile(self.headers.get(PROFILE_HEADER)) else nullcontext()
+        with profiling as report:
+            result = asyncio.run(send_digest())
+        if report:
+            asyncio.run(set_value(PROFILE_STORAGE_KEY, report.to_dict()))
         
         # Логируем результат (хотя клиент его уже не получит)
-        logger.info(f"Результат отправки дайджеста: {result}") 
\ No newline at end of file
+        logger.info(f"Результат отправки дайджеста: {result}") 
+
+record_import(__name__, _IMPORT_STARTED)
@@ -5,6 +5,7 @@ import requests
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, CallbackContext
 from sitemap_parser import SitemapParser
+from utils.storage import claim_update, release_update
 from dotenv import load_dotenv
 from http.server import BaseHTTPRequestHandler
 from io import BytesIO
@@ -89,6 +90,12 @@ async def echo(update: Update, context: CallbackContext):
 # Функция для обработки вебхуков Telegram
 async def process_telegram_update(update_json):
     """Обработать обновление от Telegram"""
+    update_id = update_json.get('update_id')
+    # Telegram повторяет доставку, если ответ задерживается; повторы не обрабатываем
+    if update_id is not None and not await claim_update(update_id):
+        logger.info(f"Обновление {update_id} уже обработано, пропускаем повторную доставку")
+        return True
+    
     try:
         # Создаем объект Application в режиме вебхука
         application = Application.builder().token(BOT_TOKEN).build()
@@ -108,6 +115,8 @@ async def process_telegram_update(update_json):
         return True
     except Exception as e:
         logger.error(f"Ошибка при обработке вебхука: {e}")
+        if update_id is not None:
+            await release_update(update_id)
         return False
 
 class handler(BaseHTTPRequestHandler):
@@ -1,15 +1,186 @@
 import os
+import base64
 import json
 import logging
+import math
+import socket
+import threading
+import time
+import uuid
 from typing import Any, Dict, Optional
 
 logger = logging.getLogger(__name__)
 
 # Проверяем, находимся ли мы на платформе Vercel
 IS_VERCEL = os.environ.get('VERCEL', '0') == '1'
+# Использовать Vercel KV (по умолчанию только на Vercel). STORAGE_KV=1 у worker из Procfile (задан там
+# по умолчанию) делает хранилище общим с cron на Vercel: подписки, аренды и состояние статей
+USE_KV = os.environ.get('STORAGE_KV', '1' if IS_VERCEL else '0') == '1'
 
 # Кеш в памяти для локальной разработки
 _memory_cache = {}
+# Сроки жизни значений кеша в памяти: {ключ: момент истечения по time.monotonic()}
+_memory_expiry = {}
+# Интервал удаления истекших значений из кеша в памяти (в секундах)
+_SWEEP_INTERVAL = 60
+_last_sweep = 0.0
+# Атомарность условных операций кеша в памяти (SET NX, INCR, сравнение с записью) между потоками
+_memory_lock = threading.RLock()
+
+# Сколько помнить обработанные update_id (Telegram повторяет доставку в течение нескольких минут)
+UPDATE_DEDUP_TTL = int(os.environ.get('UPDATE_DEDUP_TTL', '3600'))
+
+# Ключ снимка состояния статей (переживает холодный старт, в отличие от /tmp)
+ARTICLE_STATE_KEY = 'state:articles'
+
+# Срок аренды источника (в секундах): за это время сбор должен завершиться или продлить аренду
+LEASE_TTL = int(os.environ.get('LEASE_TTL', '300'))
+
+# Скрипты Lua для Vercel KV: проверка владельца аренды и действие выполняются атомарно.
+# KEYS[1] - ключ аренды, ARGV[1] - значение аренды владельца
+_RENEW_LEASE_SCRIPT = (
+    "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('PEXPIRE', KEYS[1], ARGV[2]) end "
+    "return 0"
+)
+_RELEASE_LEASE_SCRIPT = (
+    "if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end "
+    "return 0"
+)
+# KEYS[2] - записываемый ключ, ARGV[2] - значение, ARGV[3] - срок жизни в мс (0 - бессрочно)
+_FENCED_SET_SCRIPT = (
+    "if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end "
+    "if ARGV[3] == '0' then redis.call('SET', KEYS[2], ARGV[2]) "
+    "else redis.call('SET', KEYS[2], ARGV[2], 'PX', ARGV[3]) end "
+    "return 1"
+)
+
+# Скрипты Lua для очередей в Vercel KV (список Redis). KEYS[1] - ключ очереди
+# ARGV[1] - значение, ARGV[2] - максимальная длина очереди
+_QUEUE_PUSH_SCRIPT = (
+    "if redis.call('LLEN', KEYS[1]) >= tonumber(ARGV[2]) then return 0 end "
+    "return redis.call('RPUSH', KEYS[1], ARGV[1])"
+)
+_QUEUE_POP_SCRIPT = "return redis.call('LPOP', KEYS[1])"
+_QUEUE_LENGTH_SCRIPT = "return redis.call('LLEN', KEYS[1])"
+
+# Ключ хеша состояния размыкателей цепей {хост: JSON состояния} (каждый хост - отдельное поле,
+# поэтому одновременные вызовы, собирающие разные источники, не перезаписывают цепи друг друга)
+BREAKERS_KEY = 'breakers'
+# ARGV - пары (хост, JSON состояния); пустое состояние удаляет поле (цепь замкнута)
+_BREAKERS_SAVE_SCRIPT = (
+    "for i = 1, #ARGV, 2 do "
+    "if ARGV[i + 1] == '' then redis.call('HDEL', KEYS[1], ARGV[i]) "
+    "else redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1]) end "
+    "end "
+    "return 1"
+)
+_BREAKERS_LOAD_SCRIPT = "return redis.call('HGETALL', KEYS[1])"
+
+# Ведра ограничителя частоты в Vercel KV: общее для всех экземпляров функции и worker
+RATE_LIMIT_GLOBAL_KEY = 'ratelimit:global'
+# Скрипт Lua ведер жетонов: проверка и списание в ведре пользователя и общем ведре атомарны.
+# KEYS[1] - ведро пользователя, KEYS[2] - общее ведро (хеши tokens, updated); ARGV[1] - текущее время
+# в секундах, ARGV[2] - стоимость, ARGV[3..6] - емкость и скорость (жетонов в секунду) каждого ведра.
+# Возвращает строку: '0' - жетоны списаны, иначе через сколько секунд повторить ('-1' - никогда)
+_TAKE_TOKENS_SCRIPT = (
+    "local now, cost, wait, buckets = tonumber(ARGV[1]), tonumber(ARGV[2]), 0, {} "
+    "for i = 1, 2 do "
+    "local capacity, rate = tonumber(ARGV[1 + i * 2]), tonumber(ARGV[2 + i * 2]) "
+    "local data = redis.call('HMGET', KEYS[i], 'tokens', 'updated') "
+    "local tokens = tonumber(data[1]) or capacity "
+    "local updated = tonumber(data[2]) or now "
+    "tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate) "
+    "local need = math.min(cost, capacity) "
+    "buckets[i] = {tokens - need, capacity, rate} "
+    "if tokens < need then "
+    "if rate <= 0 then wait = -1 elseif wait >= 0 then wait = math.max(wait, (need - tokens) / rate) end "
+    "end "
+    "end "
+    "if wait ~= 0 then return tostring(wait) end "
+    "for i = 1, 2 do "
+    "redis.call('HSET', KEYS[i], 'tokens', tostring(buckets[i][1]), 'updated', tostring(now)) "
+    "if buckets[i][3] > 0 then "
+    "redis.call('PEXPIRE', KEYS[i], math.ceil(buckets[i][2] / buckets[i][3] * 1000) + 1000) end "
+    "end "
+    "return '0'"
+)
+
+# Идентификатор процесса для аренд
+NODE_ID = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+# Ключ списка процессов-участников шардирования; живость каждого - ключ member:<ID> со сроком жизни
+MEMBERS_KEY = 'members'
+
+# Ключ подписок чатов на источники: {ID чата: [идентификаторы источников]}
+SUBSCRIPTIONS_KEY = 'subscriptions'
+# Подписки в Vercel KV: хеш {ID чата: JSON-список источников}, хеш {источник: число подписанных чатов}
+# и отметка о том, что подписки уже создавались (для seed_subscription)
+SUBSCRIPTION_CHATS_KEY = 'subscriptions:chats'
+SUBSCRIPTION_SOURCES_KEY = 'subscriptions:sources'
+SUBSCRIPTION_SEEDED_KEY = 'subscriptions:seeded'
+
+# Скрипты Lua для подписок: чтение, проверка лимитов и запись выполняются атомарно, поэтому
+# одновременные /subscribe и /unsubscribe разных чатов не перезаписывают друг друга.
+# KEYS: хеш чатов, хеш источников, прежний ключ SUBSCRIPTIONS_KEY, отметка создания подписок.
+# Подписки из прежнего ключа (одно значение JSON) переносятся в хеши при первом обращении
+_SUBSCRIPTIONS_MIGRATE = (
+    "local legacy = redis.call('GET', KEYS[3]) "
+    "if legacy then "
+    "for chat, sources in pairs(cjson.decode(legacy)) do "
+    "if #sources > 0 then redis.call('HSET', KEYS[1], chat, cjson.encode(sources)) end "
+    "for _, source in ipairs(sources) do redis.call('HINCRBY', KEYS[2], source, 1) end "
+    "end "
+    "redis.call('DEL', KEYS[3]) "
+    "redis.call('SET', KEYS[4], '1') "
+    "end "
+)
+# ARGV[1] - ID чата, ARGV[2] - источник, ARGV[3] - лимит чата, ARGV[4] - общий лимит (-1 - без лимита),
+# ARGV[5] - '1', если подписка создается только при отсутствии подписок (seed_subscription).
+# Возвращает 1 - подписка добавлена, 0 - уже есть, -1 - лимит чата, -2 - общий лимит
+_SUBSCRIBE_SCRIPT = _SUBSCRIPTIONS_MIGRATE + (
+    "if ARGV[5] == '1' and not redis.call('SET', KEYS[4], '1', 'NX') then return 0 end "
+    "local raw = redis.call('HGET', KEYS[1], ARGV[1]) "
+    "local sources = {} "
+    "if raw then sources = cjson.decode(raw) end "
+    "for _, source in ipairs(sources) do if source == ARGV[2] then return 0 end end "
+    "local limit = tonumber(ARGV[3]) "
+    "if limit >= 0 and #sources >= limit then return -1 end "
+    "local total = tonumber(ARGV[4]) "
+    "if total >= 0 and redis.call('HEXISTS', KEYS[2], ARGV[2]) == 0 "
+    "and redis.call('HLEN', KEYS[2]) >= total then return -2 end "
+    "table.insert(sources, ARGV[2]) "
+    "redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(sources)) "
+    "redis.call('HINCRBY', KEYS[2], ARGV[2], 1) "
+    "redis.call('SET', KEYS[4], '1') "
+    "return 1"
+)
+# ARGV[1] - ID чата, ARGV[2] - источник ('' - все источники). Возвращает 1, если подписка была и удалена
+_UNSUBSCRIBE_SCRIPT = _SUBSCRIPTIONS_MIGRATE + (
+    "local raw = redis.call('HGET', KEYS[1], ARGV[1]) "
+    "if not raw then return 0 end "
+    "local kept, removed = {}, {} "
+    "for _, source in ipairs(cjson.decode(raw)) do "
+    "if ARGV[2] == '' or source == ARGV[2] then table.insert(removed, source) "
+    "else table.insert(kept, source) end "
+    "end "
+    "if #removed == 0 then return 0 end "
+    "if #kept == 0 then redis.call('HDEL', KEYS[1], ARGV[1]) "
+    "else redis.call('HSET', KEYS[1], ARGV[1], cjson.encode(kept)) end "
+    "for _, source in ipairs(removed) do "
+    "if redis.call('HINCRBY', KEYS[2], source, -1) <= 0 then redis.call('HDEL', KEYS[2], source) end "
+    "end "
+    "return 1"
+)
+# Возвращает HGETALL хеша чатов: [ID чата, JSON-список источников, ...]
+_SUBSCRIPTIONS_SCRIPT = _SUBSCRIPTIONS_MIGRATE + "return redis.call('HGETALL', KEYS[1])"
+_SUBSCRIPTION_KEYS = [SUBSCRIPTION_CHATS_KEY, SUBSCRIPTION_SOURCES_KEY, SUBSCRIPTIONS_KEY, SUBSCRIPTION_SEEDED_KEY]
+
+# Файл для бессрочных значений кеша в памяти (подписки переживают перезапуск бота).
+# Пустое значение отключает сохранение; на Vercel используется KV
+STORAGE_FILE = os.environ.get(
+    'STORAGE_FILE',
+    '' if USE_KV else os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'storage.json')
+)
 
 def _get_vercel_kv_api():
     """
@@ -38,29 +209,677 @@ def _get_vercel_kv_api():
         logger.error(f"Ошибка при инициализации Vercel KV: {e}")
         return None
 
-async def set_value(key: str, value: Any) -> bool:
+def kv_available() -> bool:
+    """
+    Проверяет, что хранилище общее для процессов (Vercel KV включен и настроен)
+    
+    Без него аренды, подписки и состояние статей видны только текущему процессу.
+    """
+    return USE_KV and _get_vercel_kv_api() is not None
+
+def _memory_expired(key: str) -> bool:
+    """Проверяет срок жизни значения в памяти и удаляет его, если срок истек"""
+    deadline = _memory_expiry.get(key)
+    if deadline is None or deadline > time.monotonic():
+        return False
+    _memory_cache.pop(key, None)
+    del _memory_expiry[key]
+    return True
+
+def _sweep_memory():
+    """Удаляет истекшие значения из памяти не чаще раза в _SWEEP_INTERVAL секунд"""
+    global _last_sweep
+    now = time.monotonic()
+    if now - _last_sweep < _SWEEP_INTERVAL:
+        return
+    _last_sweep = now
+    for key in [key for key, deadline in _memory_expiry.items() if deadline <= now]:
+        _memory_cache.pop(key, None)
+        del _memory_expiry[key]
+
+def _load_memory_file():
+    """Загружает бессрочные значения кеша в памяти из STORAGE_FILE"""
+    if not STORAGE_FILE or not os.path.exists(STORAGE_FILE):
+        return
+    try:
+        with open(STORAGE_FILE, 'r', encoding='utf-8') as f:
+            _memory_cache.update(json.load(f))
+    except Exception as e:
+        logger.error(f"Ошибка загрузки хранилища из {STORAGE_FILE}: {e}")
+
+def _save_memory_file():
+    """Сохраняет бессрочные значения кеша в памяти в STORAGE_FILE (значения со сроком жизни не сохраняются)"""
+    if not STORAGE_FILE:
+        return
+    try:
+        data = {key: value for key, value in _memory_cache.items() if key not in _memory_expiry}
+        temp_path = f'{STORAGE_FILE}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, STORAGE_FILE)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения хранилища в {STORAGE_FILE}: {e}")
+
+def _memory_set(key: str, json_value: str, ttl: Optional[int]):
+    _sweep_memory()
+    _memory_cache[key] = json_value
+    if ttl:
+        _memory_expiry[key] = time.monotonic() + ttl
+    else:
+        _memory_expiry.pop(key, None)
+        _save_memory_file()
+
+async def set_value(key: str, value: Any, ttl: Optional[int] = None) -> bool:
     """
     Сохраняет значение в хранилище
     
     :param key: Ключ
     :param value: Значение (будет преобразовано в JSON)
+    :param ttl: Срок жизни значения в секундах (по умолчанию бессрочно)
     :return: True если успешно, иначе False
     """
     try:
         json_value = json.dumps(value)
         
-        if IS_VERCEL:
+        if USE_KV:
             kv = _get_vercel_kv_api()
             if kv:
-                await kv.set(key, json_value)
+                if ttl:
+                    await kv.set(key, json_value, ex=ttl)
+                else:
+                    await kv.set(key, json_value)
                 return True
         
         # Если не на Vercel или не удалось инициализировать KV, используем кеш в памяти
-        _memory_cache[key] = json_value
+        _memory_set(key, json_value, ttl)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении значения для ключа {key}: {e}")
+        return False
+
+async def add_value(key: str, value: Any, ttl: Optional[int] = None) -> Optional[bool]:
+    """
+    Сохраняет значение, только если ключа еще нет в хранилище (SET NX)
+    
+    :param key: Ключ
+    :param value: Значение (будет преобразовано в JSON)
+    :param ttl: Срок жизни значения в секундах (по умолчанию бессрочно)
+    :return: True если значение сохранено, False если ключ уже существует, None если произошла ошибка
+    """
+    try:
+        json_value = json.dumps(value)
+        
+        if USE_KV:
+            kv = _get_vercel_kv_api()
+            if kv:
+                if ttl:
+                    return bool(await kv.set(key, json_value, px=int(ttl * 1000), nx=True))
+                return bool(await kv.set(key, json_value, nx=True))
+        
+        # Если не на Vercel или не удалось инициализировать KV, используем кеш в памяти
+        with _memory_lock:
+            if key in _memory_cache and not _memory_expired(key):
+                return False
+            _memory_set(key, json_value, ttl)
         return True
     except Exception as e:
         logger.error(f"Ошибка при сохранении значения для ключа {key}: {e}")
+        return None
+
+async def incr_value(key: str) -> Optional[int]:
+    """
+    Атомарно увеличивает числовое значение на 1 (INCR); отсутствующий ключ считается нулем
+    
+    :param key: Ключ
+    :return: Новое значение или None, если произошла ошибка
+    """
+    try:
+        if USE_KV:
+            kv = _get_vercel_kv_api()
+            if kv:
+                return int(await kv.incr(key))
+        
+        # Если не на Vercel или не удалось инициализировать KV, используем кеш в памяти
+        with _memory_lock:
+            current = json.loads(_memory_cache[key]) if key in _memory_cache and not _memory_expired(key) else 0
+            _memory_set(key, json.dumps(int(current) + 1), None)
+            return int(current) + 1
+    except Exception as e:
+        logger.error(f"Ошибка при увеличении значения для ключа {key}: {e}")
+        return None
+
+async def queue_push(key: str, value: Any, limit: int) -> Optional[bool]:
+    """
+    Добавляет значение в конец очереди, если в ней меньше limit значений (проверка и запись атомарны)
+    
+    :param key: Ключ очереди
+    :param value: Значение (будет преобразовано в JSON)
+    :param limit: Максимальная длина очереди
+    :return: True если значение добавлено, False если очередь заполнена, None если произошла ошибка
+    """
+    try:
+        json_value = json.dumps(value)
+        
+        if USE_KV:
+            kv = _get_vercel_kv_api()
+            if kv:
+                return bool(await kv.eval(_QUEUE_PUSH_SCRIPT, keys=[key], args=[json_value, str(limit)]))
+        
+        # Если не на Vercel или не удалось инициализировать KV, используем кеш в памяти
+        with _memory_lock:
+            items = json.loads(_memory_cache.get(key, '[]'))
+            if len(items) >= limit:
+                return False
+            items.append(json_value)
+            _memory_set(key, json.dumps(items), None)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении в очередь {key}: {e}")
+        return None
+
+async def queue_pop(key: str) -> Any:
+    """
+    Забирает первое значение очереди
+    
+    :param key: Ключ очереди
+    :return: Значение или None, если очередь пуста или произошла ошибка
+    """
+    try:
+        if USE_KV:
+            kv = _get_vercel_kv_api()
+            if kv:
+                value = await kv.eval(_QUEUE_POP_SCRIPT, keys=[key], args=[])
+                return json.loads(value) if value else None
+        
+        # Если не на Vercel или не удалось инициализировать KV, используем кеш в памяти
+        with _memory_lock:
+            items = json.loads(_memory_cache.get(key, '[]'))
+            if not items:
+                return None
+            value = items.pop(0)
+            _memory_set(key, json.dumps(items), None)
+        return json.loads(value)
+    except Exception as e:
+        logger.error(f"Ошибка при чтении очереди {key}: {e}")
+        return None
+
+async def queue_length(key: str) -> Optional[int]:
+    """
+    Длина очереди
+    
+    :param key: Ключ очереди
+    :return: Число значений или None, если произошла ошибка
+    """
+    try:
+        if USE_KV:
+            kv = _get_vercel_kv_api()
+            if kv:
+                return int(await kv.eval(_QUEUE_LENGTH_SCRIPT, keys=[key], args=[]) or 0)
+        
+        # Если не на Vercel или не удалось инициализировать KV, используем кеш в памяти
+        return len(json.loads(_memory_cache.get(key, '[]')))
+    except Exception as e:
+        logger.error(f"Ошибка при получении длины очереди {key}: {e}")
+        return None
+
+async def take_rate_tokens(user_id: int, cost: float, user_bucket: tuple, global_bucket: tuple) -> Optional[float]:
+    """
+    Списывает жетоны из ведра пользователя и общего ведра в Vercel KV одной атомарной операцией
+    
+    :param user_id: ID пользователя Telegram
+    :param cost: Стоимость команды в жетонах
+    :param user_bucket: Емкость и скорость восстановления (жетонов в минуту) ведра пользователя
+    :param global_bucket: Емкость и скорость восстановления общего ведра
+    :return: 0, если жетоны списаны, иначе через сколько секунд повторить (math.inf - никогда);
+        None, если Vercel KV не используется или недоступен
+    """
+    if not USE_KV:
+        return None
+    try:
+        kv = _get_vercel_kv_api()
+        if not kv:
+            return None
+        args = [repr(time.time()), repr(float(cost))]
+        for capacity, per_minute in (user_bucket, global_bucket):
+            args.extend([repr(float(capacity)), repr(per_minute / 60)])
+        result = float(await kv.eval(_TAKE_TOKENS_SCRIPT, keys=[f'ratelimit:user:{user_id}', RATE_LIMIT_GLOBAL_KEY],
+                                     args=args))
+        return math.inf if result < 0 else result
+    except Exception as e:
+        logger.error(f"Ошибка ограничителя частоты в хранилище: {e}")
+        return None
+
+async def claim_update(update_id: int, ttl: int = UPDATE_DEDUP_TTL) -> bool:
+    """
+    Отмечает обновление Telegram как взятое в обработку
+    
+    Для каждого update_id хранится отдельный ключ со сроком жизни, поэтому проверка
+    выполняется за O(1), а записи об обработанных обновлениях не накапливаются.
+    Если хранилище недоступно, обновление считается новым: лучше изредка обработать
+    повторную доставку, чем потерять все команды пользователей на время сбоя.
+    
+    :param update_id: Идентификатор обновления
+    :param ttl: Сколько секунд помнить обновление
+    :return: True если обновление встречается впервые или проверить это не удалось,
+        False если это повторная доставка
+    """
+    claimed = await add_value(f'update:{update_id}', 1, ttl)
+    if claimed is None:
+        logger.warning(f"Не удалось проверить повторную доставку обновления {update_id}, обрабатываем его")
+        return True
+    return claimed
+
+async def release_update(update_id: int) -> bool:
+    """
+    Снимает отметку об обработке, чтобы повторная доставка обновления была обработана
+    
+    :param update_id: Идентификатор обновления
+    :return: True если успешно, иначе False
+    """
+    return await delete_value(f'update:{update_id}')
+
+def article_state_key(parser) -> str:
+    """Ключ снимка состояния источника (у источника по умолчанию - прежний ARTICLE_STATE_KEY)"""
+    name = os.path.splitext(os.path.basename(parser.snapshot_file))[0]
+    return ARTICLE_STATE_KEY if name == 'last_articles' else f'{ARTICLE_STATE_KEY}:{name}'
+
+async def restore_article_state(parser) -> bool:
+    """
+    Загружает снимок состояния статей из хранилища, если он новее состояния парсера
+    
+    Без Vercel KV (USE_KV) состояние хранится только в файле снимка, и хранилище не используется.
+    
+    :param parser: Источник статей (SitemapParser)
+    :return: True если состояние заменено снимком из хранилища
+    """
+    if not USE_KV:
+        return False
+    data = await get_value(article_state_key(parser))
+    if not data:
         return False
+    try:
+        return parser.import_state(base64.b64decode(data))
+    except Exception as e:
+        logger.error(f"Ошибка загрузки снимка состояния статей из хранилища: {e}")
+        return False
+
+async def save_article_state(parser, previous_saved_at: int, lease: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Сохраняет снимок состояния статей в хранилище, если состояние изменилось
+    
+    :param parser: Источник статей (SitemapParser)
+    :param previous_saved_at: Время сохранения состояния до сбора статей (state.saved_at)
+    :param lease: Аренда источника: снимок записывается, только если она все еще принадлежит владельцу
+    :return: False если снимок не удалось записать (в том числе из-за утраченной аренды), иначе True
+    """
+    if not USE_KV or parser.last_articles.saved_at == previous_saved_at:
+        return True
+    data = base64.b64encode(parser.export_state()).decode('ascii')
+    if lease is not None:
+        return await set_value_fenced(article_state_key(parser), data, lease)
+    return await set_value(article_state_key(parser), data)
+
+async def restore_breakers(registry) -> bool:
+    """
+    Загружает состояние размыкателей цепей из хранилища
+    
+    Без Vercel KV (USE_KV) состояние хранится только в файле BREAKER_STATE_FILE.
+    
+    :param registry: Размыкатели цепей (BreakerRegistry)
+    :return: True если состояние загружено
+    """
+    if not USE_KV:
+        return False
+    try:
+        kv = _get_vercel_kv_api()
+        if not kv:
+            return False
+        fields = await kv.eval(_BREAKERS_LOAD_SCRIPT, keys=[BREAKERS_KEY], args=[]) or []
+        registry.import_state({host: json.loads(data) for host, data in zip(fields[::2], fields[1::2])})
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка загрузки состояния размыкателей цепей из хранилища: {e}")
+        return False
+
+async def save_breakers(registry) -> bool:
+    """
+    Сохраняет в хранилище цепи, изменившиеся после прошлого сохранения
+    
+    :param registry: Размыкатели цепей (BreakerRegistry)
+    :return: False если состояние не удалось записать, иначе True
+    """
+    if not USE_KV:
+        return True
+    changes = registry.export_changes()
+    if not changes:
+        return True
+    args = []
+    for host, data in changes.items():
+        args.extend([host, json.dumps(data) if data else ''])
+    try:
+        kv = _get_vercel_kv_api()
+        if not kv:
+            return False
+        await kv.eval(_BREAKERS_SAVE_SCRIPT, keys=[BREAKERS_KEY], args=args)
+        return True
+    except Exception as e:
+        logger.error(f"Ошибка сохранения состояния размыкателей цепей в хранилище: {e}")
+        return False
+
+def _lease_value(lease: Dict[str, Any]) -> str:
+    """Значение ключа аренды: по нему владелец узнает свою аренду при атомарных проверках"""
+    return json.dumps({'name': lease['name'], 'owner': lease['owner'], 'token': lease['token']})
+
+def _memory_owns(lease: Dict[str, Any]) -> bool:
+    key = f"lease:{lease['name']}"
+    return key in _memory_cache and not _memory_expired(key) and _memory_cache[key] == _lease_value(lease)
+
+async def acquire_lease(name: str, ttl: int = LEASE_TTL, owner: str = NODE_ID) -> Optional[Dict[str, Any]]:
+    """
+    Берет аренду (распределенную блокировку) с ограниченным сроком
+    
+    Аренда - ключ lease:<имя>, созданный одной атомарной операцией SET NX PX. Каждая попытка
+    получает токен ограждения из счетчика lease:<имя>:fence (INCR), поэтому токены уникальны
+    и растут от аренды к аренде. Записи, которые защищает аренда, выполняются через
+    set_value_fenced: узел, у которого аренда истекла, не перезапишет результат нового владельца.
+    
+    :param name: Имя аренды
+    :param ttl: Срок аренды в секундах
+    :param owner: Идентификатор владельца
+    :return: Аренда {'name', 'owner', 'token', 'expires_at'} или None, если аренда уже занята
+    """
+    key = f'lease:{name}'
+    if await get_value(key):
+        return None
+    token = await incr_value(f'{key}:fence')
+    if token is None:
+        return None
+    
+    lease = {'name': name, 'owner': owner, 'token': token}
+    if not await add_value(key, lease, ttl):
+        return None
+    lease['expires_at'] = time.time() + ttl
+    return lease
+
+async def check_lease(lease: Dict[str, Any]) -> bool:
+    """
+    Проверяет, что аренда все еще принадлежит владельцу (токен не сменился и срок не истек)
+    
+    Результат может устареть сразу после проверки, поэтому защищенные записи выполняются
+    через set_value_fenced, а не после check_lease.
+    
+    :param lease: Аренда из acquire_lease
+    :return: True если аренда действительна
+    """
+    current = await get_value(f"lease:{lease['name']}")
+    return bool(current) and current['token'] == lease['token']
+
+async def _lease_eval(script: str, lease: Dict[str, Any], keys: list, args: list, memory_action) -> bool:
+    """
+    Выполняет действие, только если аренда принадлежит владельцу, одной атомарной операцией
+    
+    :param script: Скрипт Lua для Vercel KV (KEYS[1] - ключ аренды, ARGV[1] - ее значение)
+    :param lease: Аренда из acquire_lease
+    :param keys: Остальные ключи скрипта
+    :param args: Остальные аргументы скрипта
+    :param memory_action: То же действие для кеша в памяти (вызывается под блокировкой)
+    :return: True если аренда принадлежала владельцу и действие выполнено
+    """
+    try:
+        if USE_KV:
+            kv = _get_vercel_kv_api()
+            if kv:
+                result = await kv.eval(script, keys=[f"lease:{lease['name']}", *keys],
+                                       args=[_lease_value(lease), *args])
+                return bool(result)
+        
+        # Если не на Vercel или не удалось инициализировать KV, используем кеш в памяти
+        with _memory_lock:
+            if not _memory_owns(lease):
+                return False
+            memory_action()
+            return True
+    except Exception as e:
+        logger.error(f"Ошибка при проверке аренды {lease['name']}: {e}")
+        return False
+
+async def set_value_fenced(key: str, value: Any, lease: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+    """
+    Сохраняет значение, только если аренда все еще принадлежит владельцу (проверка и запись атомарны)
+    
+    :param key: Ключ
+    :param value: Значение (будет преобразовано в JSON)
+    :param lease: Аренда из acquire_lease
+    :param ttl: Срок жизни значения в секундах (по умолчанию бессрочно)
+    :return: True если значение сохранено, False если аренда утрачена или произошла ошибка
+    """
+    json_value = json.dumps(value)
+    return await _lease_eval(
+        _FENCED_SET_SCRIPT, lease, [key], [json_value, str(int(ttl * 1000)) if ttl else '0'],
+        lambda: _memory_set(key, json_value, ttl)
+    )
+
+async def renew_lease(lease: Dict[str, Any], ttl: int = LEASE_TTL) -> bool:
+    """
+    Продлевает аренду, если она еще принадлежит владельцу (проверка и продление атомарны)
+    
+    :param lease: Аренда из acquire_lease (expires_at обновляется)
+    :param ttl: Новый срок аренды в секундах
+    :return: True если аренда продлена
+    """
+    key = f"lease:{lease['name']}"
+    
+    def extend():
+        _memory_expiry[key] = time.monotonic() + ttl
+    
+    if not await _lease_eval(_RENEW_LEASE_SCRIPT, lease, [], [str(int(ttl * 1000))], extend):
+        return False
+    lease['expires_at'] = time.time() + ttl
+    return True
+
+async def release_lease(lease: Dict[str, Any]) -> bool:
+    """
+    Освобождает аренду, если она еще принадлежит владельцу (проверка и удаление атомарны)
+    
+    :param lease: Аренда из acquire_lease
+    :return: True если аренда освобождена
+    """
+    key = f"lease:{lease['name']}"
+    
+    def remove():
+        _memory_cache.pop(key, None)
+        _memory_expiry.pop(key, None)
+    
+    return await _lease_eval(_RELEASE_LEASE_SCRIPT, lease, [], [], remove)
+
+async def get_lease(name: str) -> Optional[Dict[str, Any]]:
+    """
+    Получает текущую аренду
+    
+    :param name: Имя аренды
+    :return: Аренда или None, если она свободна
+    """
+    return await get_value(f'lease:{name}')
+
+async def heartbeat(node_id: str, ttl: int) -> bool:
+    """
+    Отмечает процесс живым на ttl секунд и добавляет его в список участников
+    
+    :param node_id: Идентификатор процесса
+    :param ttl: Через сколько секунд без повторной отметки процесс считается выбывшим
+    :return: True если успешно
+    """
+    if not await set_value(f'member:{node_id}', time.time(), ttl):
+        return False
+    members = await get_value(MEMBERS_KEY, []) or []
+    if node_id in members:
+        return True
+    members.append(node_id)
+    return await set_value(MEMBERS_KEY, members)
+
+async def leave(node_id: str) -> bool:
+    """
+    Удаляет процесс из участников (при штатной остановке, не дожидаясь истечения отметки)
+    
+    :param node_id: Идентификатор процесса
+    :return: True если успешно
+    """
+    await delete_value(f'member:{node_id}')
+    members = await get_value(MEMBERS_KEY, []) or []
+    if node_id not in members:
+        return True
+    members.remove(node_id)
+    return await set_value(MEMBERS_KEY, members)
+
+async def get_members() -> list:
+    """
+    Получает живых участников; выбывшие (отметка истекла) удаляются из списка
+    
+    :return: Отсортированный список идентификаторов процессов
+    """
+    members = await get_value(MEMBERS_KEY, []) or []
+    alive = [node_id for node_id in members if await get_value(f'member:{node_id}') is not None]
+    if len(alive) != len(members):
+        await set_value(MEMBERS_KEY, alive)
+    return sorted(alive)
+
+def _memory_subscriptions() -> Dict[str, list]:
+    """Подписки из кеша в памяти (вызывается под _memory_lock)"""
+    if SUBSCRIPTIONS_KEY in _memory_cache and not _memory_expired(SUBSCRIPTIONS_KEY):
+        return json.loads(_memory_cache[SUBSCRIPTIONS_KEY])
+    return {}
+
+def _memory_subscribe(chat_id: str, source_id: str, limit: int, total_limit: int, seed: bool) -> int:
+    """То же, что _SUBSCRIBE_SCRIPT, для кеша в памяти (вызывается под _memory_lock)"""
+    if seed and SUBSCRIPTIONS_KEY in _memory_cache and not _memory_expired(SUBSCRIPTIONS_KEY):
+        return 0
+    subscriptions = _memory_subscriptions()
+    sources = subscriptions.setdefault(chat_id, [])
+    if source_id in sources:
+        return 0
+    if 0 <= limit <= len(sources):
+        return -1
+    if total_limit >= 0:
+        known = {known_id for source_ids in subscriptions.values() for known_id in source_ids}
+        if source_id not in known and len(known) >= total_limit:
+            return -2
+    sources.append(source_id)
+    _memory_set(SUBSCRIPTIONS_KEY, json.dumps(subscriptions), None)
+    return 1
+
+def _memory_unsubscribe(chat_id: str, source_id: Optional[str]) -> int:
+    """То же, что _UNSUBSCRIBE_SCRIPT, для кеша в памяти (вызывается под _memory_lock)"""
+    subscriptions = _memory_subscriptions()
+    sources = subscriptions.get(chat_id)
+    if not sources or (source_id and source_id not in sources):
+        return 0
+    if not source_id or len(sources) == 1:
+        del subscriptions[chat_id]
+    else:
+        sources.remove(source_id)
+    _memory_set(SUBSCRIPTIONS_KEY, json.dumps(subscriptions), None)
+    return 1
+
+async def _change_subscriptions(script: str, args: list, memory_action) -> Optional[int]:
+    """
+    Изменяет подписки одной атомарной операцией
+    
+    :param script: Скрипт Lua для Vercel KV (ключи - _SUBSCRIPTION_KEYS)
+    :param args: Аргументы скрипта
+    :param memory_action: То же изменение для кеша в памяти (вызывается под блокировкой)
+    :return: Результат скрипта или None, если произошла ошибка
+    """
+    try:
+        if USE_KV:
+            kv = _get_vercel_kv_api()
+            if kv:
+                return int(await kv.eval(script, keys=_SUBSCRIPTION_KEYS, args=args))
+        
+        # Если не на Vercel или не удалось инициализировать KV, используем кеш в памяти
+        with _memory_lock:
+            return memory_action()
+    except Exception as e:
+        logger.error(f"Ошибка при изменении подписок: {e}")
+        return None
+
+async def get_subscriptions() -> Dict[str, list]:
+    """
+    Получает подписки всех чатов
+    
+    :return: Словарь {ID чата (строка): [идентификаторы источников]}
+    """
+    try:
+        if USE_KV:
+            kv = _get_vercel_kv_api()
+            if kv:
+                fields = await kv.eval(_SUBSCRIPTIONS_SCRIPT, keys=_SUBSCRIPTION_KEYS, args=[]) or []
+                return {
+                    str(chat_id): json.loads(sources)
+                    for chat_id, sources in zip(fields[::2], fields[1::2])
+                }
+        
+        # Если не на Vercel или не удалось инициализировать KV, используем кеш в памяти
+        with _memory_lock:
+            return _memory_subscriptions()
+    except Exception as e:
+        logger.error(f"Ошибка при получении подписок: {e}")
+        return {}
+
+async def get_chat_sources(chat_id: int) -> list:
+    """
+    Получает источники, на которые подписан чат
+    
+    :param chat_id: ID чата
+    :return: Список идентификаторов источников
+    """
+    return (await get_subscriptions()).get(str(chat_id), [])
+
+async def subscribe(chat_id: int, source_id: str, limit: Optional[int] = None,
+                    total_limit: Optional[int] = None) -> bool:
+    """
+    Подписывает чат на источник (проверка лимитов и запись атомарны)
+    
+    :param chat_id: ID чата
+    :param source_id: Идентификатор источника
+    :param limit: Максимальное число источников чата
+    :param total_limit: Максимальное число разных источников у всех чатов
+    :return: True если подписка добавлена, False если она уже есть, превышен лимит или произошла ошибка
+    """
+    limit = -1 if limit is None else limit
+    total_limit = -1 if total_limit is None else total_limit
+    result = await _change_subscriptions(
+        _SUBSCRIBE_SCRIPT, [str(chat_id), source_id, str(limit), str(total_limit), '0'],
+        lambda: _memory_subscribe(str(chat_id), source_id, limit, total_limit, seed=False)
+    )
+    return result == 1
+
+async def unsubscribe(chat_id: int, source_id: Optional[str] = None) -> bool:
+    """
+    Отписывает чат от источника или от всех источников (атомарно)
+    
+    :param chat_id: ID чата
+    :param source_id: Идентификатор источника (None - все источники)
+    :return: True если подписка была и удалена
+    """
+    result = await _change_subscriptions(
+        _UNSUBSCRIBE_SCRIPT, [str(chat_id), source_id or ''],
+        lambda: _memory_unsubscribe(str(chat_id), source_id)
+    )
+    return result == 1
+
+async def seed_subscription(chat_id: int, source_id: str) -> bool:
+    """
+    Подписывает чат из DIGEST_CHAT_ID на источник по умолчанию, если подписки еще не создавались
+    
+    :param chat_id: ID чата
+    :param source_id: Идентификатор источника
+    :return: True если подписки созданы
+    """
+    result = await _change_subscriptions(
+        _SUBSCRIBE_SCRIPT, [str(chat_id), source_id, '-1', '-1', '1'],
+        lambda: _memory_subscribe(str(chat_id), source_id, -1, -1, seed=True)
+    )
+    return result == 1
 
 async def get_value(key: str, default: Any = None) -> Any:
     """
@@ -71,7 +890,7 @@ async def get_value(key: str, default: Any = None) -> Any:
     :return: Значение или default, если ключ не найден
     """
     try:
-        if IS_VERCEL:
+        if USE_KV:
             kv = _get_vercel_kv_api()
             if kv:
                 value = await kv.get(key)
@@ -80,7 +899,7 @@ async def get_value(key: str, default: Any = None) -> Any:
                 return default
         
         # Если не на Vercel или не удалось инициализировать KV, используем кеш в памяти
-        if key in _memory_cache:
+        if key in _memory_cache and not _memory_expired(key):
             return json.loads(_memory_cache[key])
         
         return default
@@ -96,7 +915,7 @@ async def delete_value(key: str) -> bool:
     :return: True если успешно, иначе False
     """
     try:
-        if IS_VERCEL:
+        if USE_KV:
             kv = _get_vercel_kv_api()
             if kv:
                 await kv.delete(key)
@@ -105,8 +924,12 @@ async def delete_value(key: str) -> bool:
         # Если не на Vercel или не удалось инициализировать KV, используем кеш в памяти
         if key in _memory_cache:
             del _memory_cache[key]
+            if _memory_expiry.pop(key, None) is None:
+                _save_memory_file()
         
         return True
     except Exception as e:
         logger.error(f"Ошибка при удалении значения для ключа {key}: {e}")
-        return False 
\ No newline at end of file
+        return False 
+
+_load_memory_file()
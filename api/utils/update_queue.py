@@ -0,0 +1,198 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from api.utils.storage import (
+    LEASE_TTL, USE_KV, acquire_lease, queue_length, queue_pop, queue_push, release_lease, renew_lease
+)
+
+logger = logging.getLogger(__name__)
+
+# Бессерверная платформа: после ответа экземпляр функции может быть заморожен вместе с фоновым потоком
+IS_SERVERLESS = os.environ.get('VERCEL', '0') == '1'
+# Режим "сначала ответить": webhook ставит обновление в очередь и сразу отвечает Telegram.
+# В долгоживущем процессе очередь разбирает фоновый поток, а на бессерверной платформе очередь
+# хранится в Vercel KV и ее разбирает повторный вызов webhook (DRAIN_PATH)
+WEBHOOK_ACK_MODE = os.environ.get('WEBHOOK_ACK_MODE', '0') == '1'
+# Очередь в хранилище: без Vercel KV очередь в памяти не видна другим экземплярам функции
+KV_QUEUE_MODE = WEBHOOK_ACK_MODE and IS_SERVERLESS and USE_KV
+
+if WEBHOOK_ACK_MODE and IS_SERVERLESS and not USE_KV:
+    logger.warning("WEBHOOK_ACK_MODE на Vercel требует Vercel KV: обновления обрабатываются до ответа Telegram")
+# Максимальная длина очереди обновлений; при переполнении webhook отвечает 503
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '100'))
+# Через сколько секунд Telegram стоит повторить доставку при переполнении очереди
+WEBHOOK_RETRY_AFTER = int(os.environ.get('WEBHOOK_RETRY_AFTER', '5'))
+# Сколько секунд один вызов разбирает очередь в хранилище (меньше maxDuration функции Vercel)
+WEBHOOK_DRAIN_BUDGET = float(os.environ.get('WEBHOOK_DRAIN_BUDGET', '25'))
+# Полный адрес повторного вызова; по умолчанию строится из заголовка Host запроса Telegram
+WEBHOOK_DRAIN_URL = os.environ.get('WEBHOOK_DRAIN_URL')
+# Секрет повторного вызова; по умолчанию выводится из токена бота
+WEBHOOK_DRAIN_TOKEN = os.environ.get('WEBHOOK_DRAIN_TOKEN') or hashlib.sha256(
+    f"drain:{os.environ.get('TELEGRAM_BOT_TOKEN', '')}".encode('utf-8')
+).hexdigest()
+
+# Путь и заголовок повторного вызова webhook, который разбирает очередь в хранилище
+DRAIN_PATH = '/api/webhook/drain'
+DRAIN_HEADER = 'X-Drain-Token'
+# Ключ очереди обновлений в хранилище и имя аренды ее разбора (очередь разбирает один вызов за раз)
+UPDATE_QUEUE_KEY = 'queue:updates'
+DRAIN_LEASE = 'webhook:drain'
+
+
+class UpdateQueue:
+    def __init__(self, process: Callable[[Dict[str, Any]], Awaitable[None]], maxsize: int = WEBHOOK_QUEUE_SIZE):
+        """
+        Ограниченная очередь обновлений с фоновым обработчиком
+
+        Обработчик работает в отдельном потоке со своим циклом событий и обрабатывает
+        обновления по одному в порядке поступления. Поток запускается при первой постановке в очередь.
+
+        :param process: Асинхронная функция обработки обновления
+        :param maxsize: Максимальная длина очереди
+        """
+        self._process = process
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='update-queue', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        while True:
+            update_data = self._queue.get()
+            try:
+                loop.run_until_complete(self._process(update_data))
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Ошибка фоновой обработки обновления {update_data.get('update_id')}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def submit(self, update_data: Dict[str, Any]) -> bool:
+        """
+        Поставить обновление в очередь без ожидания
+
+        :param update_data: Обновление Telegram в виде словаря
+        :return: True, если обновление принято, False - если очередь переполнена
+        """
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(update_data)
+            return True
+        except queue.Full:
+            self.rejected += 1
+            logger.warning(f"Очередь обновлений переполнена ({self._queue.maxsize}), обновление отклонено")
+            return False
+
+    def join(self):
+        """Дождаться обработки всех обновлений в очереди"""
+        self._queue.join()
+
+    def stats(self) -> Dict[str, int]:
+        """Состояние очереди для метрик"""
+        return {
+            'depth': self._queue.qsize(),
+            'max_depth': self._queue.maxsize,
+            'processed': self.processed,
+            'failed': self.failed,
+            'rejected': self.rejected,
+        }
+
+
+async def enqueue_update(update_data: Dict[str, Any]) -> Optional[bool]:
+    """
+    Поставить обновление в очередь в хранилище
+
+    :param update_data: Обновление Telegram в виде словаря
+    :return: True, если обновление принято, False - если очередь переполнена, None - если хранилище недоступно
+    """
+    accepted = await queue_push(UPDATE_QUEUE_KEY, update_data, WEBHOOK_QUEUE_SIZE)
+    if accepted is False:
+        logger.warning(f"Очередь обновлений в хранилище переполнена ({WEBHOOK_QUEUE_SIZE}), обновление отклонено")
+    return accepted
+
+
+async def drain_updates(process: Callable[[Dict[str, Any]], Awaitable[None]],
+                        budget: float = WEBHOOK_DRAIN_BUDGET) -> Tuple[int, bool]:
+    """
+    Обработать обновления из очереди в хранилище в порядке поступления
+
+    Очередь разбирает один вызов за раз (аренда DRAIN_LEASE). Освободив аренду, вызов еще раз
+    проверяет очередь: обновление, поставленное, пока аренда была занята, не останется без обработки.
+
+    :param process: Асинхронная функция обработки обновления
+    :param budget: Сколько секунд разбирать очередь
+    :return: Кортеж (число обработанных обновлений, остались ли обновления после истечения budget)
+    """
+    deadline = time.monotonic() + budget
+    processed = 0
+    while True:
+        lease = await acquire_lease(DRAIN_LEASE, LEASE_TTL)
+        if lease is None:
+            # Очередь разбирает другой вызов; он проверит ее еще раз после освобождения аренды
+            return processed, False
+        try:
+            while time.monotonic() < deadline:
+                update_data = await queue_pop(UPDATE_QUEUE_KEY)
+                if update_data is None:
+                    break
+                try:
+                    await process(update_data)
+                    processed += 1
+                except Exception as e:
+                    logger.error(f"Ошибка обработки обновления {update_data.get('update_id')} из очереди: {e}")
+                await renew_lease(lease, LEASE_TTL)
+        finally:
+            await release_lease(lease)
+
+        if not await queue_length(UPDATE_QUEUE_KEY):
+            return processed, False
+        if time.monotonic() >= deadline:
+            return processed, True
+
+
+def request_drain(host: Optional[str]) -> bool:
+    """
+    Запустить повторный вызов webhook, который разберет очередь, не дожидаясь его завершения
+
+    Запрос считается отправленным, если соединение установлено и истекло только ожидание ответа.
+
+    :param host: Заголовок Host запроса Telegram (если WEBHOOK_DRAIN_URL не задан)
+    :return: True, если повторный вызов запущен
+    """
+    import requests
+
+    url = WEBHOOK_DRAIN_URL or (f'https://{host}{DRAIN_PATH}' if host else None)
+    if not url:
+        logger.error("Не удалось определить адрес повторного вызова webhook")
+        return False
+    try:
+        requests.post(url, json={}, headers={DRAIN_HEADER: WEBHOOK_DRAIN_TOKEN}, timeout=(3, 1))
+    except requests.exceptions.ReadTimeout:
+        return True
+    except requests.RequestException as e:
+        logger.error(f"Не удалось запустить повторный вызов webhook {url}: {e}")
+        return False
+    return True
+
+
+def check_drain_token(value: Optional[str]) -> bool:
+    """Проверить секрет повторного вызова webhook"""
+    return bool(value) and hmac.compare_digest(value, WEBHOOK_DRAIN_TOKEN)
@@ -1,26 +1,44 @@
+from __future__ import annotations
+
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
 from http.server import BaseHTTPRequestHandler
 import json
 import logging
 import os
 import sys
-from urllib.parse import parse_qs
+from contextlib import nullcontext
+from datetime import datetime
+from typing import TYPE_CHECKING
+from urllib.parse import parse_qs, urlparse
 
 # Добавляем корневую директорию проекта в путь для импорта
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from telegram import Update
-from telegram.ext import (
-    Application,
-    CommandHandler,
-    MessageHandler,
-    filters,
-    CallbackContext,
-    CallbackQueryHandler,
-    ContextTypes
+# Модули telegram, парсеры источников, поисковый индекс и архив статей импортируются лениво внутри
+# обработчиков, чтобы не замедлять холодный старт; аннотации типов не вычисляются благодаря
+# `from __future__ import annotations`, а имена для них импортируются только при проверке типов
+from src.config import TOKEN, SOURCE_TYPE, SITEMAP_URL, FEED_URL, DIGEST_CHAT_ID, MAX_ARTICLES_IN_DIGEST, DIGEST_INTERVAL_HOURS, ADMIN_ID
+from src.metrics import METRICS_HEADER, metrics_authorized, registry as metrics_registry, track_run
+from src.digest_renderer import render_digest_chunks, send_digest_chunks
+from src.rate_limit import rate_limiter, format_retry_message
+from src.resilience import breakers
+from src.profiling import PROFILE_HEADER, profile, should_profile
+from src.startup import import_report, record_import
+from api.utils.storage import (
+    claim_update, queue_length, release_update, set_value,
+    get_chat_sources, get_subscriptions, subscribe, unsubscribe
+)
+from api.utils.update_queue import (
+    DRAIN_HEADER, KV_QUEUE_MODE, UPDATE_QUEUE_KEY, UpdateQueue, WEBHOOK_ACK_MODE, WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_RETRY_AFTER, check_drain_token, drain_updates, enqueue_update, request_drain
 )
 
-from src.config import TOKEN, SITEMAP_URL, DIGEST_CHAT_ID, MAX_ARTICLES_IN_DIGEST, DIGEST_INTERVAL_HOURS, ADMIN_ID
-from src.sitemap_parser import SitemapParser
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import ContextTypes
 
 # Настройка логирования
 logging.basicConfig(
@@ -30,7 +48,20 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # Глобальные переменные
-sitemap_parser = SitemapParser(SITEMAP_URL)
+sitemap_parser = None
+# Последний собранный дайджест (показывается при превышении лимита запросов)
+last_digest = {'articles': None, 'time': None}
+
+# Ключ хранилища для последнего отчета профилирования
+PROFILE_STORAGE_KEY = 'profile:last'
+
+def get_sitemap_parser():
+    """Парсер источника по умолчанию (создается при первом обращении)"""
+    global sitemap_parser
+    if sitemap_parser is None:
+        from src.sources import create_parser
+        sitemap_parser = create_parser(SOURCE_TYPE, SITEMAP_URL, FEED_URL)
+    return sitemap_parser
 
 # Обработчики команд
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -70,37 +101,57 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         '🔹 /start - запустить бота\n'
         '🔹 /help - показать это сообщение\n'
         '🔹 /digest - получить свежий дайджест\n'
+        '🔹 /digest 6h или /digest since 2025-04-27 - статьи за период\n'
         '🔹 /status - проверить статус бота\n'
         '🔹 /settings - настройки уведомлений\n'
-        f'🔹 /setchat - установить чат для дайджеста (только для админа)\n\n'
+        '🔹 /subscribe <URL> - подписать чат на sitemap (feed <URL> - на ленту)\n'
+        '🔹 /unsubscribe <URL|all> - отписать чат от источника\n'
+        '🔹 /sources - подписки чата\n'
+        '🔹 /search <запрос> - найти собранные статьи\n'
+        f'🔹 /setchat - установить чат для дайджеста (только для админа)\n'
+        f'🔹 /profile - профилировать сбор дайджеста (только для админа)\n\n'
         f'⏰ Автоматическая отправка дайджеста: каждые {DIGEST_INTERVAL_HOURS} часов\n'
         f'📊 Максимум статей в дайджесте: {MAX_ARTICLES_IN_DIGEST}',
         reply_markup=reply_markup
     )
 
-async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /digest"""
-    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+async def deliver_digest(edit_text, send_message):
+    """
+    Собрать свежий дайджест и показать его, отредактировав сообщение о прогрессе
     
-    progress_message = await update.message.reply_text('🔄 Собираю свежие новости... Пожалуйста, подождите.')
+    Если дайджест не помещается в одно сообщение, остальные части отправляются новыми сообщениями.
     
-    try:
-        articles = sitemap_parser.parse_sitemap()
+    :param edit_text: Функция редактирования сообщения (message.edit_text или query.edit_message_text)
+    :param send_message: Функция отправки нового сообщения в тот же чат
+    """
+    from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+    from src.digest_lease import collect_exclusive
+    
+    parser = get_sitemap_parser()
+    with track_run('interactive'):
+        # Источник собирает только один процесс; если сбор уже идет, используется его результат
+        articles = await collect_exclusive(parser)
+        if articles is None:
+            await edit_text('⏳ Дайджест сейчас собирает другой процесс. Попробуйте через минуту.')
+            return
+        
+        if articles:
+            # Запоминаем дайджест, чтобы показать его вместо нового сбора при превышении лимита запросов
+            last_digest['articles'] = articles
+            last_digest['time'] = datetime.now()
         
         if not articles:
             keyboard = [
                 [InlineKeyboardButton("🔄 Проверить снова", callback_data="check_now")]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await progress_message.edit_text(
+            await edit_text(
                 '📭 Новых статей пока нет.\n'
                 'Попробуйте проверить позже.',
                 reply_markup=reply_markup
             )
             return
         
-        digest_text = sitemap_parser.format_digest(articles, MAX_ARTICLES_IN_DIGEST)
-        
         keyboard = [
             [
                 InlineKeyboardButton("🔄 Обновить", callback_data="check_now"),
@@ -109,12 +160,76 @@ async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await progress_message.edit_text(
-            f'📰 Свежий дайджест:\n\n{digest_text}',
-            parse_mode='Markdown',
-            disable_web_page_preview=True,
-            reply_markup=reply_markup
+        chunks = parser.iter_digest_chunks(
+            articles, MAX_ARTICLES_IN_DIGEST, header='📰 Свежий дайджест:'
         )
+        await send_digest_chunks(chunks, send_message, edit_first=edit_text, reply_markup=reply_markup)
+
+async def deliver_cached_digest(edit_text, send_message, retry_after):
+    """
+    Ответить на запрос дайджеста сверх лимита без нового сбора статей
+    
+    Показывается последний собранный дайджест, а если его нет - сообщение о лимите.
+    
+    :param edit_text: Функция для первого сообщения (редактирование или ответ)
+    :param send_message: Функция отправки нового сообщения в тот же чат
+    :param retry_after: Через сколько секунд можно запросить новый дайджест
+    """
+    if not last_digest['articles']:
+        await edit_text(format_retry_message(retry_after))
+        return
+    
+    parser = get_sitemap_parser()
+    header = f"📦 Последний дайджест ({last_digest['time'].strftime('%H:%M')}). {format_retry_message(retry_after)}"
+    chunks = parser.iter_digest_chunks(last_digest['articles'], MAX_ARTICLES_IN_DIGEST, header=header)
+    await send_digest_chunks(chunks, send_message, edit_first=edit_text)
+
+async def deliver_range_digest(update: Update, args):
+    """Показать статьи за период из архива (/digest 6h, /digest since 2025-04-27) без нового сбора"""
+    import asyncio
+    from src.article_archive import ARCHIVE_ENABLED, article_archive, parse_window
+    
+    if not ARCHIVE_ENABLED:
+        await update.message.reply_text(
+            '📭 Архив статей отключен. На Vercel архив теряется при холодном старте, '
+            'поэтому дайджест за период работает в боте, запущенном как worker (Procfile)'
+        )
+        return
+    
+    since, label = parse_window(args)
+    if since is None:
+        await update.message.reply_text(label)
+        return
+    
+    articles, truncated = await asyncio.to_thread(article_archive.window, since)
+    if not articles:
+        await update.message.reply_text(f'📭 В архиве нет статей {label}')
+        return
+    
+    # Период длиннее ARCHIVE_MAX_RESULTS статей: показаны только самые новые, и об этом нужно сказать
+    header = f'Показаны последние {len(articles)} статей периода, уточните период' if truncated else None
+    chunks = render_digest_chunks(articles, len(articles), header=header, title=f'Дайджест {label}')
+    await send_digest_chunks(chunks, update.effective_chat.send_message)
+
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /digest (с периодом - статьи за период из архива)"""
+    if context.args:
+        retry_after = await rate_limiter.acquire(update.effective_user.id, 'digest_range')
+        if retry_after:
+            await update.message.reply_text(format_retry_message(retry_after))
+        else:
+            await deliver_range_digest(update, context.args)
+        return
+    
+    retry_after = await rate_limiter.acquire(update.effective_user.id, 'digest')
+    if retry_after:
+        await deliver_cached_digest(update.message.reply_text, update.effective_chat.send_message, retry_after)
+        return
+    
+    progress_message = await update.message.reply_text('🔄 Собираю свежие новости... Пожалуйста, подождите.')
+    
+    try:
+        await deliver_digest(progress_message.edit_text, update.effective_chat.send_message)
     except Exception as e:
         logger.error(f"Ошибка при формировании дайджеста: {e}")
         await progress_message.edit_text(
@@ -125,13 +240,15 @@ async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /status"""
     try:
-        chat_id = os.getenv('DIGEST_CHAT_ID', 'Не установлен')
+        subscriptions = await get_subscriptions()
+        sources_count = len({source_id for source_ids in subscriptions.values() for source_id in source_ids})
         await update.message.reply_text(
             '📊 Статус бота:\n\n'
-            f'🔹 Мониторинг: {SITEMAP_URL}\n'
+            f'🔹 Мониторинг: {get_sitemap_parser().source_url}\n'
             f'🔹 Интервал проверки: {DIGEST_INTERVAL_HOURS} часов\n'
-            f'🔹 Чат для дайджеста: {chat_id}\n'
-            f'🔹 Максимум статей: {MAX_ARTICLES_IN_DIGEST}'
+            f'🔹 Подписано чатов: {len(subscriptions)}, источников: {sources_count}\n'
+            f'🔹 Максимум статей: {MAX_ARTICLES_IN_DIGEST}\n\n'
+            f'⏱ Метрики дайджеста:\n{metrics_registry.format_status()}'
         )
     except Exception as e:
         logger.error(f"Ошибка при получении статуса: {e}")
@@ -156,12 +273,15 @@ async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def setchat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /setchat"""
+    from src.subscriptions import DEFAULT_SOURCE
+    
     if ADMIN_ID and str(update.effective_user.id) != ADMIN_ID:
         await update.message.reply_text('⛔️ У вас нет прав для выполнения этой команды')
         return
     
+    # Подписка хранится в хранилище: переменные окружения не переживают холодный старт
     chat_id = update.effective_chat.id
-    os.environ['DIGEST_CHAT_ID'] = str(chat_id)
+    await subscribe(chat_id, DEFAULT_SOURCE)
     
     await update.message.reply_text(
         f'✅ Чат успешно установлен\n\n'
@@ -169,6 +289,122 @@ async def setchat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f'🔹 Дайджесты будут отправляться сюда каждые {DIGEST_INTERVAL_HOURS} часов'
     )
 
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /subscribe: подписать чат на источник"""
+    from src.subscriptions import (
+        MAX_SOURCES_PER_CHAT, MAX_SOURCES_TOTAL, check_source_host, parse_subscribe_args, source_label
+    )
+    
+    source_id, error_text = parse_subscribe_args(context.args)
+    if error_text:
+        await update.message.reply_text(error_text)
+        return
+    
+    retry_after = await rate_limiter.acquire(update.effective_user.id, 'subscribe')
+    if retry_after:
+        await update.message.reply_text(format_retry_message(retry_after))
+        return
+    
+    # Источник загружает бот, поэтому адреса внутренней сети не принимаются
+    error_text = await check_source_host(source_id)
+    if error_text:
+        await update.message.reply_text(error_text)
+        return
+    
+    label = source_label(source_id, get_sitemap_parser().source_url)
+    if await subscribe(update.effective_chat.id, source_id, MAX_SOURCES_PER_CHAT, MAX_SOURCES_TOTAL):
+        await update.message.reply_text(
+            f'✅ Чат подписан на {label}\n'
+            f'🔹 Дайджест будет приходить каждые {DIGEST_INTERVAL_HOURS} часов'
+        )
+        return
+    
+    chat_sources = await get_chat_sources(update.effective_chat.id)
+    if source_id in chat_sources:
+        await update.message.reply_text(f'ℹ️ Чат уже подписан на {label}')
+    elif len(chat_sources) >= MAX_SOURCES_PER_CHAT:
+        await update.message.reply_text(f'❌ Не более {MAX_SOURCES_PER_CHAT} источников на чат')
+    else:
+        await update.message.reply_text(f'❌ Достигнут общий лимит источников ({MAX_SOURCES_TOTAL}), подписка невозможна')
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /unsubscribe: отписать чат от источника или от всех (all)"""
+    from src.subscriptions import parse_subscribe_args, source_label
+    
+    if context.args and context.args[0] == 'all':
+        source_id, error_text = None, None
+    else:
+        source_id, error_text = parse_subscribe_args(context.args, validate=False)
+    if error_text:
+        await update.message.reply_text(error_text)
+        return
+    
+    if await unsubscribe(update.effective_chat.id, source_id):
+        label = source_label(source_id, get_sitemap_parser().source_url) if source_id else 'все источники'
+        await update.message.reply_text(f'✅ Чат отписан: {label}')
+    else:
+        await update.message.reply_text('ℹ️ Чат не подписан на этот источник. Список подписок: /sources')
+
+async def sources_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /sources: подписки чата"""
+    from src.subscriptions import format_sources
+    
+    source_ids = await get_chat_sources(update.effective_chat.id)
+    await update.message.reply_text(format_sources(source_ids, get_sitemap_parser().source_url))
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /search: поиск по собранным статьям"""
+    import asyncio
+    from src.search_index import SEARCH_ENABLED, search_index
+    
+    if not SEARCH_ENABLED:
+        await update.message.reply_text(
+            '🔎 Поиск по статьям отключен. На Vercel индекс теряется при холодном старте, '
+            'поэтому поиск работает в боте, запущенном как worker (Procfile)'
+        )
+        return
+    
+    query = ' '.join(context.args or [])
+    if not query:
+        await update.message.reply_text('🔎 Укажите запрос: /search <слова из заголовка>')
+        return
+    
+    retry_after = await rate_limiter.acquire(update.effective_user.id, 'search')
+    if retry_after:
+        await update.message.reply_text(format_retry_message(retry_after))
+        return
+    
+    results = await asyncio.to_thread(search_index.search, query)
+    if not results:
+        await update.message.reply_text(f'🔎 По запросу «{query}» ничего не найдено')
+        return
+    
+    chunks = render_digest_chunks(results, len(results), title=f'Найдено по запросу «{query}»', footer=None)
+    await send_digest_chunks(chunks, update.effective_chat.send_message)
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /profile: собрать дайджест под профилировщиком (только для админа)"""
+    # Профилирование замедляет сбор и раскрывает внутренности бота, поэтому без ADMIN_ID команда недоступна
+    if not ADMIN_ID or str(update.effective_user.id) != ADMIN_ID:
+        await update.message.reply_text('⛔️ У вас нет прав для выполнения этой команды')
+        return
+    
+    retry_after = await rate_limiter.acquire(update.effective_user.id, 'profile')
+    if retry_after:
+        await update.message.reply_text(format_retry_message(retry_after))
+        return
+    
+    progress_message = await update.message.reply_text('🔬 Собираю дайджест с профилированием...')
+    
+    try:
+        with profile('digest') as report:
+            await deliver_digest(progress_message.edit_text, update.effective_chat.send_message)
+        await set_value(PROFILE_STORAGE_KEY, report.to_dict())
+        await update.message.reply_text(report.to_text(max_length=4000))
+    except Exception as e:
+        logger.error(f"Ошибка при профилировании дайджеста: {e}")
+        await update.message.reply_text('❌ Ошибка при профилировании дайджеста')
+
 # Обработчик для inline кнопок
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик нажатий inline кнопок"""
@@ -176,39 +412,15 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     if query.data == "check_now":
+        retry_after = await rate_limiter.acquire(update.effective_user.id, 'check_now')
+        if retry_after:
+            await deliver_cached_digest(query.edit_message_text, update.effective_chat.send_message, retry_after)
+            return
+        
         await query.edit_message_text("🔄 Собираю свежие новости... Пожалуйста, подождите.")
         
         try:
-            articles = sitemap_parser.parse_sitemap()
-            
-            if not articles:
-                keyboard = [
-                    [InlineKeyboardButton("🔄 Проверить снова", callback_data="check_now")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text(
-                    '📭 Новых статей пока нет.\n'
-                    'Попробуйте проверить позже.',
-                    reply_markup=reply_markup
-                )
-                return
-            
-            digest_text = sitemap_parser.format_digest(articles, MAX_ARTICLES_IN_DIGEST)
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("🔄 Обновить", callback_data="check_now"),
-                    InlineKeyboardButton("⚙️ Настройки", callback_data="settings")
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                f'📰 Свежий дайджест:\n\n{digest_text}',
-                parse_mode='Markdown',
-                disable_web_page_preview=True,
-                reply_markup=reply_markup
-            )
+            await deliver_digest(query.edit_message_text, update.effective_chat.send_message)
         except Exception as e:
             logger.error(f"Ошибка при обработке кнопки check_now: {e}")
             await query.edit_message_text(
@@ -260,13 +472,21 @@ async def error(update, context):
 # Инициализация бота
 def create_application():
     """Создание приложения бота"""
+    from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler, filters
+    
     application = Application.builder().token(TOKEN).build()
     
     # Добавляем обработчики команд
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("digest", digest_command))
+    application.add_handler(CommandHandler("status", status_command))
     application.add_handler(CommandHandler("setchat", setchat_command))
+    application.add_handler(CommandHandler("subscribe", subscribe_command))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    application.add_handler(CommandHandler("sources", sources_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("profile", profile_command))
     
     # Обработчик callback от inline кнопок
     application.add_handler(CallbackQueryHandler(button_callback))
@@ -279,24 +499,112 @@ def create_application():
     
     return application
 
-# Обработчик HTTP-запросов от Vercel
-class handler(BaseHTTPRequestHandler):
-    async def process_update(self, update_data):
+async def process_update(update_data):
+    """Обработать обновление Telegram, пропуская повторные доставки того же update_id"""
+    from telegram import Update
+    
+    update_id = update_data.get('update_id')
+    if update_id is not None and not await claim_update(update_id):
+        logger.info(f"Обновление {update_id} уже обработано, пропускаем повторную доставку")
+        return
+    
+    try:
         application = create_application()
         update = Update.de_json(update_data, application.bot)
         await application.process_update(update)
+    except Exception:
+        # Даем Telegram возможность доставить обновление повторно
+        if update_id is not None:
+            await release_update(update_id)
+        raise
+
+# Очередь для режима "сначала ответить" (WEBHOOK_ACK_MODE=1): долгий сбор дайджеста не задерживает
+# ответ webhook, поэтому Telegram не считает доставку неудачной и не присылает обновление повторно
+update_queue = UpdateQueue(process_update)
+
+# Обработчик HTTP-запросов от Vercel
+class handler(BaseHTTPRequestHandler):
+    async def process_update(self, update_data):
+        await process_update(update_data)
+    
+    def _send_json(self, status, payload, headers=None):
+        self.send_response(status)
+        self.send_header('Content-type', 'application/json')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(json.dumps(payload, ensure_ascii=False).encode('utf-8'))
+        
+    def _drain(self):
+        """Повторный вызов: разобрать очередь обновлений в хранилище"""
+        import asyncio
+        
+        if not check_drain_token(self.headers.get(DRAIN_HEADER)):
+            self._send_json(403, {"status": "forbidden"})
+            return
+        processed, remaining = asyncio.run(drain_updates(process_update))
+        # Время вызова истекло раньше, чем закончилась очередь: остаток разберет следующий вызов
+        if remaining:
+            request_drain(self.headers.get('Host'))
+        self._send_json(200, {"status": "drained", "processed": processed})
+    
+    def _enqueue(self, update_data):
+        """
+        Поставить обновление в очередь в хранилище и запустить ее разбор повторным вызовом
+        
+        :return: True, если ответ Telegram отправлен; False, если обновление нужно обработать сейчас
+        """
+        import asyncio
         
+        accepted = asyncio.run(enqueue_update(update_data))
+        if accepted is None:
+            return False
+        if not accepted:
+            self._send_json(503, {"status": "busy"}, headers={'Retry-After': str(WEBHOOK_RETRY_AFTER)})
+            return True
+        if not request_drain(self.headers.get('Host')):
+            # Повторный вызов не запустился: разбираем очередь сами, до ответа
+            asyncio.run(drain_updates(process_update))
+        self._send_json(200, {"status": "accepted"})
+        return True
+    
     def do_POST(self):
+        if urlparse(self.path).path.rstrip('/').endswith('/drain'):
+            self._drain()
+            return
+        
         content_length = int(self.headers['Content-Length'])
         post_data = self.rfile.read(content_length).decode('utf-8')
         
         # Обрабатываем данные
         try:
             update_data = json.loads(post_data)
+            if not isinstance(update_data, dict) or not isinstance(update_data.get('update_id'), int):
+                self._send_json(400, {"status": "error", "message": "invalid update"})
+                return
+            
+            profiling_requested = should_profile(self.headers.get(PROFILE_HEADER))
+            if KV_QUEUE_MODE and not profiling_requested:
+                # Отвечаем после записи в очередь; обработку выполняет повторный вызов webhook
+                if self._enqueue(update_data):
+                    return
+            elif WEBHOOK_ACK_MODE and not profiling_requested:
+                # Отвечаем сразу, обработка идет в фоновом потоке
+                if not update_queue.submit(update_data):
+                    self._send_json(
+                        503, {"status": "busy"}, headers={'Retry-After': str(WEBHOOK_RETRY_AFTER)}
+                    )
+                    return
+                self._send_json(200, {"status": "accepted"})
+                return
             
             # Используем асинхронный обработчик
             import asyncio
-            asyncio.run(self.process_update(update_data))
+            profiling = profile('webhook') if profiling_requested else nullcontext()
+            with profiling as report:
+                asyncio.run(self.process_update(update_data))
+            if report:
+                asyncio.run(set_value(PROFILE_STORAGE_KEY, report.to_dict()))
             
             # Отправляем успешный ответ
             self.send_response(200)
@@ -311,9 +619,38 @@ class handler(BaseHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(json.dumps({"status": "error", "message": str(e)}).encode('utf-8'))
     
+    def _queue_stats(self):
+        """Состояние очереди обновлений для метрик"""
+        if not KV_QUEUE_MODE:
+            return update_queue.stats()
+        import asyncio
+        return {'depth': asyncio.run(queue_length(UPDATE_QUEUE_KEY)), 'max_depth': WEBHOOK_QUEUE_SIZE}
+    
     def do_GET(self):
+        # Метрики конвейера дайджеста в формате JSON
+        if urlparse(self.path).path.rstrip('/').endswith('/metrics'):
+            if not metrics_authorized(self.headers.get(METRICS_HEADER)):
+                self.send_response(403)
+                self.send_header('Content-type', 'application/json')
+                self.end_headers()
+                self.wfile.write(json.dumps({"status": "forbidden"}).encode('utf-8'))
+                return
+            self.send_response(200)
+            self.send_header('Content-type', 'application/json')
+            self.end_headers()
+            metrics = {
+                **metrics_registry.snapshot(),
+                'startup': import_report(),
+                'queue': self._queue_stats(),
+                'breakers': breakers.stats(),
+            }
+            self.wfile.write(json.dumps(metrics, ensure_ascii=False).encode('utf-8'))
+            return
+        
         # Для проверки, что webhook доступен
         self.send_response(200)
         self.send_header('Content-type', 'application/json')
         self.end_headers()
-        self.wfile.write(json.dumps({"status": "webhook active"}).encode('utf-8')) 
\ No newline at end of file
+        self.wfile.write(json.dumps({"status": "webhook active"}).encode('utf-8')) 
+
+record_import(__name__, _IMPORT_STARTED)
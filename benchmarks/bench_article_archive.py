@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Время выборки статей за период из архива в зависимости от размера архива
+
+Статьи появляются пачками раз в час; выборка за фиксированный период должна занимать
+одинаковое время при любом размере архива (поиск по индексу и чтение только статей периода).
+
+Использование:
+    python benchmarks/bench_article_archive.py --articles 100000,1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from src.article_archive import ArticleArchive
+
+# Периоды выборки (в часах)
+WINDOWS = (1, 6, 24)
+
+
+def fill(archive, count, now, batch=60):
+    """Заполнить архив: каждый час дайджест из batch статей, последний - в момент now"""
+    for start in range(0, count, batch):
+        articles = [
+            {'url': f'https://strana.news/news/{index}.html', 'title': f'Статья {index}', 'lastmod': None}
+            for index in range(start, min(count, start + batch))
+        ]
+        archive.add_articles(articles, seen_at=now - (count - start) // batch * 3600)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк выборки статей за период")
+    parser.add_argument('--articles', default='100000,1000000', help="Размеры архива через запятую")
+    args = parser.parse_args()
+
+    now = time.time()
+    for count in (int(value) for value in args.articles.split(',')):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            archive = ArticleArchive(os.path.join(tmp_dir, 'articles.db'))
+            fill(archive, count, now)
+            for hours in WINDOWS:
+                timings = []
+                for _ in range(5):
+                    started = time.perf_counter()
+                    results = archive.since(now - hours * 3600, limit=10000)
+                    timings.append((time.perf_counter() - started) * 1000)
+                print(f"{count} статей, период {hours} ч: {min(timings):.2f} мс, статей {len(results)}")
+            archive.close()
+
+
+if __name__ == '__main__':
+    main()
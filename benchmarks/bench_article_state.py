@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Сравнение памяти прежнего представления статей (словари записей и состояние {URL: строка версии})
+с компактным (SitemapEntry со __slots__ и ArticleState с общими префиксами и версиями),
+а также времени загрузки состояния из JSON и из двоичного снимка
+
+Генерирует sitemap в стиле strana.news: URL с общим префиксом и версии вида "daily_0.8_2025-04-28".
+Память состояния измеряется для адресов вида ".../slug.html" и адресов-каталогов ".../slug/".
+
+Использование:
+    python benchmarks/bench_article_state.py --urls 100000
+"""
+import argparse
+import gc
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from src.article_state import ArticleState
+from src.sitemap_parser import iter_sitemap_entries
+from src.state_snapshot import read_snapshot_file, write_snapshot_file
+
+TODAY = '2025-04-28'
+# Окончания адресов статей: файл или каталог с завершающим "/"
+URL_STYLES = {'html': '.html', 'slash': '/'}
+
+
+def generate_sitemap(urls, ending='.html'):
+    """Сгенерировать sitemap без lastmod (версия статьи строится из changefreq, priority и даты)"""
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">']
+    for index in range(urls):
+        lines.append(f'<url><loc>https://strana.news/news/{484110 - index}-novost-o-sobytijah-dnja-nomer-{index}{ending}</loc>'
+                     f'<changefreq>daily</changefreq><priority>0.8</priority></url>')
+    lines.append('</urlset>')
+    return '\n'.join(lines).encode('utf-8')
+
+
+def legacy_entries(content):
+    """Записи в прежнем виде - словари"""
+    entries = []
+    for entry in iter_sitemap_entries(content):
+        entries.append({field: entry[field] for field in entry.__slots__ if entry.get(field)})
+    return entries
+
+
+def legacy_state(entries):
+    """Прежнее состояние {URL: строка версии}"""
+    return {entry['loc']: f"{entry['changefreq']}_{entry['priority']}_{TODAY}" for entry in entries}
+
+
+def compact_state(entries):
+    state = ArticleState()
+    for entry in entries:
+        state.set(entry.loc, state.version(entry.changefreq, entry.priority, TODAY))
+    state.compact()
+    return state
+
+
+def measure(build):
+    """Объем памяти, удерживаемой результатом build() (в МБ)"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size / 1024 / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк памяти представления статей")
+    parser.add_argument('--urls', type=int, default=100000, help="Число URL в sitemap")
+    args = parser.parse_args()
+
+    content = generate_sitemap(args.urls)
+    print(f"Sitemap: {args.urls} URL, {len(content) / 1024 / 1024:.1f} МБ")
+
+    old_entries, old_entries_mb = measure(lambda: legacy_entries(content))
+    new_entries, new_entries_mb = measure(lambda: list(iter_sitemap_entries(content)))
+    print(f"Записи sitemap: словари {old_entries_mb:.1f} МБ, SitemapEntry {new_entries_mb:.1f} МБ "
+          f"({1 - new_entries_mb / old_entries_mb:.0%} экономии)")
+
+    del old_entries, new_entries
+    # Состояние живет между запусками дольше записей, поэтому учитывается только то, что оно удерживает
+    for style, ending in URL_STYLES.items():
+        style_content = generate_sitemap(args.urls, ending)
+        old_state, old_state_mb = measure(lambda: legacy_state(legacy_entries(style_content)))
+        new_state, new_state_mb = measure(lambda: compact_state(iter_sitemap_entries(style_content)))
+        print(f"Состояние в памяти ({style}): словарь {old_state_mb:.1f} МБ, ArticleState {new_state_mb:.1f} МБ "
+              f"({1 - new_state_mb / old_state_mb:.0%} экономии)")
+        assert new_state_mb < old_state_mb, f"ArticleState больше словаря для адресов {style}"
+        del style_content
+    # Остальные измерения - для адресов последнего вида (каталоги)
+
+    old_json = json.dumps(old_state, ensure_ascii=False, indent=2).encode('utf-8')
+    new_json = json.dumps(new_state.to_json(), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    print(f"Сохраненное состояние: {len(old_json) / 1024 / 1024:.1f} МБ -> {len(new_json) / 1024 / 1024:.1f} МБ "
+          f"({1 - len(new_json) / len(old_json):.0%} экономии)")
+
+    restored = ArticleState.from_json(json.loads(old_json))
+    assert all(restored.get(url) == new_state.get(url) for url in old_state), "Миграция состояния нарушила версии"
+
+    # Холодный старт: загрузка прежнего JSON и двоичного снимка
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        json_path = os.path.join(tmp_dir, 'last_articles.json')
+        with open(json_path, 'wb') as f:
+            f.write(old_json)
+        started = time.perf_counter()
+        with open(json_path, encoding='utf-8') as f:
+            ArticleState.from_json(json.load(f))
+        json_ms = (time.perf_counter() - started) * 1000
+        print(f"Загрузка JSON: {json_ms:.0f} мс")
+
+        for codec in ('zlib', 'none'):
+            snapshot_path = os.path.join(tmp_dir, f'last_articles-{codec}.snap')
+            size = write_snapshot_file(snapshot_path, new_state, codec)
+            started = time.perf_counter()
+            loaded = read_snapshot_file(snapshot_path)
+            snapshot_ms = (time.perf_counter() - started) * 1000
+            assert len(loaded) == len(new_state)
+            print(f"Загрузка снимка ({codec}, {size / 1024 / 1024:.1f} МБ): {snapshot_ms:.0f} мс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Время построения поискового индекса статей и задержка запросов /search
+
+Генерирует заголовки из словаря новостных слов с распределением частот по закону Ципфа,
+поэтому в индексе есть и редкие, и очень частые термы.
+
+Использование:
+    python benchmarks/bench_search_index.py --articles 300000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from src.search_index import SearchIndex
+
+WORDS = (
+    'выборы президент правительство украина россия москва киев война переговоры санкции экономика '
+    'рубль доллар нефть газ цены инфляция банк налоги бюджет армия фронт удар беспилотник ракета '
+    'наступление оборона суд закон депутаты парламент партия министр губернатор мэр полиция авария '
+    'пожар погода зима лето школа университет больница врачи вакцина спорт футбол хоккей чемпионат '
+    'кино театр музыка концерт выставка интернет телеграм блокировка хакеры связь транспорт метро '
+    'поезд самолет аэропорт граница мигранты пенсии зарплаты ипотека жилье строительство энергетика'
+).split()
+ENDINGS = ('', 'а', 'ы', 'ов', 'ах', 'ом', 'е', 'и', 'ами')
+QUERIES = ('выборы', 'переговоры в киеве', 'цены на нефть', 'беспилотники атаковали аэропорт',
+           'чемпионат по хоккею', 'ипотека')
+
+
+def generate_articles(count, seed=1):
+    """Статьи с заголовками из 5-9 слов, частоты слов распределены по закону Ципфа"""
+    rng = random.Random(seed)
+    weights = [1 / rank for rank in range(1, len(WORDS) + 1)]
+    for index in range(count):
+        words = rng.choices(WORDS, weights, k=rng.randint(5, 9))
+        title = ' '.join(word + rng.choice(ENDINGS) for word in words).capitalize()
+        yield {'url': f'https://strana.news/news/{500000 - index}-{"-".join(words[:3])}.html', 'title': title}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк поискового индекса статей")
+    parser.add_argument('--articles', type=int, default=300000, help="Число статей в индексе")
+    parser.add_argument('--batch', type=int, default=1000, help="Статей в одном добавлении")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        index = SearchIndex(os.path.join(tmp_dir, 'search_index.db'))
+        started = time.perf_counter()
+        batch = []
+        for article in generate_articles(args.articles):
+            batch.append(article)
+            if len(batch) == args.batch:
+                index.add_articles(batch)
+                batch = []
+        index.add_articles(batch)
+        elapsed = time.perf_counter() - started
+        size = os.path.getsize(index.path) / 1024 / 1024
+        print(f"Индекс: {len(index)} статей, {size:.0f} МБ, построение {elapsed:.1f} с "
+              f"({args.articles / elapsed:.0f} статей/с)")
+
+        # Добавление одного дайджеста к большому индексу
+        started = time.perf_counter()
+        index.add_articles(generate_articles(100, seed=2))
+        print(f"Добавление 100 статей: {(time.perf_counter() - started) * 1000:.0f} мс")
+
+        for query in QUERIES:
+            index.search(query)
+            timings = []
+            for _ in range(5):
+                started = time.perf_counter()
+                results = index.search(query)
+                timings.append((time.perf_counter() - started) * 1000)
+            print(f"{query!r}: {min(timings):.1f} мс, результатов {len(results)}")
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Сравнение скорости разбора sitemap в одном процессе и в пуле процессов
+
+По умолчанию генерирует синтетические sitemap во временном каталоге; процессам передаются
+пути к файлам, а обратно возвращаются компактные кортежи (см. src/parallel_parse.py).
+
+Использование:
+    python benchmarks/bench_sitemap_parse.py --sitemaps 16 --urls 20000 --workers 1,2,4
+    python benchmarks/bench_sitemap_parse.py --dir saved_sitemaps/
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from src.parallel_parse import parse_sitemaps, shutdown
+
+
+def generate_sitemaps(directory, sitemaps, urls):
+    """Сгенерировать sitemap с расширением Google News"""
+    paths = []
+    for number in range(sitemaps):
+        path = os.path.join(directory, f'sitemap-{number}.xml')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" '
+                    'xmlns:news="http://www.google.com/schemas/sitemap-news/0.9">\n')
+            for index in range(urls):
+                f.write(f'<url><loc>https://example.com/news/{number}/{index}-statja-o-sobytijah.html</loc>'
+                        f'<lastmod>2025-04-27T10:{index % 60:02d}:00+03:00</lastmod>'
+                        f'<priority>0.{index % 10}</priority>'
+                        f'<news:news><news:title>Статья {index} о событиях дня</news:title></news:news></url>\n')
+            f.write('</urlset>\n')
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк разбора sitemap в пуле процессов")
+    parser.add_argument('--sitemaps', type=int, default=16, help="Число синтетических sitemap")
+    parser.add_argument('--urls', type=int, default=20000, help="Число URL в каждом sitemap")
+    parser.add_argument('--workers', default=f'1,{os.cpu_count() or 1}', help="Число процессов через запятую")
+    parser.add_argument('--dir', help="Каталог с сохраненными sitemap вместо генерации")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.dir:
+            paths = [os.path.join(args.dir, name) for name in sorted(os.listdir(args.dir))]
+        else:
+            paths = generate_sitemaps(tmp_dir, args.sitemaps, args.urls)
+        total_mb = sum(os.path.getsize(path) for path in paths) / 1024 / 1024
+        print(f"Sitemap: {len(paths)}, всего {total_mb:.1f} МБ")
+
+        for workers in sorted({int(value) for value in args.workers.split(',')}):
+            # Первый прогон запускает процессы пула, поэтому замеряем второй
+            parse_sitemaps(paths[:workers], workers)
+            started = time.perf_counter()
+            results = parse_sitemaps(paths, workers)
+            elapsed = time.perf_counter() - started
+            urls = sum(len(rows) for _, rows in results)
+            print(f"процессов: {workers:3}  {elapsed:7.2f} с  {urls / elapsed:10.0f} URL/с")
+    shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Сравнение скорости извлечения заголовков статей
+
+По умолчанию загружает страницы из last_articles.json и сравнивает исходный разбор
+BeautifulSoup(html.parser) с быстрыми извлекателями из src/title_extractor.py.
+
+Использование:
+    python benchmarks/bench_title_extraction.py --pages 20 --repeat 5
+    python benchmarks/bench_title_extraction.py --dir saved_pages/
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from src.article_state import ArticleState
+from src.title_extractor import EXTRACTORS
+
+
+def baseline_title(content, encoding=None):
+    """Исходный способ: полный разбор документа BeautifulSoup с html.parser"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, 'html.parser')
+    title = soup.find('title') or soup.find('h1')
+    return title.text.strip() if title else None
+
+
+def load_pages(args):
+    """Загрузить страницы из каталога или по URL из кеша статей"""
+    pages = []
+    if args.dir:
+        for name in sorted(os.listdir(args.dir))[:args.pages]:
+            with open(os.path.join(args.dir, name), 'rb') as f:
+                pages.append((name, f.read(), None))
+        return pages
+
+    import requests
+
+    with open(os.path.join(ROOT_DIR, 'last_articles.json'), encoding='utf-8') as f:
+        urls = list(ArticleState.from_json(json.load(f)))[:args.pages]
+    for url in urls:
+        try:
+            response = requests.get(url, timeout=10)
+            response.raise_for_status()
+            pages.append((url, response.content, response.encoding))
+        except Exception as e:
+            print(f"Пропущена страница {url}: {e}")
+    return pages
+
+
+def bench(extractor, pages, repeat):
+    """Среднее время обработки одной страницы (в мс)"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for _, content, encoding in pages:
+            extractor(content, encoding)
+    return (time.perf_counter() - started) * 1000 / (repeat * len(pages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк извлечения заголовков")
+    parser.add_argument('--pages', type=int, default=20, help="Число страниц")
+    parser.add_argument('--repeat', type=int, default=5, help="Число повторов")
+    parser.add_argument('--dir', help="Каталог с сохраненными HTML-страницами вместо загрузки")
+    args = parser.parse_args()
+
+    pages = load_pages(args)
+    if not pages:
+        print("Нет страниц для замера")
+        return 1
+
+    total_kb = sum(len(content) for _, content, _ in pages) / 1024
+    print(f"Страниц: {len(pages)}, средний размер: {total_kb / len(pages):.0f} КБ")
+
+    baseline_ms = bench(baseline_title, pages, args.repeat)
+    print(f"{'bs4 html.parser (исходный)':28} {baseline_ms:8.2f} мс/стр")
+    for name, extractor in EXTRACTORS.items():
+        ms = bench(extractor, pages, args.repeat)
+        mismatches = sum(
+            1 for _, content, encoding in pages
+            if extractor(content, encoding) != baseline_title(content, encoding)
+        )
+        print(f"{name:28} {ms:8.2f} мс/стр  ускорение x{baseline_ms / ms:.1f}  расхождений: {mismatches}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,25 +1,33 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import asyncio
 import logging
 import os
-import re
-from typing import List, Optional, Tuple
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 import xml.etree.ElementTree as ET
-from urllib.parse import urlparse
 
 import requests
 from dotenv import load_dotenv
-from telegram import Update
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.constants import ParseMode
 from telegram.ext import (
     Application,
+    CallbackQueryHandler,
     CommandHandler,
     ContextTypes,
     MessageHandler,
     filters,
 )
 
+from src.update_processor import ChatOrderedUpdateProcessor, UPDATE_WORKERS
+from src.rate_limit import rate_limiter, format_retry_message
+from src.sitemap_cache import sitemap_cache
+from src.result_pages import ALL_URLS, PAGE_SIZE, PagedResult, result_store
+from src.resilience import public_get
+from src.url_validation import URL_PATTERN, BlockedAddressError, validate_sitemap_url
+
 # Загрузка переменных окружения из .env файла
 load_dotenv()
 
@@ -39,20 +47,10 @@ logger = logging.getLogger(__name__)
 
 # Константы
 MAX_MESSAGE_LENGTH = 4096  # Максимальная длина сообщения в Telegram
-MAX_URLS_PER_MESSAGE = 50  # Максимальное количество URL в одном сообщении
-
-# Регулярное выражение для проверки URL
-URL_PATTERN = re.compile(
-    r'^https?://'  # http:// или https://
-    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # домен
-    r'localhost|'  # localhost
-    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # или IP
-    r'(?::\d+)?'  # опциональный порт
-    r'(?:/?|[/?]\S+)$', re.IGNORECASE
-)
-
-# Регулярное выражение для проверки имени файла sitemap
-SITEMAP_PATTERN = re.compile(r'sitemap.*\.xml$', re.IGNORECASE)
+MAX_URL_DISPLAY_LENGTH = 120  # Более длинные URL на странице результата обрезаются
+PAGE_CALLBACK_PREFIX = "pg"  # Префикс callback_data кнопок листания результата
+STREAM_CHUNK_SIZE = 8 * 1024  # Размер блока при потоковой загрузке sitemap (примерно 100 URL)
+PROGRESS_EDIT_INTERVAL = 2.0  # Минимальный интервал между обновлениями сообщения о прогрессе (в секундах)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик команды /start."""
@@ -91,133 +89,305 @@ async def parse_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     url = context.args[0]
     await handle_url(update, url)
 
-def parse_sitemap(url: str) -> Tuple[List[str], Optional[str]]:
+class SitemapError(Exception):
+    """Ошибка sitemap с сообщением для пользователя."""
+
+class SitemapStream:
     """
-    Парсит sitemap по указанному URL и возвращает список URL и сообщение об ошибке (если есть).
+    Потоковая загрузка и разбор sitemap: URL возвращаются по мере получения данных,
+    не дожидаясь загрузки всего файла.
     
     Args:
         url: URL sitemap-файла
-        
-    Returns:
-        Tuple[List[str], Optional[str]]: Список URL и сообщение об ошибке (если есть)
+        headers: Дополнительные заголовки запроса (например, для условного запроса)
     """
-    urls = []
-    error = None
-    
-    # Проверяем, что URL валидный
-    if not URL_PATTERN.match(url):
-        return [], f"⚠️ Некорректный URL: {url}"
-    
-    # Проверяем, что URL ведет на sitemap файл
-    parsed_url = urlparse(url)
-    path = parsed_url.path
     
-    if not path or not SITEMAP_PATTERN.search(path):
-        return [], f"⚠️ URL не похож на sitemap файл: {url}"
+    def __init__(self, url: str, headers: Optional[Dict[str, str]] = None):
+        self.url = url
+        self.headers = headers
+        self.not_modified = False  # Сервер ответил 304 Not Modified
+        self.etag = None
+        self.last_modified = None
+        self.bytes_received = 0
     
-    try:
-        # Загружаем sitemap файл
-        response = requests.get(url, timeout=30)
-        response.raise_for_status()
-        
-        # Проверяем, что ответ содержит XML
-        content_type = response.headers.get('Content-Type', '')
-        if 'text/xml' not in content_type and 'application/xml' not in content_type:
-            return [], f"⚠️ Ответ не является XML: {content_type}"
-        
-        # Парсим XML
-        root = ET.fromstring(response.content)
-        
-        # Находим все URL в sitemap
-        # Обрабатываем оба формата sitemap: xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"
-        # и xmlns="http://www.google.com/schemas/sitemap/0.84"
-        namespaces = {
-            'sm': 'http://www.sitemaps.org/schemas/sitemap/0.9',
-            'sm_old': 'http://www.google.com/schemas/sitemap/0.84'
-        }
-        
-        # Ищем URL в стандартном формате
-        for url_elem in root.findall('.//sm:url/sm:loc', namespaces) or root.findall('.//sm_old:url/sm_old:loc', namespaces):
-            if url_elem.text and url_elem.text.strip():
-                urls.append(url_elem.text.strip())
-        
-        # Если URL не найдены, пробуем искать без пространства имен
-        if not urls:
-            for url_elem in root.findall('.//url/loc') or root.findall('.//sitemap/loc'):
-                if url_elem.text and url_elem.text.strip():
-                    urls.append(url_elem.text.strip())
-        
-        if not urls:
-            return [], "⚠️ В sitemap не найдено URL"
+    def __iter__(self) -> Iterator[str]:
+        # URL указал пользователь: соединения и перенаправления во внутреннюю сеть отклоняются
+        with public_get(self.url, timeout=30, stream=True, headers=self.headers) as response:
+            if self.headers and response.status_code == 304:
+                self.not_modified = True
+                return
+            response.raise_for_status()
             
-    except requests.exceptions.RequestException as e:
+            # Проверяем, что ответ содержит XML
+            content_type = response.headers.get('Content-Type', '')
+            if 'text/xml' not in content_type and 'application/xml' not in content_type:
+                raise SitemapError(f"⚠️ Ответ не является XML: {content_type}")
+            self.etag = response.headers.get('ETag')
+            self.last_modified = response.headers.get('Last-Modified')
+            
+            parser = ET.XMLPullParser(events=('start', 'end'))
+            # Открытые элементы: разобранный <url> удаляется из родителя, чтобы корень не рос
+            open_elements = []
+            for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+                self.bytes_received += len(chunk)
+                parser.feed(chunk)
+                yield from self._read_urls(parser, open_elements)
+            parser.close()
+            yield from self._read_urls(parser, open_elements)
+    
+    @staticmethod
+    def _read_urls(parser: ET.XMLPullParser, open_elements: List[ET.Element]) -> Iterator[str]:
+        """Извлекает <loc> из полностью полученных <url> и <sitemap> (любого пространства имен)."""
+        for event, elem in parser.read_events():
+            if event == 'start':
+                open_elements.append(elem)
+                continue
+            open_elements.pop()
+            if elem.tag.rsplit('}', 1)[-1] not in ('url', 'sitemap'):
+                continue
+            for child in elem:
+                if child.tag.rsplit('}', 1)[-1] == 'loc' and child.text and child.text.strip():
+                    yield child.text.strip()
+                    break
+            if open_elements:
+                open_elements[-1].remove(elem)
+
+def iter_batches(items: Iterable[str], size: int) -> Iterator[List[str]]:
+    """Группирует элементы в пакеты заданного размера."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def describe_error(e: Exception) -> str:
+    """Преобразует ошибку загрузки или разбора sitemap в сообщение для пользователя."""
+    if isinstance(e, SitemapError):
+        return str(e)
+    if isinstance(e, BlockedAddressError):
+        return "⚠️ Адрес недоступен: разрешены только публичные сайты"
+    if isinstance(e, requests.exceptions.RequestException):
         logger.error(f"Ошибка при загрузке sitemap: {e}")
-        return [], f"⚠️ Ошибка при загрузке sitemap: {str(e)}"
-    except ET.ParseError as e:
+        return f"⚠️ Ошибка при загрузке sitemap: {str(e)}"
+    if isinstance(e, ET.ParseError):
         logger.error(f"Ошибка при парсинге XML: {e}")
-        return [], f"⚠️ Ошибка при парсинге XML: {str(e)}"
-    except Exception as e:
-        logger.error(f"Непредвиденная ошибка: {e}")
-        return [], f"⚠️ Непредвиденная ошибка: {str(e)}"
+        return f"⚠️ Ошибка при парсинге XML: {str(e)}"
+    logger.error(f"Непредвиденная ошибка: {e}")
+    return f"⚠️ Непредвиденная ошибка: {str(e)}"
+
+def format_url_list(header: str, urls: List[str]) -> str:
+    """
+    Формирует текст списка URL, который помещается в одно сообщение Telegram.
     
-    return urls, error
+    Длинные URL обрезаются до MAX_URL_DISPLAY_LENGTH, а URL, которые не помещаются
+    в MAX_MESSAGE_LENGTH, заменяются строкой с их числом.
+    
+    Args:
+        header: Заголовок сообщения
+        urls: URL для показа
+        
+    Returns:
+        str: Текст сообщения
+    """
+    text = header + "\n"
+    for index, url in enumerate(urls):
+        line = url if len(url) <= MAX_URL_DISPLAY_LENGTH else url[:MAX_URL_DISPLAY_LENGTH - 1] + '…'
+        rest = f"\n… и еще {len(urls) - index} URL"
+        # Место для строки о пропущенных URL оставляем всегда, кроме последнего URL
+        reserve = 0 if index == len(urls) - 1 else len(rest) + 1
+        if len(text) + 1 + len(line) + reserve > MAX_MESSAGE_LENGTH:
+            return text + rest
+        text += "\n" + line
+    return text
 
-async def send_url_batches(update: Update, urls: List[str]) -> None:
+def format_page(result_id: str, result: PagedResult, page: int = 0,
+                prefix_index: int = ALL_URLS) -> Tuple[str, InlineKeyboardMarkup]:
     """
-    Отправляет пользователю списки URL пакетами, чтобы не превышать лимиты Telegram.
+    Формирует текст и клавиатуру страницы результата.
     
     Args:
-        update: Объект обновления Telegram
-        urls: Список URL для отправки
+        result_id: Идентификатор результата в хранилище
+        result: Результат разбора
+        page: Номер страницы, начиная с 0
+        prefix_index: Номер фильтра по префиксу пути или ALL_URLS
+        
+    Returns:
+        Tuple[str, InlineKeyboardMarkup]: Текст сообщения и клавиатура
     """
-    if not urls:
-        await update.message.reply_text("⚠️ Не найдено URL для отправки.")
+    pages = result.pages(prefix_index)
+    page = min(max(page, 0), pages - 1)
+    urls = result.page(page, prefix_index)
+    first = page * result.page_size + 1
+    
+    header = f"🔍 Найдено URL: {len(result)}"
+    if prefix_index != ALL_URLS:
+        header += f", с префиксом {result.prefixes[prefix_index]}: {result.total(prefix_index)}"
+    if urls:
+        header += f"\n📄 Страница {page + 1}/{pages} (URL {first}–{first + len(urls) - 1})"
+    text = format_url_list(header, urls)
+    
+    def callback(target_prefix: int, target_page: int) -> str:
+        return f"{PAGE_CALLBACK_PREFIX}:{result_id}:{target_prefix}:{target_page}"
+    
+    keyboard = []
+    if pages > 1:
+        keyboard.append([
+            InlineKeyboardButton("◀", callback_data=callback(prefix_index, (page - 1) % pages)),
+            InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=callback(prefix_index, page)),
+            InlineKeyboardButton("▶", callback_data=callback(prefix_index, (page + 1) % pages)),
+        ])
+    
+    # Фильтры по самым частым префиксам пути, по два в ряд
+    filter_buttons = [
+        InlineKeyboardButton(
+            ("✅ " if index == prefix_index else "") + f"{prefix} ({result.total(index)})",
+            callback_data=callback(index, 0)
+        )
+        for index, prefix in enumerate(result.prefixes)
+    ]
+    if prefix_index != ALL_URLS:
+        filter_buttons.append(InlineKeyboardButton("Все URL", callback_data=callback(ALL_URLS, 0)))
+    for i in range(0, len(filter_buttons), 2):
+        keyboard.append(filter_buttons[i:i + 2])
+    
+    return text, InlineKeyboardMarkup(keyboard)
+
+async def page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Обработчик кнопок листания и фильтров результата разбора."""
+    query = update.callback_query
+    try:
+        _, result_id, prefix_index, page = query.data.split(":")
+        prefix_index, page = int(prefix_index), int(page)
+    except ValueError:
+        await query.answer()
         return
     
-    # Отправляем общую информацию о количестве найденных URL
-    await update.message.reply_text(f"🔍 Найдено URL: {len(urls)}")
+    result = result_store.get(result_id)
+    if result is None or prefix_index >= len(result.prefixes):
+        await query.answer("Результат устарел. Отправьте URL sitemap еще раз.", show_alert=True)
+        return
+    await query.answer()
     
-    # Разбиваем URL на пакеты, чтобы не превышать лимиты Telegram
-    for i in range(0, len(urls), MAX_URLS_PER_MESSAGE):
-        batch = urls[i:i + MAX_URLS_PER_MESSAGE]
-        message = "\n".join(batch)
-        
-        # Проверяем, не превышает ли сообщение максимальную длину
-        if len(message) > MAX_MESSAGE_LENGTH:
-            # Если превышает, разбиваем на более мелкие части
-            current_message = ""
-            for url in batch:
-                if len(current_message) + len(url) + 1 > MAX_MESSAGE_LENGTH:
-                    await update.message.reply_text(current_message)
-                    current_message = url + "\n"
-                else:
-                    current_message += url + "\n"
-            
-            if current_message:
-                await update.message.reply_text(current_message)
-        else:
-            await update.message.reply_text(message)
+    text, reply_markup = format_page(result_id, result, page, prefix_index)
+    if text == query.message.text:
+        return
+    await query.edit_message_text(text, reply_markup=reply_markup, disable_web_page_preview=True)
+
+async def send_result(update: Update, url: str, urls: List[str], message=None) -> None:
+    """
+    Сохраняет результат разбора и показывает его первую страницу.
+    
+    Args:
+        update: Объект обновления Telegram
+        url: URL sitemap
+        urls: Найденные URL
+        message: Сообщение для редактирования (если первая страница уже была отправлена)
+    """
+    result_id, result = await asyncio.to_thread(result_store.add, url, urls)
+    text, reply_markup = format_page(result_id, result)
+    if message:
+        await message.edit_text(text, reply_markup=reply_markup, disable_web_page_preview=True)
+    else:
+        await update.message.reply_text(text, reply_markup=reply_markup, disable_web_page_preview=True)
 
 async def handle_url(update: Update, url: str) -> None:
     """
     Обрабатывает URL, переданный пользователем.
     
+    URL из sitemap разбираются по мере загрузки: первая страница отправляется, как только
+    найдено PAGE_SIZE URL, а сообщение о прогрессе обновляется счетчиками. После разбора
+    первая страница получает кнопки листания и фильтров по префиксу пути.
+    
     Args:
         update: Объект обновления Telegram
         url: URL для обработки
     """
-    await update.message.reply_text(f"🔄 Парсинг sitemap: {url}")
-    
-    # Парсим sitemap
-    urls, error = parse_sitemap(url)
-    
-    # Если возникла ошибка, отправляем сообщение об ошибке
+    # Некорректный URL не тратит жетоны пользователя
+    error = validate_sitemap_url(url)
     if error:
         await update.message.reply_text(error)
         return
     
-    # Отправляем найденные URL
-    await send_url_batches(update, urls)
+    # Разбор произвольного sitemap - самая дорогая операция, поэтому она ограничена по частоте;
+    # результат из кеша стоит дешевле
+    command = 'parse_cached' if sitemap_cache.is_fresh(url) else 'parse'
+    retry_after = await rate_limiter.acquire(update.effective_user.id, command)
+    if retry_after:
+        await update.message.reply_text(format_retry_message(retry_after))
+        return
+    
+    # Результат из кеша отправляем сразу
+    cached = sitemap_cache.lookup(url)
+    if cached and cached.fresh:
+        await send_result(update, url, cached.urls())
+        return
+    
+    progress_message = await update.message.reply_text(f"🔄 Парсинг sitemap: {url}")
+    
+    stream = SitemapStream(url, cached.validators() if cached else None)
+    urls = []
+    first_page_message = None
+    progress_text = None
+    last_progress = time.monotonic()
+    try:
+        batches = iter_batches(stream, PAGE_SIZE)
+        try:
+            while True:
+                # Загрузка и разбор блокирующие, поэтому каждый пакет собирается в отдельном потоке
+                batch = await asyncio.to_thread(next, batches, None)
+                if batch is None:
+                    break
+                urls.extend(batch)
+                if first_page_message is None:
+                    # Первая страница - сразу, кнопки появятся после окончания разбора
+                    first_page_message = await update.message.reply_text(
+                        format_url_list("🔍 Первые URL (разбор продолжается):", batch),
+                        disable_web_page_preview=True
+                    )
+                
+                # Обновляем сообщение о прогрессе не чаще раза в PROGRESS_EDIT_INTERVAL секунд
+                if time.monotonic() - last_progress >= PROGRESS_EDIT_INTERVAL:
+                    text = (
+                        f"🔄 Парсинг sitemap: {url}\n"
+                        f"🔍 Найдено URL: {len(urls)}, загружено {stream.bytes_received // 1024} КБ"
+                    )
+                    if text != progress_text:
+                        await progress_message.edit_text(text)
+                        progress_text = text
+                    last_progress = time.monotonic()
+        finally:
+            batches.close()
+    except Exception as e:
+        error_text = describe_error(e)
+        await progress_message.edit_text(error_text)
+        if first_page_message is not None:
+            # Первая страница больше не ждет окончания разбора: показываем, что результат неполный
+            await first_page_message.edit_text(
+                format_url_list(f"{error_text}\n🔍 Разбор прерван, первые URL:", urls[:PAGE_SIZE]),
+                disable_web_page_preview=True
+            )
+        return
+    
+    if stream.not_modified:
+        # Sitemap не изменился с прошлого разбора
+        sitemap_cache.refresh(cached)
+        await progress_message.edit_text(f"✅ Sitemap не изменился: {url}")
+        await send_result(update, url, cached.urls())
+        return
+    
+    if not urls:
+        await progress_message.edit_text("⚠️ В sitemap не найдено URL")
+        return
+    
+    sitemap_cache.put(url, urls, stream.etag, stream.last_modified)
+    await progress_message.edit_text(
+        f"✅ Парсинг завершен: {url}\n"
+        f"🔍 Найдено URL: {len(urls)}, загружено {stream.bytes_received // 1024} КБ"
+    )
+    await send_result(update, url, urls, first_page_message)
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Обработчик текстовых сообщений"""
@@ -235,14 +405,23 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 def main() -> None:
     """Запускает бота."""
-    # Создаем приложение и передаем ему токен бота
-    application = Application.builder().token(TOKEN).build()
+    # Создаем приложение и передаем ему токен бота; обновления разных чатов
+    # обрабатываются параллельно, а обновления одного чата - по порядку
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor(UPDATE_WORKERS))
+        .build()
+    )
 
     # Регистрируем обработчики команд
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("parse", parse_command))
     
+    # Листание и фильтры результатов разбора
+    application.add_handler(CallbackQueryHandler(page_callback, pattern=f"^{PAGE_CALLBACK_PREFIX}:"))
+    
     # Добавляем обработчик текстовых сообщений
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
@@ -0,0 +1,184 @@
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from src.article_state import VERSION_SEPARATOR
+from src.state_snapshot import STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Файл архива статей (на Vercel - в /tmp, поэтому архив живет до холодного старта)
+ARCHIVE_FILE = os.getenv('ARCHIVE_FILE', os.path.join(STATE_DIR, 'articles.db'))
+# Вести архив и отвечать на /digest с периодом. На Vercel архив в /tmp теряется при холодном старте
+# и у каждого экземпляра функции свой, поэтому по умолчанию архив работает только в worker
+ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', '0' if os.environ.get('VERCEL', '0') == '1' else '1') == '1'
+# Сколько статей показывать в дайджесте за период
+ARCHIVE_MAX_RESULTS = int(os.getenv('ARCHIVE_MAX_RESULTS', '50'))
+
+# Период вида "6h", "2d", "30m", "1w"
+_WINDOW = re.compile(r'^(\d+)\s*([mhdw])$')
+_WINDOW_UNITS = {'m': ('minutes', 'мин'), 'h': ('hours', 'ч'), 'd': ('days', 'дн'), 'w': ('weeks', 'нед')}
+# Форматы даты в "/digest since ..."
+_SINCE_FORMATS = ('%Y-%m-%d', '%Y-%m-%d %H:%M', '%d.%m.%Y', '%d.%m.%Y %H:%M')
+# Ответ на некорректный период
+_WINDOW_USAGE = '❌ Укажите период: /digest 6h, /digest 2d или /digest since 2025-04-27'
+
+
+def parse_lastmod(version):
+    """
+    Время изменения статьи из строки версии (time.time()) или None
+
+    Версия - lastmod из sitemap ("2025-04-28T10:00:00+03:00") или "changefreq_priority_дата";
+    в обоих случаях дата - последняя часть версии.
+    """
+    if not version:
+        return None
+    text = version.rsplit(VERSION_SEPARATOR, 1)[-1].strip()
+    try:
+        return datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def parse_window(args, now=None):
+    """
+    Разобрать период из аргументов /digest: "6h", "2d" или "since 2025-04-27 [10:00]"
+
+    :param args: Аргументы команды (context.args)
+    :param now: Текущее время (datetime), по умолчанию datetime.now()
+    :return: Кортеж (начало периода time.time(), подпись периода) или (None, текст ошибки)
+    """
+    now = now or datetime.now()
+    text = ' '.join(args).strip().lower()
+    match = _WINDOW.match(text)
+    if match:
+        amount, unit = int(match.group(1)), match.group(2)
+        name, label = _WINDOW_UNITS[unit]
+        try:
+            return (now - timedelta(**{name: amount})).timestamp(), f'за {amount} {label}'
+        except (OverflowError, ValueError, OSError):
+            # Период раньше первого года или вне диапазона времени платформы
+            return None, _WINDOW_USAGE
+
+    if args and args[0].lower() == 'since':
+        value = ' '.join(args[1:])
+        for date_format in _SINCE_FORMATS:
+            try:
+                since = datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+            try:
+                return since.timestamp(), f'с {since.strftime("%d.%m.%Y %H:%M")}'
+            except (OverflowError, ValueError, OSError):
+                return None, _WINDOW_USAGE
+
+    return None, _WINDOW_USAGE
+
+
+class ArticleArchive:
+    def __init__(self, path=ARCHIVE_FILE):
+        """
+        Архив собранных статей в SQLite
+
+        Статьи индексированы по времени первого появления и по lastmod (B-деревья SQLite),
+        поэтому выборка за период - два поиска по индексу и чтение только статей периода:
+        O(log n + k) независимо от размера архива.
+
+        :param path: Файл архива
+        """
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(
+                'CREATE TABLE IF NOT EXISTS articles ('
+                ' url TEXT PRIMARY KEY, title TEXT NOT NULL, first_seen REAL NOT NULL, lastmod REAL);'
+                'CREATE INDEX IF NOT EXISTS articles_first_seen ON articles (first_seen);'
+                'CREATE INDEX IF NOT EXISTS articles_lastmod ON articles (lastmod);'
+            )
+            self._connection = connection
+        return self._connection
+
+    def add_articles(self, articles, seen_at=None):
+        """
+        Записать статьи в архив
+
+        Время первого появления статьи не меняется, заголовок и lastmod обновляются.
+
+        :param articles: Статьи ({'url', 'title', 'lastmod'})
+        :param seen_at: Время появления (time.time()), по умолчанию текущее
+        :return: Число записанных статей
+        """
+        seen_at = seen_at or time.time()
+        rows = [
+            (article['url'], article['title'], seen_at, parse_lastmod(article.get('lastmod')))
+            for article in articles
+        ]
+        with self._lock:
+            connection = self._connect()
+            with connection:
+                connection.executemany(
+                    'INSERT INTO articles (url, title, first_seen, lastmod) VALUES (?, ?, ?, ?) '
+                    'ON CONFLICT (url) DO UPDATE SET title = excluded.title, '
+                    'lastmod = coalesce(excluded.lastmod, articles.lastmod)',
+                    rows
+                )
+        return len(rows)
+
+    def since(self, start, limit=ARCHIVE_MAX_RESULTS):
+        """
+        Статьи, появившиеся или измененные начиная с момента start, от новых к старым
+
+        :param start: Начало периода (time.time())
+        :param limit: Максимальное число статей
+        :return: Статьи ({'url', 'title', 'first_seen', 'lastmod'})
+        """
+        with self._lock:
+            rows = self._connect().execute(
+                'SELECT url, title, first_seen, lastmod FROM articles WHERE first_seen >= :start '
+                'UNION '
+                'SELECT url, title, first_seen, lastmod FROM articles WHERE lastmod >= :start '
+                'ORDER BY 3 DESC LIMIT :limit',
+                {'start': start, 'limit': limit}
+            ).fetchall()
+        return [
+            {'url': url, 'title': title, 'first_seen': first_seen, 'lastmod': lastmod}
+            for url, title, first_seen, lastmod in rows
+        ]
+
+    def window(self, start, limit=ARCHIVE_MAX_RESULTS):
+        """
+        Статьи периода для /digest: не больше limit, от новых к старым
+
+        :param start: Начало периода (time.time())
+        :param limit: Максимальное число статей
+        :return: Кортеж (статьи, есть ли в периоде статьи сверх limit)
+        """
+        articles = self.since(start, limit + 1)
+        return articles[:limit], len(articles) > limit
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute('SELECT count(*) FROM articles').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+# Общий архив процесса
+article_archive = ArticleArchive()
@@ -0,0 +1,172 @@
+import logging
+import sys
+from collections import deque
+
+from src.dedup import DEDUP_HISTORY
+
+logger = logging.getLogger(__name__)
+
+# Версия формата сохраненного состояния (формат 1 - словарь {url: строка версии})
+STATE_FORMAT = 2
+
+# Разделитель частей версии в строковом виде ("daily_0.8_2025-04-28")
+VERSION_SEPARATOR = '_'
+
+
+def split_url(url):
+    """
+    Разделить URL на префикс (схема, хост и каталоги) и последний сегмент
+
+    Завершающий "/" остается в последнем сегменте ("https://site/news/slug/" -> "https://site/news/", "slug/"),
+    поэтому статьи с адресами-каталогами тоже группируются по общему префиксу.
+    """
+    position = url.rstrip('/').rfind('/') + 1
+    return url[:position], url[position:]
+
+
+def parse_version(text):
+    """Строка версии из формата 1 -> кортеж частей ("daily_0.8_2025-04-28" -> ("daily", "0.8", "2025-04-28"))"""
+    return tuple(text.split(VERSION_SEPARATOR))
+
+
+def format_version(version):
+    """Кортеж частей версии -> строка версии"""
+    return VERSION_SEPARATOR.join(version)
+
+
+class ArticleState:
+    def __init__(self, recent=()):
+        """
+        Компактное состояние ранее обработанных статей {URL: версия}
+
+        URL хранятся по префиксам: для каждого префикса (например, "https://strana.news/news/")
+        словарь {последний сегмент: версия}, поэтому общий префикс хранится один раз.
+        Версия - кортеж частей (lastmod или changefreq, priority и дата); одинаковые версии
+        и их части интернируются и хранятся в одном экземпляре.
+
+        :param recent: Последние новые или измененные статьи (для поиска дубликатов)
+        """
+        self._prefixes = {}
+        self._versions = {}
+        self.recent = deque(recent, maxlen=DEDUP_HISTORY)
+        # Время сохранения снимка, из которого загружено состояние (мс, 0 - не загружалось)
+        self.saved_at = 0
+
+    def __len__(self):
+        return sum(len(tails) for tails in self._prefixes.values())
+
+    def __iter__(self):
+        for prefix, tails in self._prefixes.items():
+            for tail in tails:
+                yield prefix + tail
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def version(self, *parts):
+        """Интернированная версия из частей"""
+        version = self._versions.get(parts)
+        if version is None:
+            version = tuple(sys.intern(part) for part in parts)
+            self._versions[version] = version
+        return version
+
+    def compact(self):
+        """Освободить таблицу интернирования версий после заполнения состояния"""
+        self._versions = {}
+
+    def get(self, url):
+        """Версия статьи или None, если статья не обрабатывалась"""
+        prefix, tail = split_url(url)
+        tails = self._prefixes.get(prefix)
+        return tails.get(tail) if tails else None
+
+    def set(self, url, version):
+        """Запомнить версию статьи"""
+        prefix, tail = split_url(url)
+        tails = self._prefixes.get(prefix)
+        if tails is None:
+            tails = self._prefixes[sys.intern(prefix)] = {}
+        tails[tail] = self.version(*version)
+
+    def copy(self):
+        """Копия состояния для дополнения (словари статей копируются, версии общие)"""
+        state = ArticleState(self.recent)
+        for prefix, tails in self._prefixes.items():
+            state._prefixes[prefix] = dict(tails)
+        return state
+
+    def groups(self):
+        """Статьи по префиксам: пары (префикс, {последний сегмент: версия})"""
+        return self._prefixes.items()
+
+    def set_group(self, prefix, rows):
+        """
+        Добавить статьи префикса (при загрузке сохраненного состояния)
+
+        :param prefix: Префикс URL
+        :param rows: Словарь {последний сегмент: версия}, версии получены из self.version
+        """
+        if '' in rows and prefix.endswith('/'):
+            # Состояние, сохраненное до переноса завершающего "/" в последний сегмент:
+            # адрес-каталог записан отдельным префиксом с пустым сегментом
+            version = rows.pop('')
+            parent, tail = split_url(prefix)
+            self.set_group(parent, {tail: version})
+            if not rows:
+                return
+        tails = self._prefixes.get(prefix)
+        if tails:
+            tails.update(rows)
+        else:
+            self._prefixes[sys.intern(prefix)] = rows
+
+    def discard(self, url):
+        """Забыть статью (например, если ее не удалось обработать)"""
+        prefix, tail = split_url(url)
+        tails = self._prefixes.get(prefix)
+        if tails:
+            tails.pop(tail, None)
+
+    def to_json(self):
+        """
+        Сериализуемое представление состояния (формат 2)
+
+        Версии записываются один раз в таблицу, а статьи ссылаются на них по номеру.
+        """
+        version_ids = {}
+        prefixes = {}
+        for prefix, tails in self._prefixes.items():
+            prefixes[prefix] = [
+                [tail, version_ids.setdefault(version, len(version_ids))]
+                for tail, version in tails.items()
+            ]
+        return {
+            'format': STATE_FORMAT,
+            'versions': [list(version) for version in version_ids],
+            'prefixes': prefixes,
+            'recent': list(self.recent),
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Восстановить состояние из to_json() или из словаря {URL: строка версии} формата 1
+
+        :param data: Загруженный JSON
+        :return: ArticleState
+        """
+        if data.get('format') != STATE_FORMAT:
+            # Формат 1 хранил только статьи последнего запуска - они и считаются последними
+            state = cls(recent=list(data)[-DEDUP_HISTORY:])
+            for url, text in data.items():
+                state.set(url, parse_version(text))
+            state.compact()
+            return state
+
+        state = cls(recent=data.get('recent', ()))
+        versions = [state.version(*parts) for parts in data['versions']]
+        for prefix, rows in data['prefixes'].items():
+            state.set_group(prefix, {tail: versions[version_id] for tail, version_id in rows})
+        state.compact()
+        return state
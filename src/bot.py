@@ -1,6 +1,8 @@
+import asyncio
 import logging
 import os
 import sys
+from datetime import datetime
 from pathlib import Path
 
 # Добавляем корневой каталог в путь импорта
@@ -9,9 +11,24 @@ sys.path.append(str(root_dir))
 
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, CallbackQueryHandler
-from src.config import TOKEN, SITEMAP_URL, DIGEST_CHAT_ID, MAX_ARTICLES_IN_DIGEST, DIGEST_INTERVAL_HOURS, ADMIN_ID
-from src.sitemap_parser import SitemapParser
+from src.config import TOKEN, SOURCE_TYPE, SITEMAP_URL, FEED_URL, DIGEST_CHAT_ID, MAX_ARTICLES_IN_DIGEST, DIGEST_INTERVAL_HOURS, ADMIN_ID
+from src.sources import create_parser
 from src.scheduler import DigestScheduler
+from src.metrics import registry as metrics_registry, track_run
+from src.digest_renderer import render_digest_chunks, send_digest_chunks
+from src.search_index import SEARCH_ENABLED, search_index
+from src.article_archive import ARCHIVE_ENABLED, article_archive, parse_window
+from src.rate_limit import rate_limiter, format_retry_message
+from src.profiling import profile
+from src.update_processor import ChatOrderedUpdateProcessor, UPDATE_WORKERS
+from src.resilience import breakers
+from src.sharding import check_shared_storage
+from src.digest_lease import collect_exclusive
+from src.subscriptions import (
+    DEFAULT_SOURCE, MAX_SOURCES_PER_CHAT, MAX_SOURCES_TOTAL, check_source_host, format_sources, parse_subscribe_args,
+    source_label
+)
+from api.utils.storage import USE_KV, get_chat_sources, get_subscriptions, kv_available, subscribe, unsubscribe
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,6 +40,8 @@ logger = logging.getLogger(__name__)
 # Глобальные переменные
 sitemap_parser = None
 digest_scheduler = None
+# Последний собранный дайджест (показывается при превышении лимита запросов)
+last_digest = {'articles': None, 'time': None}
 
 # Константы для callback данных
 CHECK_NOW_CALLBACK = "check_now"
@@ -66,39 +85,53 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         '🔹 /start - запустить бота\n'
         '🔹 /help - показать это сообщение\n'
         '🔹 /digest - получить свежий дайджест\n'
+        '🔹 /digest 6h или /digest since 2025-04-27 - статьи за период\n'
         '🔹 /status - проверить статус бота\n'
         '🔹 /settings - настройки уведомлений\n'
-        f'🔹 /setchat - установить чат для дайджеста (только для админа)\n\n'
+        '🔹 /subscribe <URL> - подписать чат на sitemap (feed <URL> - на ленту)\n'
+        '🔹 /unsubscribe <URL|all> - отписать чат от источника\n'
+        '🔹 /sources - подписки чата\n'
+        '🔹 /search <запрос> - найти собранные статьи\n'
+        f'🔹 /setchat - установить чат для дайджеста (только для админа)\n'
+        f'🔹 /profile - профилировать сбор дайджеста (только для админа)\n\n'
         f'⏰ Автоматическая отправка дайджеста: каждые {DIGEST_INTERVAL_HOURS} часов\n'
         f'📊 Максимум статей в дайджесте: {MAX_ARTICLES_IN_DIGEST}',
         reply_markup=reply_markup
     )
 
-async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обработчик команды /digest"""
-    if not sitemap_parser:
-        await update.message.reply_text('❌ Ошибка: парсер не инициализирован')
-        return
+async def deliver_digest(edit_text, send_message):
+    """
+    Собрать свежий дайджест и показать его, отредактировав сообщение о прогрессе
     
-    progress_message = await update.message.reply_text('🔄 Собираю свежие новости... Пожалуйста, подождите.')
+    Если дайджест не помещается в одно сообщение, остальные части отправляются новыми сообщениями.
     
-    try:
-        articles = sitemap_parser.parse_sitemap()
+    :param edit_text: Функция редактирования сообщения (message.edit_text или query.edit_message_text)
+    :param send_message: Функция отправки нового сообщения в тот же чат
+    """
+    with track_run('interactive'):
+        # Источник собирает только один процесс; если сбор уже идет, используется его результат
+        articles = await collect_exclusive(sitemap_parser)
+        if articles is None:
+            await edit_text('⏳ Дайджест сейчас собирает другой процесс. Попробуйте через минуту.')
+            return
+        
+        if articles:
+            # Запоминаем дайджест, чтобы показать его вместо нового сбора при превышении лимита запросов
+            last_digest['articles'] = articles
+            last_digest['time'] = datetime.now()
         
         if not articles:
             keyboard = [
                 [InlineKeyboardButton("🔄 Проверить снова", callback_data=CHECK_NOW_CALLBACK)]
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
-            await progress_message.edit_text(
+            await edit_text(
                 '📭 Новых статей пока нет.\n'
                 'Попробуйте проверить позже.',
                 reply_markup=reply_markup
             )
             return
         
-        digest_text = sitemap_parser.format_digest(articles, MAX_ARTICLES_IN_DIGEST)
-        
         keyboard = [
             [
                 InlineKeyboardButton("🔄 Обновить", callback_data=CHECK_NOW_CALLBACK),
@@ -107,12 +140,76 @@ async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ]
         reply_markup = InlineKeyboardMarkup(keyboard)
         
-        await progress_message.edit_text(
-            f'📰 Свежий дайджест:\n\n{digest_text}',
-            parse_mode='Markdown',
-            disable_web_page_preview=True,
-            reply_markup=reply_markup
+        chunks = sitemap_parser.iter_digest_chunks(
+            articles, MAX_ARTICLES_IN_DIGEST, header='📰 Свежий дайджест:'
         )
+        await send_digest_chunks(chunks, send_message, edit_first=edit_text, reply_markup=reply_markup)
+
+async def deliver_cached_digest(edit_text, send_message, retry_after):
+    """
+    Ответить на запрос дайджеста сверх лимита без нового сбора статей
+    
+    Показывается последний собранный дайджест, а если его нет - сообщение о лимите.
+    
+    :param edit_text: Функция для первого сообщения (редактирование или ответ)
+    :param send_message: Функция отправки нового сообщения в тот же чат
+    :param retry_after: Через сколько секунд можно запросить новый дайджест
+    """
+    if not last_digest['articles']:
+        await edit_text(format_retry_message(retry_after))
+        return
+    
+    header = f"📦 Последний дайджест ({last_digest['time'].strftime('%H:%M')}). {format_retry_message(retry_after)}"
+    chunks = sitemap_parser.iter_digest_chunks(last_digest['articles'], MAX_ARTICLES_IN_DIGEST, header=header)
+    await send_digest_chunks(chunks, send_message, edit_first=edit_text)
+
+async def deliver_range_digest(update: Update, args):
+    """Показать статьи за период из архива (/digest 6h, /digest since 2025-04-27) без нового сбора"""
+    if not ARCHIVE_ENABLED:
+        await update.message.reply_text(
+            '📭 Архив статей отключен. На Vercel архив теряется при холодном старте, '
+            'поэтому дайджест за период работает в боте, запущенном как worker (Procfile)'
+        )
+        return
+    
+    since, label = parse_window(args)
+    if since is None:
+        await update.message.reply_text(label)
+        return
+    
+    articles, truncated = await asyncio.to_thread(article_archive.window, since)
+    if not articles:
+        await update.message.reply_text(f'📭 В архиве нет статей {label}')
+        return
+    
+    # Период длиннее ARCHIVE_MAX_RESULTS статей: показаны только самые новые, и об этом нужно сказать
+    header = f'Показаны последние {len(articles)} статей периода, уточните период' if truncated else None
+    chunks = render_digest_chunks(articles, len(articles), header=header, title=f'Дайджест {label}')
+    await send_digest_chunks(chunks, update.effective_chat.send_message)
+
+async def digest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /digest (с периодом - статьи за период из архива)"""
+    if context.args:
+        retry_after = await rate_limiter.acquire(update.effective_user.id, 'digest_range')
+        if retry_after:
+            await update.message.reply_text(format_retry_message(retry_after))
+        else:
+            await deliver_range_digest(update, context.args)
+        return
+    
+    retry_after = await rate_limiter.acquire(update.effective_user.id, 'digest')
+    if retry_after:
+        await deliver_cached_digest(update.message.reply_text, update.effective_chat.send_message, retry_after)
+        return
+    
+    if not sitemap_parser:
+        await update.message.reply_text('❌ Ошибка: парсер не инициализирован')
+        return
+    
+    progress_message = await update.message.reply_text('🔄 Собираю свежие новости... Пожалуйста, подождите.')
+    
+    try:
+        await deliver_digest(progress_message.edit_text, update.effective_chat.send_message)
     except Exception as e:
         logger.error(f"Ошибка при формировании дайджеста: {e}")
         await progress_message.edit_text(
@@ -127,17 +224,35 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     status = "✅ работает" if digest_scheduler.is_running else "⛔️ остановлен"
-    chat_id = digest_scheduler.digest_chat_id or "Не установлен"
+    subscriptions = await get_subscriptions()
+    subscribed = {source_id for source_ids in subscriptions.values() for source_id in source_ids}
+    sources_count = len(subscribed)
+    shard = ''
+    if digest_scheduler.membership:
+        urls = [digest_scheduler.sources.url(source_id) for source_id in subscribed]
+        shard = f'🔹 Шардирование: {digest_scheduler.membership.format_status(urls)}\n'
     
     await update.message.reply_text(
         '📊 Статус бота:\n\n'
-        f'🔹 Мониторинг: {SITEMAP_URL}\n'
+        f'🔹 Мониторинг: {sitemap_parser.source_url}\n'
         f'🔹 Интервал проверки: {DIGEST_INTERVAL_HOURS} часов\n'
         f'🔹 Статус планировщика: {status}\n'
-        f'🔹 Чат для дайджеста: {chat_id}\n'
-        f'🔹 Максимум статей: {MAX_ARTICLES_IN_DIGEST}'
+        f'🔹 Подписано чатов: {len(subscriptions)}, источников: {sources_count}\n'
+        f'🔹 Максимум статей: {MAX_ARTICLES_IN_DIGEST}\n'
+        f'🔹 Обновления: {update_processor_status(context.application)}\n'
+        f'{shard}'
+        f'🔹 Недоступные хосты: {breakers.format_status()}\n\n'
+        f'⏱ Метрики дайджеста:\n{metrics_registry.format_status()}'
     )
 
+def update_processor_status(application):
+    """Сводка по очереди и обработчикам обновлений"""
+    processor = application.update_processor
+    queued = application.update_queue.qsize()
+    if isinstance(processor, ChatOrderedUpdateProcessor):
+        return processor.format_status(queued)
+    return f"в очереди {queued}"
+
 async def settings_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /settings"""
     keyboard = [
@@ -166,8 +281,9 @@ async def setchat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text('❌ Ошибка: планировщик не инициализирован')
         return
     
-    # Устанавливаем ID текущего чата для отправки дайджеста
+    # Подписываем текущий чат на источник по умолчанию
     digest_scheduler.digest_chat_id = chat_id
+    await subscribe(chat_id, DEFAULT_SOURCE)
     
     await update.message.reply_text(
         f'✅ Чат успешно установлен\n\n'
@@ -175,6 +291,114 @@ async def setchat_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f'🔹 Дайджесты будут отправляться сюда каждые {DIGEST_INTERVAL_HOURS} часов'
     )
 
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /subscribe: подписать чат на источник"""
+    source_id, error_text = parse_subscribe_args(context.args)
+    if error_text:
+        await update.message.reply_text(error_text)
+        return
+    
+    retry_after = await rate_limiter.acquire(update.effective_user.id, 'subscribe')
+    if retry_after:
+        await update.message.reply_text(format_retry_message(retry_after))
+        return
+    
+    # Источник загружает бот, поэтому адреса внутренней сети не принимаются
+    error_text = await check_source_host(source_id)
+    if error_text:
+        await update.message.reply_text(error_text)
+        return
+    
+    label = source_label(source_id, sitemap_parser.source_url)
+    if await subscribe(update.effective_chat.id, source_id, MAX_SOURCES_PER_CHAT, MAX_SOURCES_TOTAL):
+        await update.message.reply_text(
+            f'✅ Чат подписан на {label}\n'
+            f'🔹 Дайджест будет приходить каждые {DIGEST_INTERVAL_HOURS} часов'
+        )
+        return
+    
+    chat_sources = await get_chat_sources(update.effective_chat.id)
+    if source_id in chat_sources:
+        await update.message.reply_text(f'ℹ️ Чат уже подписан на {label}')
+    elif len(chat_sources) >= MAX_SOURCES_PER_CHAT:
+        await update.message.reply_text(f'❌ Не более {MAX_SOURCES_PER_CHAT} источников на чат')
+    else:
+        await update.message.reply_text(f'❌ Достигнут общий лимит источников ({MAX_SOURCES_TOTAL}), подписка невозможна')
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /unsubscribe: отписать чат от источника или от всех (all)"""
+    if context.args and context.args[0] == 'all':
+        source_id, error_text = None, None
+    else:
+        source_id, error_text = parse_subscribe_args(context.args, validate=False)
+    if error_text:
+        await update.message.reply_text(error_text)
+        return
+    
+    if await unsubscribe(update.effective_chat.id, source_id):
+        label = source_label(source_id, sitemap_parser.source_url) if source_id else 'все источники'
+        await update.message.reply_text(f'✅ Чат отписан: {label}')
+    else:
+        await update.message.reply_text('ℹ️ Чат не подписан на этот источник. Список подписок: /sources')
+
+async def sources_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /sources: подписки чата"""
+    source_ids = await get_chat_sources(update.effective_chat.id)
+    await update.message.reply_text(format_sources(source_ids, sitemap_parser.source_url))
+
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /search: поиск по собранным статьям"""
+    if not SEARCH_ENABLED:
+        await update.message.reply_text(
+            '🔎 Поиск по статьям отключен. На Vercel индекс теряется при холодном старте, '
+            'поэтому поиск работает в боте, запущенном как worker (Procfile)'
+        )
+        return
+    
+    query = ' '.join(context.args or [])
+    if not query:
+        await update.message.reply_text('🔎 Укажите запрос: /search <слова из заголовка>')
+        return
+    
+    retry_after = await rate_limiter.acquire(update.effective_user.id, 'search')
+    if retry_after:
+        await update.message.reply_text(format_retry_message(retry_after))
+        return
+    
+    results = await asyncio.to_thread(search_index.search, query)
+    if not results:
+        await update.message.reply_text(f'🔎 По запросу «{query}» ничего не найдено')
+        return
+    
+    chunks = render_digest_chunks(results, len(results), title=f'Найдено по запросу «{query}»', footer=None)
+    await send_digest_chunks(chunks, update.effective_chat.send_message)
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Обработчик команды /profile: собрать дайджест под профилировщиком (только для админа)"""
+    # Профилирование замедляет сбор и раскрывает внутренности бота, поэтому без ADMIN_ID команда недоступна
+    if not ADMIN_ID or str(update.effective_user.id) != ADMIN_ID:
+        await update.message.reply_text('⛔️ У вас нет прав для выполнения этой команды')
+        return
+    
+    retry_after = await rate_limiter.acquire(update.effective_user.id, 'profile')
+    if retry_after:
+        await update.message.reply_text(format_retry_message(retry_after))
+        return
+    
+    if not sitemap_parser:
+        await update.message.reply_text('❌ Ошибка: парсер не инициализирован')
+        return
+    
+    progress_message = await update.message.reply_text('🔬 Собираю дайджест с профилированием...')
+    
+    try:
+        with profile('digest') as report:
+            await deliver_digest(progress_message.edit_text, update.effective_chat.send_message)
+        await update.message.reply_text(report.to_text(max_length=4000))
+    except Exception as e:
+        logger.error(f"Ошибка при профилировании дайджеста: {e}")
+        await update.message.reply_text('❌ Ошибка при профилировании дайджеста')
+
 # Обработчик для inline кнопок
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик нажатий inline кнопок"""
@@ -182,6 +406,11 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     
     if query.data == CHECK_NOW_CALLBACK:
+        retry_after = await rate_limiter.acquire(update.effective_user.id, 'check_now')
+        if retry_after:
+            await deliver_cached_digest(query.edit_message_text, update.effective_chat.send_message, retry_after)
+            return
+        
         await query.edit_message_text("🔄 Собираю свежие новости... Пожалуйста, подождите.")
         
         if not sitemap_parser:
@@ -189,36 +418,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         try:
-            articles = sitemap_parser.parse_sitemap()
-            
-            if not articles:
-                keyboard = [
-                    [InlineKeyboardButton("🔄 Проверить снова", callback_data=CHECK_NOW_CALLBACK)]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await query.edit_message_text(
-                    '📭 Новых статей пока нет.\n'
-                    'Попробуйте проверить позже.',
-                    reply_markup=reply_markup
-                )
-                return
-            
-            digest_text = sitemap_parser.format_digest(articles, MAX_ARTICLES_IN_DIGEST)
-            
-            keyboard = [
-                [
-                    InlineKeyboardButton("🔄 Обновить", callback_data=CHECK_NOW_CALLBACK),
-                    InlineKeyboardButton("⚙️ Настройки", callback_data=SETTINGS_CALLBACK)
-                ]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            await query.edit_message_text(
-                f'📰 Свежий дайджест:\n\n{digest_text}',
-                parse_mode='Markdown',
-                disable_web_page_preview=True,
-                reply_markup=reply_markup
-            )
+            await deliver_digest(query.edit_message_text, update.effective_chat.send_message)
         except Exception as e:
             logger.error(f"Ошибка при обработке кнопки check_now: {e}")
             await query.edit_message_text(
@@ -265,12 +465,39 @@ async def error(update, context):
     """Логирование ошибок, вызванных обновлениями."""
     logger.error(f'Произошла ошибка: {context.error} при обработке {update}')
 
+def check_storage():
+    """
+    Проверить общее хранилище до запуска
+    
+    Аренды источников защищают от двойной рассылки, только если worker и cron на Vercel видят
+    одно хранилище. При STORAGE_KV=1 без настроенного Vercel KV бот не запускается: иначе он
+    молча перешел бы на хранилище в памяти без файла, и подписки терялись бы при перезапуске.
+    При SHARDING=1 без общего хранилища бот тоже не запускается (см. check_shared_storage).
+    
+    :return: True, если можно запускать
+    """
+    if USE_KV and not kv_available():
+        logger.error("STORAGE_KV=1, но Vercel KV недоступен (VERCEL_KV_URL, VERCEL_KV_REST_API_TOKEN). "
+                     "Бот не запущен; для работы без общего хранилища задайте STORAGE_KV=0")
+        return False
+    error = check_shared_storage()
+    if error:
+        logger.error(f"{error}. Бот не запущен")
+        return False
+    if not USE_KV:
+        logger.warning("Хранилище в памяти процесса (STORAGE_KV=0): аренды не видны cron на Vercel и другим "
+                       "worker, поэтому при их одновременной работе дайджест может быть отправлен дважды")
+    return True
+
 def main():
     """Запуск бота."""
     global sitemap_parser, digest_scheduler
     
+    if not check_storage():
+        sys.exit(1)
+    
     # Инициализируем парсер и планировщик
-    sitemap_parser = SitemapParser(SITEMAP_URL)
+    sitemap_parser = create_parser(SOURCE_TYPE, SITEMAP_URL, FEED_URL)
     digest_scheduler = DigestScheduler(
         sitemap_parser=sitemap_parser,
         digest_chat_id=DIGEST_CHAT_ID,
@@ -279,8 +506,13 @@ def main():
         bot_token=TOKEN
     )
     
-    # Создаем приложение
-    application = Application.builder().token(TOKEN).build()
+    # Создаем приложение: обновления разных чатов обрабатываются параллельно, одного чата - по порядку
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(ChatOrderedUpdateProcessor(UPDATE_WORKERS))
+        .build()
+    )
     
     # Добавляем обработчики команд
     application.add_handler(CommandHandler("start", start_command))
@@ -289,6 +521,11 @@ def main():
     application.add_handler(CommandHandler("status", status_command))
     application.add_handler(CommandHandler("settings", settings_command))
     application.add_handler(CommandHandler("setchat", setchat_command))
+    application.add_handler(CommandHandler("subscribe", subscribe_command))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    application.add_handler(CommandHandler("sources", sources_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(CommandHandler("profile", profile_command))
     
     # Добавляем обработчик callback от inline кнопок
     application.add_handler(CallbackQueryHandler(button_callback))
@@ -301,12 +538,8 @@ def main():
     
     logger.info("Бот запущен. Нажмите Ctrl+C для остановки.")
     
-    # Запускаем планировщик
-    if digest_scheduler.digest_chat_id:
-        digest_scheduler.start()
-        logger.info(f"Планировщик запущен с интервалом {DIGEST_INTERVAL_HOURS} часов.")
-    else:
-        logger.warning("Планировщик не запущен: ID чата для дайджеста не установлен. Используйте /setchat")
+    # Запускаем планировщик: дайджесты рассылаются по подпискам чатов (/subscribe, /setchat)
+    digest_scheduler.start()
     
     # Запускаем бота в режиме long polling
     application.run_polling()
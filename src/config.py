@@ -10,9 +10,13 @@ if not TOKEN:
     raise ValueError("Не задан TELEGRAM_BOT_TOKEN в .env файле")
 
 # Настройки парсинга
+SOURCE_TYPE = os.getenv('SOURCE_TYPE', 'sitemap')  # Тип источника: sitemap, feed или feed+sitemap
 SITEMAP_URL = os.getenv('SITEMAP_URL')  # URL для sitemap.xml
-if not SITEMAP_URL:
+FEED_URL = os.getenv('FEED_URL')  # URL ленты RSS/Atom
+if SOURCE_TYPE != 'feed' and not SITEMAP_URL:
     raise ValueError("Не задан SITEMAP_URL в .env файле")
+if SOURCE_TYPE in ('feed', 'feed+sitemap') and not FEED_URL:
+    raise ValueError("Не задан FEED_URL в .env файле")
 
 # Настройки дайджеста
 DIGEST_CHAT_ID = os.getenv('DIGEST_CHAT_ID')  # ID чата для отправки дайджеста
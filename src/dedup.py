@@ -0,0 +1,211 @@
+import hashlib
+import logging
+import os
+import random
+import re
+from functools import lru_cache
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# Максимальное расстояние Хэмминга между SimHash, при котором тексты считаются почти одинаковыми
+DEDUP_MAX_DISTANCE = int(os.getenv('DEDUP_MAX_DISTANCE', '3'))
+# Минимальный коэффициент Жаккара, при котором заголовки считаются почти одинаковыми
+DEDUP_TITLE_SIMILARITY = float(os.getenv('DEDUP_TITLE_SIMILARITY', '0.7'))
+# Сколько последних ранее обработанных URL учитывать при поиске дубликатов
+DEDUP_HISTORY = int(os.getenv('DEDUP_HISTORY', '5000'))
+
+# Минимальное число слов, при котором SimHash достаточно надежен
+MIN_TOKENS = 3
+
+SIMHASH_BITS = 64
+# SimHash slug: для расстояния <= 3 совпадает хотя бы одна из 4 частей по 16 бит (принцип Дирихле)
+_BANDS = 4
+_BAND_BITS = SIMHASH_BITS // _BANDS
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+# MinHash: 32 хеш-функции, LSH по 8 частям из 4 значений
+_MINHASH_PERMUTATIONS = 32
+_MINHASH_ROWS = 4
+_MERSENNE_PRIME = (1 << 61) - 1
+_seed_random = random.Random(42)
+_MINHASH_SEEDS = tuple(
+    (_seed_random.randrange(1, _MERSENNE_PRIME), _seed_random.randrange(0, _MERSENNE_PRIME))
+    for _ in range(_MINHASH_PERMUTATIONS)
+)
+
+# Параметры запроса, которые не меняют содержимое страницы
+TRACKING_PARAMS = re.compile(r'^(utm_\w+|fbclid|gclid|yclid|ysclid|_openstat|ref|from|source|amp)$', re.IGNORECASE)
+
+_TOKEN_RE = re.compile(r'[^\W\d_]{2,}')
+_SLUG_ID_RE = re.compile(r'^(\d{5,})[-_].+$')
+
+
+def canonicalize_url(url):
+    """
+    Привести URL статьи к каноническому виду
+
+    Удаляются параметры отслеживания, фрагмент, www и AMP-варианты адреса,
+    а из последнего сегмента вида "<id>-<slug>.html" остается только числовой id,
+    поэтому смена slug после правки заголовка не создает новую статью.
+    """
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    for prefix in ('www.', 'amp.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+
+    segments = [segment for segment in parts.path.split('/') if segment and segment.lower() != 'amp']
+    if segments:
+        last = re.sub(r'\.amp$', '', segments[-1], flags=re.IGNORECASE)
+        match = _SLUG_ID_RE.match(last)
+        segments[-1] = match.group(1) if match else re.sub(r'\.(html?|php)$', '', last, flags=re.IGNORECASE)
+    path = '/' + '/'.join(segments)
+
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not TRACKING_PARAMS.match(key)
+    ))
+    return urlunsplit(('https', host, path, query, ''))
+
+
+def _tokens(text):
+    """Слова текста без чисел (номера дней и даты не отличают живые ленты друг от друга)"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+def slug_tokens(url):
+    """Слова из slug последнего сегмента URL"""
+    path = urlsplit(url).path.rstrip('/')
+    return _tokens(path.rsplit('/', 1)[-1].replace('-', ' ').replace('_', ' '))
+
+
+@lru_cache(maxsize=65536)
+def _token_vector(token):
+    """Вклад слова в каждый бит SimHash (+1 или -1); слова часто повторяются, поэтому кешируем"""
+    value = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+    return tuple(1 if value >> bit & 1 else -1 for bit in range(SIMHASH_BITS))
+
+
+def simhash(tokens):
+    """64-битный SimHash набора слов"""
+    result = 0
+    for bit, weight in enumerate(map(sum, zip(*map(_token_vector, tokens)))):
+        if weight > 0:
+            result |= 1 << bit
+    return result
+
+
+@lru_cache(maxsize=65536)
+def _token_hash(token):
+    return int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def minhash(tokens):
+    """MinHash-подпись множества слов"""
+    hashes = [_token_hash(token) for token in set(tokens)]
+    return tuple(
+        min((a * value + b) % _MERSENNE_PRIME for value in hashes)
+        for a, b in _MINHASH_SEEDS
+    )
+
+
+def jaccard(first, second):
+    """Коэффициент Жаккара двух множеств"""
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+class SimHashIndex:
+    def __init__(self, max_distance=DEDUP_MAX_DISTANCE):
+        """
+        Индекс SimHash с поиском почти одинаковых отпечатков за O(1)
+
+        :param max_distance: Максимальное расстояние Хэмминга для совпадения (не больше 3)
+        """
+        self.max_distance = min(max_distance, _BANDS - 1)
+        self._bands = [{} for _ in range(_BANDS)]
+
+    def find(self, fingerprint):
+        """Найти ключ почти одинакового отпечатка или None"""
+        for band, index in enumerate(self._bands):
+            for other, key in index.get(fingerprint >> (band * _BAND_BITS) & _BAND_MASK, ()):
+                if bin(fingerprint ^ other).count('1') <= self.max_distance:
+                    return key
+        return None
+
+    def add(self, fingerprint, key):
+        """Добавить отпечаток"""
+        for band, index in enumerate(self._bands):
+            index.setdefault(fingerprint >> (band * _BAND_BITS) & _BAND_MASK, []).append((fingerprint, key))
+
+
+class Deduplicator:
+    def __init__(self, seen_urls=(), max_distance=DEDUP_MAX_DISTANCE, title_similarity=DEDUP_TITLE_SIMILARITY):
+        """
+        Поиск дубликатов статей по каноническому URL, slug и заголовку
+
+        :param seen_urls: Ранее обработанные URL (с ними тоже сравниваются новые статьи)
+        :param max_distance: Максимальное расстояние Хэмминга между SimHash slug
+        :param title_similarity: Минимальный коэффициент Жаккара для почти одинаковых заголовков
+        """
+        self.title_similarity = title_similarity
+        self._canonical = {}
+        self._slugs = SimHashIndex(max_distance)
+        self._title_bands = {}
+        self._seen = set()
+        for url in seen_urls:
+            self._seen.add(url)
+            self._remember_url(url)
+
+    def _remember_url(self, url):
+        self._canonical.setdefault(canonicalize_url(url), url)
+        tokens = slug_tokens(url)
+        if len(tokens) >= MIN_TOKENS:
+            self._slugs.add(simhash(tokens), url)
+
+    def url_duplicate_of(self, url):
+        """
+        Проверить URL до загрузки заголовка и запомнить его
+
+        Обновление уже известной статьи (тот же URL) дубликатом не считается.
+
+        :return: URL статьи, дубликатом которой является url, или None
+        """
+        if url in self._seen:
+            return None
+        self._seen.add(url)
+
+        original = self._canonical.get(canonicalize_url(url))
+        if original is None:
+            tokens = slug_tokens(url)
+            if len(tokens) >= MIN_TOKENS:
+                original = self._slugs.find(simhash(tokens))
+        if original is None:
+            self._remember_url(url)
+        return original
+
+    def title_duplicate_of(self, url, title):
+        """
+        Проверить заголовок после загрузки и запомнить его
+
+        Кандидаты ищутся через LSH по MinHash-подписи, а затем сравниваются точно по Жаккару.
+
+        :return: URL статьи с почти таким же заголовком или None
+        """
+        tokens = frozenset(_tokens(title or ''))
+        if len(tokens) < MIN_TOKENS:
+            return None
+        signature = minhash(tokens)
+        bands = [
+            (band, signature[band * _MINHASH_ROWS:(band + 1) * _MINHASH_ROWS])
+            for band in range(len(signature) // _MINHASH_ROWS)
+        ]
+        for band in bands:
+            for other_url, other_tokens in self._title_bands.get(band, ()):
+                if jaccard(tokens, other_tokens) >= self.title_similarity:
+                    return other_url
+        for band in bands:
+            self._title_bands.setdefault(band, []).append((url, tokens))
+        return None
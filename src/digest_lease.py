@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import os
+import time
+
+from src.article_archive import ARCHIVE_ENABLED, article_archive
+from src.metrics import incr
+from src.profiling import to_thread
+from src.resilience import breakers
+from src.search_index import SEARCH_ENABLED, search_index
+from api.utils.storage import (
+    LEASE_TTL, acquire_lease, article_state_key, get_lease, get_value, release_lease, renew_lease,
+    restore_article_state, restore_breakers, save_article_state, save_breakers, set_value_fenced
+)
+
+logger = logging.getLogger(__name__)
+
+# Сколько ждать результата узла, который уже собирает источник (в секундах)
+LEASE_WAIT = float(os.getenv('LEASE_WAIT', '60'))
+# Интервал проверки результата другого узла (в секундах)
+LEASE_POLL_INTERVAL = float(os.getenv('LEASE_POLL_INTERVAL', '1'))
+
+
+def lease_name(parser):
+    """Имя аренды источника (по ключу его состояния статей)"""
+    return f'digest:{article_state_key(parser)}'
+
+
+async def _keep_renewed(lease):
+    """Продлевать аренду через треть срока, пока идет сбор"""
+    while True:
+        await asyncio.sleep(LEASE_TTL / 3)
+        if not await renew_lease(lease):
+            logger.warning(f"Не удалось продлить аренду {lease['name']} (токен {lease['token']})")
+            return
+
+
+async def wait_result(name, timeout=LEASE_WAIT):
+    """
+    Дождаться результата сбора, который выполняет владелец аренды
+
+    :param name: Имя аренды
+    :param timeout: Сколько ждать (в секундах)
+    :return: Результат {'token', 'articles', 'delivered', 'finished_at'} или None
+    """
+    lease = await get_lease(name)
+    token = lease['token'] if lease else 0
+    deadline = time.monotonic() + timeout
+    while True:
+        result = await get_value(f'result:{name}')
+        if result and result['token'] >= token:
+            return result
+        if time.monotonic() >= deadline:
+            return None
+        await asyncio.sleep(LEASE_POLL_INTERVAL)
+
+
+async def remember_articles(articles):
+    """Добавить собранные статьи в архив и поисковый индекс (повторное добавление статьи ничего не меняет)"""
+    if not articles:
+        return
+    stores = []
+    if ARCHIVE_ENABLED:
+        stores.append(('архива статей', article_archive))
+    if SEARCH_ENABLED:
+        stores.append(('поискового индекса', search_index))
+    for name, store in stores:
+        try:
+            await to_thread(store.add_articles, articles)
+        except Exception as e:
+            incr('errors')
+            logger.error(f"Ошибка обновления {name}: {e}")
+
+
+async def collect_exclusive(parser, delivers=False, wait=LEASE_WAIT):
+    """
+    Собрать новые статьи источника под арендой: один узел собирает, остальные используют его результат
+
+    Владелец аренды загружает состояние статей и размыкателей цепей из хранилища, собирает статьи
+    в отдельном потоке, сохраняет состояние и публикует результат. Каждая запись атомарно проверяет, что аренда не перешла
+    к другому узлу (токен ограждения не сменился), поэтому узел, приостановленный после сбора,
+    не перезапишет результат нового владельца. Остальные узлы ждут опубликованный результат.
+
+    :param parser: Источник статей
+    :param delivers: Запуск рассылает дайджест подписчикам (планировщик, cron). Если результат
+        другого узла уже разослан, такой запуск пропускает источник
+    :param wait: Сколько ждать результата другого узла (в секундах)
+    :return: Список новых статей или None, если обрабатывать нечего
+    """
+    name = lease_name(parser)
+    lease = await acquire_lease(name)
+    if lease is None:
+        incr('lease_waits')
+        logger.info(f"Источник {parser.source_url} уже собирает другой процесс, ждем результат")
+        result = await wait_result(name, wait)
+        if result is None:
+            logger.warning(f"Не дождались результата сбора {parser.source_url}")
+            return None
+        await remember_articles(result['articles'])
+        if delivers and result['delivered']:
+            return None
+        return result['articles']
+
+    renewer = asyncio.create_task(_keep_renewed(lease))
+    try:
+        await restore_article_state(parser)
+        await restore_breakers(breakers)
+        saved_at = parser.last_articles.saved_at
+        try:
+            articles = await to_thread(parser.get_new_articles)
+        finally:
+            # Цепи сохраняются и после ошибки сбора: именно тогда они размыкаются
+            await save_breakers(breakers)
+
+        # Токен ограждения: если аренда истекла и ее взял другой узел, результат этого узла не записывается
+        result = {
+            'token': lease['token'],
+            'articles': articles,
+            'delivered': delivers,
+            'finished_at': time.time(),
+        }
+        if not (await save_article_state(parser, saved_at, lease)
+                and await set_value_fenced(f'result:{name}', result, lease, LEASE_TTL)):
+            incr('errors')
+            logger.error(f"Аренда {name} (токен {lease['token']}) утрачена во время сбора, результат отброшен")
+            return None
+        await remember_articles(articles)
+        return articles
+    finally:
+        renewer.cancel()
+        await release_lease(lease)
@@ -0,0 +1,142 @@
+import logging
+import re
+from datetime import datetime
+from itertools import islice
+
+from src.metrics import stage
+
+logger = logging.getLogger(__name__)
+
+# Максимальная длина сообщения в Telegram
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Режим разметки сообщений дайджеста
+PARSE_MODE = 'MarkdownV2'
+
+# Символы, которые необходимо экранировать в MarkdownV2
+_MARKDOWN_V2_SPECIAL = re.compile(r'([\\_*\[\]()~`>#+\-=|{}.!])')
+
+DIGEST_FOOTER = "🤖 Бот автоматически собирает новости каждый час"
+
+
+def escape_markdown(text):
+    """Экранировать текст для MarkdownV2"""
+    return _MARKDOWN_V2_SPECIAL.sub(r'\\\1', str(text))
+
+
+def _truncate(text, size):
+    """Обрезать текст так, чтобы после экранирования для MarkdownV2 он занимал не больше size символов"""
+    text = str(text)
+    if len(escape_markdown(text)) <= size:
+        return text
+    used = 0
+    for index, char in enumerate(text):
+        used += len(escape_markdown(char))
+        if used > size - 1:
+            return text[:index] + '…'
+    return text
+
+
+def _render_article(number, article, limit):
+    """
+    Отформатировать одну статью дайджеста
+
+    Слишком длинный заголовок обрезается, чтобы статья поместилась в limit символов. Если не помещается
+    даже адрес, статья пропускается: обрезанная ссылка никуда не ведет.
+
+    :return: Текст статьи или None
+    """
+    url = escape_markdown(article['url'])
+    prefix = f"*{number}\\. "
+    suffix = f"*\n{url}\n\n"
+    room = limit - len(prefix) - len(suffix)
+    if room < 1:
+        return None
+    return f"{prefix}{escape_markdown(_truncate(article['title'], room))}{suffix}"
+
+
+def render_digest_chunks(articles, max_articles=10, header=None, footer=DIGEST_FOOTER,
+                         limit=TELEGRAM_MESSAGE_LIMIT, title=None):
+    """
+    Лениво сформировать дайджест в виде частей, каждая из которых помещается в одно сообщение
+
+    Статьи упаковываются жадно в порядке следования, поэтому число сообщений минимально,
+    а нумерация статей сквозная для всех частей. Заголовок дайджеста занимает не больше половины
+    сообщения и всегда отправляется вместе с первой статьей; статья, адрес которой не помещается
+    в сообщение, пропускается.
+
+    :param articles: Список или итератор статей ({'url', 'title'})
+    :param max_articles: Максимальное число статей в дайджесте
+    :param header: Дополнительная строка перед заголовком дайджеста (без разметки)
+    :param footer: Подпись в конце дайджеста (без разметки)
+    :param limit: Максимальная длина одного сообщения
+    :param title: Заголовок вместо "Дайджест новостей от <дата>" (без разметки)
+    :return: Генератор текстов сообщений в формате MarkdownV2
+    """
+    if title is None:
+        title = f'Дайджест новостей от {datetime.now().strftime("%d.%m.%Y %H:%M")}'
+    title = f"📰 *{escape_markdown(_truncate(title, limit // 4))}*\n\n"
+    if header:
+        title = f"{escape_markdown(_truncate(header, limit // 4))}\n\n{title}"
+
+    parts = [title]
+    length = len(title)
+    # Есть ли статьи в текущей части: часть из одного заголовка не отправляется
+    chunk_has_articles = False
+    number = 0
+
+    for article in islice(articles, max_articles):
+        # Первая статья части должна поместиться вместе с заголовком
+        entry = _render_article(number + 1, article, limit if chunk_has_articles else limit - length)
+        if entry is None:
+            logger.warning(f"Статья {article['url'][:100]}... не помещается в сообщение и пропущена")
+            continue
+        if length + len(entry) > limit:
+            yield ''.join(parts).rstrip()
+            parts, length = [], 0
+        parts.append(entry)
+        length += len(entry)
+        chunk_has_articles = True
+        number += 1
+
+    if not number:
+        yield escape_markdown("Нет новых статей")
+        return
+
+    if footer:
+        footer = escape_markdown(footer)
+        if length + len(footer) > limit:
+            yield ''.join(parts).rstrip()
+            parts, length = [], 0
+        parts.append(footer)
+
+    if parts:
+        yield ''.join(parts).rstrip()
+
+
+async def send_digest_chunks(chunks, send_message, edit_first=None, reply_markup=None):
+    """
+    Отправить части дайджеста по мере их готовности
+
+    :param chunks: Итератор текстов сообщений
+    :param send_message: Асинхронная функция отправки нового сообщения (text=..., **kwargs)
+    :param edit_first: Асинхронная функция для первой части (например, редактирование сообщения о прогрессе)
+    :param reply_markup: Клавиатура, прикрепляемая к последнему сообщению
+    :return: Число отправленных сообщений
+    """
+    sent = 0
+    chunks = iter(chunks)
+    current = next(chunks, None)
+    while current is not None:
+        # Заглядываем на одну часть вперед, чтобы прикрепить клавиатуру к последнему сообщению
+        following = next(chunks, None)
+        send = edit_first if sent == 0 and edit_first else send_message
+        kwargs = {'parse_mode': PARSE_MODE, 'disable_web_page_preview': True}
+        if following is None and reply_markup is not None:
+            kwargs['reply_markup'] = reply_markup
+        with stage('send'):
+            await send(text=current, **kwargs)
+        sent += 1
+        current = following
+    logger.info(f"Дайджест отправлен частями: {sent}")
+    return sent
@@ -0,0 +1,183 @@
+import logging
+import xml.etree.ElementTree as ET
+from email.utils import parsedate_to_datetime
+
+from src.metrics import stage, incr
+from src.resilience import fetch
+from src.sitemap_parser import SitemapParser
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при потоковой загрузке ленты
+FEED_CHUNK_SIZE = 16 * 1024
+
+
+def _local_name(tag):
+    """Имя тега без пространства имен"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def _normalize_date(value):
+    """Привести дату RSS (RFC 822) к ISO 8601; даты Atom уже в ISO 8601"""
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).isoformat()
+    except (TypeError, ValueError):
+        return value
+
+
+def _item_entry(item):
+    """
+    Преобразовать <item> (RSS) или <entry> (Atom) в запись источника
+
+    :return: Словарь с ключами loc, lastmod, title или None, если нет ссылки
+    """
+    fields = {}
+    for child in item:
+        name = _local_name(child.tag)
+        if name == 'link':
+            # В Atom ссылка в атрибуте href, основная - rel="alternate" или без rel
+            href = child.get('href')
+            if href is not None:
+                if child.get('rel', 'alternate') == 'alternate':
+                    fields.setdefault('link', href.strip())
+            elif child.text:
+                fields.setdefault('link', child.text.strip())
+        elif name in ('title', 'pubDate', 'updated', 'published', 'date', 'guid', 'id') and child.text:
+            fields.setdefault(name, child.text.strip())
+
+    link = fields.get('link') or fields.get('guid') or fields.get('id')
+    if not link or not link.startswith('http'):
+        return None
+
+    lastmod = fields.get('updated') or fields.get('published') or fields.get('date') or fields.get('pubDate')
+    return {
+        'loc': link,
+        'lastmod': _normalize_date(lastmod),
+        'title': fields.get('title'),
+    }
+
+
+class FeedStreamParser:
+    def __init__(self):
+        """Инкрементальный разбор RSS 2.0, RSS 1.0 и Atom по мере поступления данных"""
+        self._parser = ET.XMLPullParser(events=('end',))
+
+    def _drain(self):
+        entries = []
+        for _, elem in self._parser.read_events():
+            if _local_name(elem.tag) in ('item', 'entry'):
+                entry = _item_entry(elem)
+                if entry:
+                    entries.append(entry)
+                elem.clear()
+        return entries
+
+    def feed(self, chunk):
+        """
+        Передать очередной блок данных
+
+        :return: Записи, полностью полученные к этому моменту
+        """
+        self._parser.feed(chunk)
+        return self._drain()
+
+    def close(self):
+        """Завершить разбор и вернуть оставшиеся записи"""
+        self._parser.close()
+        return self._drain()
+
+
+def iter_feed_entries(chunks):
+    """
+    Потоково разобрать ленту RSS/Atom
+
+    :param chunks: Итератор блоков содержимого ленты в байтах
+    :return: Генератор записей (словари с ключами loc, lastmod, title)
+    """
+    parser = FeedStreamParser()
+    for chunk in chunks:
+        yield from parser.feed(chunk)
+    yield from parser.close()
+
+
+class FeedParser(SitemapParser):
+    def __init__(self, feed_url, cache_file='last_articles.json'):
+        """
+        Источник статей на основе RSS/Atom
+
+        Лента уже содержит заголовки и даты публикации, поэтому страницы статей не загружаются.
+        Сравнение с ранее обработанными статьями такое же, как у SitemapParser.
+
+        :param feed_url: URL ленты RSS/Atom
+        :param cache_file: Файл для хранения ранее обработанных статей
+        """
+        super().__init__(None, cache_file)
+        self.feed_url = feed_url
+
+    @property
+    def source_url(self):
+        """URL источника статей"""
+        return self.feed_url
+
+    def _fetch_entries(self):
+        """Потоково загрузить и разобрать ленту"""
+        entries = []
+        received = 0
+        parser = FeedStreamParser()
+        with fetch(self.feed_url, timeout=10, stream=True, public_only=self.public_only) as response:
+            chunks = response.iter_content(chunk_size=FEED_CHUNK_SIZE)
+            while True:
+                # Загрузка и разбор чередуются, поэтому время этапов учитывается поблочно
+                with stage('download'):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                received += len(chunk)
+                with stage('parse'):
+                    entries.extend(parser.feed(chunk))
+            with stage('parse'):
+                entries.extend(parser.close())
+        incr('bytes', received)
+        incr('urls', len(entries))
+
+        logger.info(f"Найдено {len(entries)} записей в ленте {self.feed_url}")
+        return entries
+
+
+class FeedWithSitemapFallback(SitemapParser):
+    def __init__(self, feed_url, sitemap_url, cache_file='last_articles.json'):
+        """
+        Источник статей: лента RSS/Atom с переходом на sitemap.xml при ошибке или пустой ленте
+
+        Состояние у обоих источников общее. Лента содержит лишь последние статьи, поэтому после
+        ее загрузки состояние дополняется, а не заменяется: иначе при следующем переходе на sitemap
+        все статьи, которых нет в ленте, считались бы новыми и отправлялись повторно.
+
+        :param feed_url: URL ленты RSS/Atom
+        :param sitemap_url: URL sitemap.xml
+        :param cache_file: Файл для хранения ранее обработанных статей (общий для обоих источников)
+        """
+        super().__init__(sitemap_url, cache_file)
+        self.feed = FeedParser(feed_url, cache_file)
+
+    @property
+    def source_url(self):
+        """URL источника статей"""
+        return f"{self.feed.feed_url} (резерв: {self.sitemap_url})"
+
+    def _fetch_entries(self):
+        """Загрузить ленту, а при неудаче - sitemap.xml"""
+        self.feed.public_only = self.public_only
+        try:
+            entries = self.feed._fetch_entries()
+            if entries:
+                self.partial_fetch = True
+                return entries
+            logger.warning(f"Лента {self.feed.feed_url} пуста, используем sitemap")
+        except Exception as e:
+            logger.warning(f"Ошибка загрузки ленты {self.feed.feed_url}: {e}. Используем sitemap")
+        # Sitemap содержит все статьи и заменяет состояние целиком (удаленные статьи забываются)
+        self.partial_fetch = False
+        return super()._fetch_entries()
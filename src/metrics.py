@@ -0,0 +1,228 @@
+import hmac
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Этапы конвейера дайджеста в порядке выполнения
+STAGES = ('download', 'parse', 'diff', 'titles', 'format', 'send')
+
+# Счетчики, собираемые за один запуск
+COUNTERS = (
+    'bytes', 'urls', 'new_articles', 'cache_hits', 'sitemap_titles', 'duplicates', 'errors',
+    'retries', 'breaker_rejects', 'sources', 'deliveries', 'lease_waits',
+)
+
+# Перцентили, которые считаются по скользящему окну
+PERCENTILES = (50, 95, 99)
+
+# Размер скользящего окна (число последних запусков)
+METRICS_WINDOW = int(os.getenv('METRICS_WINDOW', '100'))
+
+# Секрет для доступа к эндпоинту метрик; без него эндпоинт отключен
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Заголовок HTTP-запроса с секретом метрик
+METRICS_HEADER = 'X-Metrics-Token'
+
+# Текущий запуск дайджеста (свой для каждого потока и asyncio-задачи)
+_current_run = ContextVar('digest_run', default=None)
+
+
+def metrics_authorized(header_value=None):
+    """
+    Разрешен ли доступ к метрикам
+
+    Метрики раскрывают хосты источников, состояние очереди и размыкателей цепей,
+    поэтому без METRICS_TOKEN эндпоинт недоступен.
+
+    :param header_value: Значение заголовка X-Metrics-Token (если есть)
+    """
+    if not METRICS_TOKEN or not header_value:
+        return False
+    return hmac.compare_digest(header_value.encode('utf-8'), METRICS_TOKEN.encode('utf-8'))
+
+
+class DigestRun:
+    def __init__(self, path):
+        """
+        Метрики одного запуска дайджеста
+
+        :param path: Путь запуска (scheduler, cron, interactive, webhook)
+        """
+        self.path = path
+        self.started_at = datetime.now()
+        self.stages = {}
+        self.counters = dict.fromkeys(COUNTERS, 0)
+        self.total = 0.0
+
+    def add_time(self, stage_name, seconds):
+        """Добавить время выполнения этапа"""
+        self.stages[stage_name] = self.stages.get(stage_name, 0.0) + seconds
+
+    def incr(self, name, value=1):
+        """Увеличить счетчик"""
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        """Представление запуска в виде словаря для JSON"""
+        return {
+            'path': self.path,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'total_ms': round(self.total * 1000, 1),
+            'stages_ms': {name: round(seconds * 1000, 1) for name, seconds in self.stages.items()},
+            'counters': dict(self.counters),
+        }
+
+
+def _percentile(sorted_values, q):
+    """Перцентиль по методу ближайшего ранга"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+class MetricsRegistry:
+    def __init__(self, window=METRICS_WINDOW):
+        """
+        Хранилище метрик запусков со скользящим окном
+
+        :param window: Число последних запусков, по которым считаются перцентили
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self._durations = {}
+        self._totals = dict.fromkeys(COUNTERS, 0)
+        self._runs = 0
+        self._runs_by_path = {}
+        self._recent = deque(maxlen=window)
+        self.last_run = None
+
+    def record(self, run):
+        """Сохранить результаты завершенного запуска"""
+        with self._lock:
+            self._runs += 1
+            self._runs_by_path[run.path] = self._runs_by_path.get(run.path, 0) + 1
+            for name, value in run.counters.items():
+                self._totals[name] = self._totals.get(name, 0) + value
+            for name, seconds in list(run.stages.items()) + [('total', run.total)]:
+                self._durations.setdefault(name, deque(maxlen=self.window)).append(seconds)
+            self._recent.append(run.to_dict())
+            self.last_run = run
+
+    def percentiles(self):
+        """Перцентили длительности этапов (в миллисекундах)"""
+        with self._lock:
+            durations = {name: sorted(values) for name, values in self._durations.items()}
+        result = {}
+        for name in STAGES + ('total',):
+            values = durations.get(name)
+            if not values:
+                continue
+            result[name] = {f'p{q}': round(_percentile(values, q) * 1000, 1) for q in PERCENTILES}
+            result[name]['count'] = len(values)
+        return result
+
+    def snapshot(self):
+        """Полный снимок метрик для HTTP-эндпоинта"""
+        percentiles = self.percentiles()
+        with self._lock:
+            return {
+                'runs': self._runs,
+                'runs_by_path': dict(self._runs_by_path),
+                'window': self.window,
+                'totals': dict(self._totals),
+                'stages': percentiles,
+                'last_run': self.last_run.to_dict() if self.last_run else None,
+                'recent': list(self._recent)[-10:],
+            }
+
+    def format_status(self):
+        """Краткая сводка метрик для команды /status"""
+        if not self.last_run:
+            return '🔹 Метрики: запусков дайджеста еще не было'
+
+        last = self.last_run
+        counters = last.counters
+        lines = [
+            f'🔹 Последний запуск ({last.path}, {last.started_at.strftime("%d.%m.%Y %H:%M")}): '
+            f'{last.total * 1000:.0f} мс',
+            f'🔹 URL: {counters.get("urls", 0)}, новых: {counters.get("new_articles", 0)}, '
+            f'из кеша: {counters.get("cache_hits", 0)}, ошибок: {counters.get("errors", 0)}, '
+            f'загружено: {counters.get("bytes", 0) / 1024:.0f} КБ',
+        ]
+        if counters.get('retries') or counters.get('breaker_rejects'):
+            lines.append(
+                f'🔹 Повторов запросов: {counters.get("retries", 0)}, '
+                f'отклонено размыкателем цепи: {counters.get("breaker_rejects", 0)}'
+            )
+        if counters.get('deliveries'):
+            lines.append(
+                f'🔹 Источников: {counters.get("sources", 0)}, '
+                f'отправлено дайджестов: {counters.get("deliveries", 0)}, '
+                f'ожиданий другого процесса: {counters.get("lease_waits", 0)}'
+            )
+        for name, values in self.percentiles().items():
+            lines.append(
+                f'   • {name}: p50 {values["p50"]:.0f} мс, p95 {values["p95"]:.0f} мс, '
+                f'p99 {values["p99"]:.0f} мс'
+            )
+        return '\n'.join(lines)
+
+
+# Глобальный реестр метрик процесса
+registry = MetricsRegistry()
+
+
+def current_run():
+    """Текущий запуск дайджеста или None"""
+    return _current_run.get()
+
+
+@contextmanager
+def track_run(path):
+    """
+    Отслеживать один запуск дайджеста
+
+    :param path: Путь запуска (scheduler, cron, interactive, webhook)
+    """
+    run = DigestRun(path)
+    token = _current_run.set(run)
+    started = time.perf_counter()
+    try:
+        yield run
+    except Exception:
+        run.incr('errors')
+        raise
+    finally:
+        run.total = time.perf_counter() - started
+        _current_run.reset(token)
+        registry.record(run)
+        logger.info(f"Метрики запуска дайджеста: {run.to_dict()}")
+
+
+@contextmanager
+def stage(name):
+    """Замерить время этапа текущего запуска"""
+    run = _current_run.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if run is not None:
+            run.add_time(name, time.perf_counter() - started)
+
+
+def incr(name, value=1):
+    """Увеличить счетчик текущего запуска (если он есть)"""
+    run = _current_run.get()
+    if run is not None:
+        run.incr(name, value)
@@ -0,0 +1,98 @@
+import atexit
+import logging
+import os
+
+from src.sitemap_parser import SitemapEntry, iter_sitemap_entries
+
+logger = logging.getLogger(__name__)
+
+# Число процессов для разбора sitemap: 1 - разбор в текущем процессе, 0 - по числу ядер.
+# Имеет смысл для worker из Procfile; в Vercel разбор всегда идет в текущем процессе.
+SITEMAP_PARSE_WORKERS = int(os.getenv('SITEMAP_PARSE_WORKERS', '1'))
+# Число потоков для загрузки дочерних sitemap из индекса
+SITEMAP_FETCH_THREADS = int(os.getenv('SITEMAP_FETCH_THREADS', '8'))
+# Максимальное число дочерних sitemap, загружаемых из индекса
+MAX_CHILD_SITEMAPS = int(os.getenv('MAX_CHILD_SITEMAPS', '500'))
+# Максимальная вложенность индексов sitemap
+MAX_INDEX_DEPTH = 2
+
+# Поля компактной записи, которую процесс-обработчик возвращает вместо словаря
+ROW_FIELDS = ('loc', 'lastmod', 'changefreq', 'priority', 'title')
+
+_executor = None
+_executor_workers = None
+
+
+def parse_workers():
+    """Фактическое число процессов для разбора sitemap"""
+    if os.environ.get('VERCEL', '0') == '1':
+        return 1
+    return SITEMAP_PARSE_WORKERS or os.cpu_count() or 1
+
+
+def parse_sitemap_rows(source):
+    """
+    Разобрать один sitemap (выполняется в процессе-обработчике)
+
+    :param source: Содержимое sitemap в байтах или путь к файлу
+    :return: Кортеж (URL дочерних sitemap, записи в виде кортежей по ROW_FIELDS)
+    """
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            source = f.read()
+
+    children = []
+    rows = []
+    for entry in iter_sitemap_entries(source, include_index=True):
+        if entry.sitemap:
+            children.append(entry.loc)
+        else:
+            rows.append((entry.loc, entry.lastmod or entry.published, entry.changefreq, entry.priority, entry.title))
+    return children, rows
+
+
+def row_to_entry(row):
+    """Преобразовать компактную запись обратно в запись sitemap"""
+    return SitemapEntry(*row)
+
+
+def _get_executor(workers):
+    """Пул процессов переиспользуется между запусками, чтобы не платить за старт процессов каждый раз"""
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != workers:
+        from concurrent.futures import ProcessPoolExecutor
+        import multiprocessing
+
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        # spawn вместо fork: бот многопоточный, а fork копирует захваченные другими потоками блокировки
+        _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        _executor_workers = workers
+        logger.info(f"Запущен пул из {workers} процессов для разбора sitemap")
+    return _executor
+
+
+@atexit.register
+def shutdown():
+    """Остановить пул процессов"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def parse_sitemaps(sources, workers=None):
+    """
+    Разобрать несколько sitemap, при необходимости в пуле процессов
+
+    Разбор XML ограничен GIL, поэтому большие индексы sitemap разбираются параллельно
+    в отдельных процессах, а в основной процесс возвращаются только компактные кортежи.
+
+    :param sources: Список содержимого sitemap (байты) или путей к файлам
+    :param workers: Число процессов (по умолчанию parse_workers())
+    :return: Список результатов parse_sitemap_rows в порядке sources
+    """
+    workers = workers or parse_workers()
+    if workers <= 1 or len(sources) <= 1:
+        return [parse_sitemap_rows(source) for source in sources]
+    return list(_get_executor(workers).map(parse_sitemap_rows, sources))
@@ -0,0 +1,217 @@
+import asyncio
+import contextvars
+import io
+import logging
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Профилирование каждого вызова (включается переменной окружения)
+PROFILE_ENABLED = os.getenv('PROFILE_ENABLED', '0') == '1'
+# Секрет для включения профилирования отдельного запроса заголовком X-Profile-Token
+PROFILE_TOKEN = os.getenv('PROFILE_TOKEN')
+# Число самых затратных функций и мест выделения памяти в отчете
+PROFILE_TOP_N = int(os.getenv('PROFILE_TOP_N', '25'))
+# Каталог для сохранения отчетов (на Vercel доступен только /tmp)
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp' if os.environ.get('VERCEL', '0') == '1' else 'profiles')
+
+# Заголовок HTTP-запроса для профилирования отдельного вызова
+PROFILE_HEADER = 'X-Profile-Token'
+
+# Профилировщики рабочих потоков активного профилирования (контекст передается в поток через to_thread)
+_thread_profilers = contextvars.ContextVar('thread_profilers', default=None)
+
+
+class ProfileReport:
+    def __init__(self, label):
+        """
+        Результаты профилирования одного вызова
+
+        :param label: Название профилируемого вызова (cron, webhook, digest)
+        """
+        self.label = label
+        self.started_at = datetime.now()
+        self.duration = 0.0
+        self.peak_bytes = 0
+        self.hotspots = ''
+        self.allocations = []
+        self.path = None
+        # Профилирование не выполнялось: уже работал другой профилировщик
+        self.skipped = False
+
+    def to_dict(self):
+        """Представление отчета в виде словаря для хранилища"""
+        return {
+            'label': self.label,
+            'started_at': self.started_at.isoformat(timespec='seconds'),
+            'duration_ms': round(self.duration * 1000, 1),
+            'peak_kb': round(self.peak_bytes / 1024, 1),
+            'hotspots': self.hotspots,
+            'allocations': self.allocations,
+            'path': self.path,
+            'skipped': self.skipped,
+        }
+
+    def to_text(self, max_length=None):
+        """
+        Текстовый отчет
+
+        :param max_length: Максимальная длина текста (например, для сообщения Telegram)
+        """
+        if self.skipped:
+            return (f'Профиль: {self.label} не собран - уже выполняется другое профилирование '
+                    f'(длительность {self.duration * 1000:.0f} мс)')
+        lines = [
+            f'Профиль: {self.label} ({self.started_at.strftime("%d.%m.%Y %H:%M:%S")})',
+            f'Длительность: {self.duration * 1000:.0f} мс',
+            f'Пиковая память: {self.peak_bytes / 1024:.0f} КБ',
+            '',
+            'Выделения памяти:',
+        ]
+        lines.extend(self.allocations)
+        lines.extend(['', 'Горячие точки:', self.hotspots])
+        text = '\n'.join(lines)
+        if max_length and len(text) > max_length:
+            text = text[:max_length - 1] + '…'
+        return text
+
+
+def should_profile(header_value=None):
+    """
+    Нужно ли профилировать текущий вызов
+
+    :param header_value: Значение заголовка X-Profile-Token (если есть)
+    """
+    if PROFILE_ENABLED:
+        return True
+    return bool(PROFILE_TOKEN and header_value and header_value == PROFILE_TOKEN)
+
+
+@contextmanager
+def profile(label, top_n=PROFILE_TOP_N):
+    """
+    Профилировать блок кода с помощью cProfile и tracemalloc
+
+    Профилировщик фиксирует все, что выполняется в текущем потоке, поэтому
+    в цикле asyncio в отчет попадут и параллельно выполняющиеся задачи.
+    Работа, вынесенная в поток через to_thread (например, сбор статей), профилируется
+    в самом потоке, и ее статистика добавляется в отчет.
+
+    Вложенное профилирование (например, /profile при PROFILE_ENABLED=1) и профилирование при
+    другом активном профилировщике (с Python 3.12 он один на процесс) пропускаются: блок
+    выполняется, а отчет помечается skipped и не сохраняется.
+
+    :param label: Название профилируемого вызова
+    :param top_n: Число строк в отчете
+    :return: ProfileReport, заполняемый после выхода из блока
+    """
+    # cProfile и pstats нужны только при профилировании, поэтому не замедляют холодный старт
+    import cProfile
+    import pstats
+    
+    report = ProfileReport(label)
+    if _thread_profilers.get() is not None:
+        yield from _skip_profile(report, "вложенный вызов")
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError as e:
+        yield from _skip_profile(report, e)
+        return
+    thread_profilers = []
+    context_token = _thread_profilers.set(thread_profilers)
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    started = time.perf_counter()
+    try:
+        yield report
+    finally:
+        profiler.disable()
+        _thread_profilers.reset(context_token)
+        report.duration = time.perf_counter() - started
+        _, report.peak_bytes = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if started_tracing:
+            tracemalloc.stop()
+
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        for thread_profiler in thread_profilers:
+            stats.add(thread_profiler)
+        stats.sort_stats('cumulative').print_stats(top_n)
+        report.hotspots = stream.getvalue().strip()
+        report.allocations = [str(stat) for stat in snapshot.statistics('lineno')[:top_n]]
+        save_report(report)
+
+
+def _skip_profile(report, reason):
+    """Выполнить блок без профилирования, учитывая только длительность"""
+    logger.warning(f"Профилирование {report.label} пропущено: {reason}")
+    report.skipped = True
+    started = time.perf_counter()
+    try:
+        yield report
+    finally:
+        report.duration = time.perf_counter() - started
+
+
+def _profile_thread(profilers, func, *args, **kwargs):
+    """Выполнить func в рабочем потоке под отдельным профилировщиком"""
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # С Python 3.12 профилировщик один на процесс и уже видит все потоки
+        return func(*args, **kwargs)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        profiler.disable()
+        profilers.append(profiler)
+
+
+async def to_thread(func, *args, **kwargs):
+    """
+    asyncio.to_thread, учитываемый профилированием
+
+    cProfile видит только свой поток, поэтому во время profile() функция выполняется
+    под профилировщиком рабочего потока, статистика которого попадает в отчет.
+
+    :param func: Блокирующая функция
+    :return: Результат func
+    """
+    profilers = _thread_profilers.get()
+    if profilers is None:
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return await asyncio.to_thread(_profile_thread, profilers, func, *args, **kwargs)
+
+
+def save_report(report):
+    """
+    Сохранить отчет в локальный файл
+
+    :param report: Отчет профилирования
+    :return: Путь к файлу или None при ошибке
+    """
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        filename = f"profile_{report.label}_{report.started_at.strftime('%Y%m%d_%H%M%S')}.txt"
+        path = os.path.join(PROFILE_DIR, filename)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(report.to_text())
+        report.path = path
+        logger.info(f"Отчет профилирования сохранен: {path} "
+                    f"({report.duration * 1000:.0f} мс, пик памяти {report.peak_bytes / 1024:.0f} КБ)")
+        return path
+    except Exception as e:
+        logger.error(f"Ошибка сохранения отчета профилирования: {e}")
+        return None
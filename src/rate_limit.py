@@ -0,0 +1,175 @@
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+
+from api.utils.storage import take_rate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Ведро пользователя: сколько "жетонов" можно потратить сразу и сколько восстанавливается в минуту
+RATE_LIMIT_USER_CAPACITY = float(os.getenv('RATE_LIMIT_USER_CAPACITY', '6'))
+RATE_LIMIT_USER_PER_MINUTE = float(os.getenv('RATE_LIMIT_USER_PER_MINUTE', '2'))
+# Общее ведро: ограничивает суммарную нагрузку на источники независимо от числа пользователей.
+# С Vercel KV (STORAGE_KV=1) ведра хранятся в нем и общие для всех экземпляров функции и worker,
+# без него - у каждого процесса свои
+RATE_LIMIT_GLOBAL_CAPACITY = float(os.getenv('RATE_LIMIT_GLOBAL_CAPACITY', '30'))
+RATE_LIMIT_GLOBAL_PER_MINUTE = float(os.getenv('RATE_LIMIT_GLOBAL_PER_MINUTE', '10'))
+# Сколько ведер пользователей хранить (давно неактивные вытесняются)
+RATE_LIMIT_MAX_USERS = int(os.getenv('RATE_LIMIT_MAX_USERS', '10000'))
+
+# Стоимость команд в жетонах: разбор произвольного sitemap дороже дайджеста по известному источнику
+COMMAND_COSTS = {
+    'digest': 1,
+    'check_now': 1,
+    'parse': 3,
+    'parse_cached': 1,
+    'search': 1,
+    'digest_range': 1,
+    'subscribe': 1,
+    'profile': 3,
+}
+
+
+def _parse_costs(value):
+    """Разобрать переопределения стоимости вида "digest=1,parse=3" """
+    costs = {}
+    for item in (value or '').split(','):
+        name, _, cost = item.partition('=')
+        if name.strip() and cost.strip():
+            try:
+                costs[name.strip()] = float(cost)
+            except ValueError:
+                logger.warning(f"Некорректная стоимость команды в RATE_LIMIT_COSTS: {item}")
+    return costs
+
+
+COMMAND_COSTS.update(_parse_costs(os.getenv('RATE_LIMIT_COSTS')))
+
+
+class TokenBucket:
+    __slots__ = ('capacity', 'rate', 'tokens', 'updated')
+
+    def __init__(self, capacity, per_minute, now=None):
+        """
+        Ведро жетонов
+
+        :param capacity: Максимальное число жетонов (допустимый всплеск запросов)
+        :param per_minute: Скорость восстановления жетонов в минуту
+        """
+        self.capacity = capacity
+        self.rate = per_minute / 60
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost, now):
+        """
+        Через сколько секунд в ведре наберется cost жетонов (0 - уже есть)
+
+        Стоимость больше емкости ведра ограничивается емкостью: такая команда тратит полное ведро,
+        а не ждет жетонов, которые никогда не наберутся.
+        """
+        cost = min(cost, self.capacity)
+        self._refill(now)
+        if self.tokens >= cost:
+            return 0.0
+        if self.rate <= 0:
+            return math.inf
+        return (cost - self.tokens) / self.rate
+
+    def take(self, cost):
+        self.tokens -= min(cost, self.capacity)
+
+
+class RateLimiter:
+    def __init__(self, user_capacity=RATE_LIMIT_USER_CAPACITY, user_per_minute=RATE_LIMIT_USER_PER_MINUTE,
+                 global_capacity=RATE_LIMIT_GLOBAL_CAPACITY, global_per_minute=RATE_LIMIT_GLOBAL_PER_MINUTE,
+                 costs=None, max_users=RATE_LIMIT_MAX_USERS):
+        """
+        Ограничение частоты дорогих команд: ведро на пользователя и общее ведро
+
+        Запрос проходит, только если жетонов хватает в обоих ведрах; иначе жетоны не списываются.
+
+        :param costs: Стоимость команд в жетонах (по умолчанию COMMAND_COSTS)
+        :param max_users: Сколько ведер пользователей хранить
+        """
+        self.user_capacity = user_capacity
+        self.user_per_minute = user_per_minute
+        self.costs = COMMAND_COSTS if costs is None else costs
+        self.max_users = max_users
+        self._global = TokenBucket(global_capacity, global_per_minute)
+        self._users = OrderedDict()
+        self.limited = 0
+        capacity = min(user_capacity, global_capacity)
+        for command, cost in self.costs.items():
+            if cost > capacity:
+                logger.warning(f"Стоимость команды {command} ({cost}) больше емкости ведра ({capacity}), "
+                               f"команда будет тратить все ведро")
+
+    def _user_bucket(self, user_id, now):
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = self._users[user_id] = TokenBucket(self.user_capacity, self.user_per_minute, now)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return bucket
+
+    def check(self, user_id, command, now=None):
+        """
+        Списать жетоны за команду
+
+        :param user_id: ID пользователя Telegram
+        :param command: Имя команды (ключ COMMAND_COSTS)
+        :param now: Текущее время (time.monotonic()), по умолчанию текущее
+        :return: 0, если команду можно выполнить, иначе через сколько секунд повторить
+        """
+        cost = self.costs.get(command, 1)
+        now = time.monotonic() if now is None else now
+        user_bucket = self._user_bucket(user_id, now)
+        wait = max(user_bucket.wait_time(cost, now), self._global.wait_time(cost, now))
+        if wait > 0:
+            self.limited += 1
+            logger.info(f"Команда {command} пользователя {user_id} ограничена, повтор через {wait:.0f} с")
+            return wait
+        user_bucket.take(cost)
+        self._global.take(cost)
+        return 0.0
+
+    async def acquire(self, user_id, command):
+        """
+        Списать жетоны за команду в общем хранилище (Vercel KV), а без него - в ведрах процесса
+
+        Если хранилище недоступно, используются ведра процесса: лучше ограничить частоту
+        в пределах процесса, чем отказать всем пользователям на время сбоя.
+
+        :param user_id: ID пользователя Telegram
+        :param command: Имя команды (ключ COMMAND_COSTS)
+        :return: 0, если команду можно выполнить, иначе через сколько секунд повторить
+        """
+        cost = self.costs.get(command, 1)
+        wait = await take_rate_tokens(user_id, cost, (self.user_capacity, self.user_per_minute),
+                                      (self._global.capacity, self._global.rate * 60))
+        if wait is None:
+            return self.check(user_id, command)
+        if wait > 0:
+            self.limited += 1
+            logger.info(f"Команда {command} пользователя {user_id} ограничена, повтор через {wait:.0f} с")
+        return wait
+
+
+def format_retry_message(retry_after):
+    """Сообщение пользователю об ограничении частоты запросов"""
+    if math.isinf(retry_after):
+        return '⏳ Слишком много запросов. Попробуйте позже.'
+    return f'⏳ Слишком много запросов. Попробуйте через {max(1, math.ceil(retry_after))} с.'
+
+
+# Общий ограничитель процесса
+rate_limiter = RateLimiter()
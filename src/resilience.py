@@ -0,0 +1,337 @@
+import json
+import logging
+import os
+import random
+import threading
+import time
+from urllib.parse import urljoin, urlsplit
+
+from src.metrics import incr
+from src.state_snapshot import STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Число повторов запроса при временной ошибке (сетевой сбой, таймаут, 429, 5xx)
+FETCH_RETRIES = int(os.getenv('FETCH_RETRIES', '2'))
+# Базовая и максимальная пауза экспоненциальной задержки между повторами (в секундах)
+FETCH_BACKOFF_BASE = float(os.getenv('FETCH_BACKOFF_BASE', '0.5'))
+FETCH_BACKOFF_MAX = float(os.getenv('FETCH_BACKOFF_MAX', '4'))
+# Таймаут установки соединения (в секундах): недоступный хост не должен занимать весь таймаут чтения
+FETCH_CONNECT_TIMEOUT = float(os.getenv('FETCH_CONNECT_TIMEOUT', '3.05'))
+# Сколько ошибок подряд размыкают цепь хоста
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+# Через сколько секунд разомкнутая цепь пропускает пробный запрос
+BREAKER_RESET_TIMEOUT = float(os.getenv('BREAKER_RESET_TIMEOUT', '60'))
+# Файл состояния цепей (переживает перезапуск процесса и повторные вызовы функции). На Vercel файл
+# в /tmp теряется при холодном старте, поэтому состояние также хранится в Vercel KV (см. collect_exclusive)
+BREAKER_STATE_FILE = os.getenv('BREAKER_STATE_FILE', os.path.join(STATE_DIR, 'circuit_breakers.json'))
+
+# Сколько перенаправлений проходит запрос к источнику пользователя (каждое проверяется отдельно)
+FETCH_MAX_REDIRECTS = int(os.getenv('FETCH_MAX_REDIRECTS', '5'))
+
+# Коды ответа, после которых запрос имеет смысл повторить
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Цепь хоста разомкнута: запрос не выполнялся"""
+
+    def __init__(self, host, retry_in):
+        super().__init__(f"Хост {host} временно недоступен, повтор через {retry_in:.0f} с")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    __slots__ = ('state', 'failures', 'opened_at', 'probing')
+
+    def __init__(self, state=CLOSED, failures=0, opened_at=0.0):
+        """
+        Размыкатель цепи одного хоста
+
+        После BREAKER_FAILURE_THRESHOLD ошибок подряд цепь размыкается, и запросы к хосту
+        сразу завершаются ошибкой. Через BREAKER_RESET_TIMEOUT секунд пропускается один
+        пробный запрос: при успехе цепь замыкается, при ошибке снова размыкается.
+
+        :param state: closed, open или half_open
+        :param failures: Число ошибок подряд
+        :param opened_at: Время размыкания (time.time(), переживает перезапуск)
+        """
+        self.state = state
+        self.failures = failures
+        self.opened_at = opened_at
+        self.probing = False
+
+    def retry_in(self, now, reset_timeout):
+        """Через сколько секунд разомкнутая цепь пропустит пробный запрос"""
+        return max(0.0, self.opened_at + reset_timeout - now)
+
+    def to_dict(self):
+        return {'state': self.state, 'failures': self.failures, 'opened_at': self.opened_at}
+
+
+class BreakerRegistry:
+    def __init__(self, path=BREAKER_STATE_FILE, threshold=BREAKER_FAILURE_THRESHOLD,
+                 reset_timeout=BREAKER_RESET_TIMEOUT):
+        """
+        Размыкатели цепей по хостам с сохранением состояния в файл
+
+        Файл перезаписывается только при ошибках и при замыкании цепи, а не после каждого
+        успешного запроса.
+
+        :param path: Файл состояния (None - только в памяти)
+        :param threshold: Сколько ошибок подряд размыкают цепь
+        :param reset_timeout: Через сколько секунд пропускать пробный запрос
+        """
+        self.path = path
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = None
+        # Хосты, цепи которых изменились после последнего export_changes
+        self._changed = set()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        breakers = {}
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for host, data in json.load(f).items():
+                        breakers[host] = CircuitBreaker(data['state'], data['failures'], data['opened_at'])
+            except Exception as e:
+                logger.error(f"Ошибка загрузки состояния размыкателей цепей: {e}")
+        return breakers
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            # Замкнутые цепи без ошибок не сохраняются
+            data = {
+                host: breaker.to_dict()
+                for host, breaker in self._breakers.items()
+                if breaker.state != CLOSED or breaker.failures
+            }
+            temp_path = f'{self.path}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(temp_path, self.path)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения состояния размыкателей цепей: {e}")
+
+    def _breaker(self, host):
+        if self._breakers is None:
+            self._breakers = self._load()
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker()
+        return breaker
+
+    def before_request(self, host):
+        """
+        Проверить, можно ли выполнить запрос к хосту
+
+        :raises CircuitOpenError: Если цепь разомкнута или пробный запрос уже выполняется
+        """
+        with self._lock:
+            breaker = self._breaker(host)
+            if breaker.state == CLOSED:
+                return
+            now = time.time()
+            if breaker.state == OPEN and breaker.retry_in(now, self.reset_timeout) == 0:
+                breaker.state = HALF_OPEN
+                breaker.probing = False
+            if breaker.state == HALF_OPEN and not breaker.probing:
+                breaker.probing = True
+                logger.info(f"Пробный запрос к хосту {host}")
+                return
+            raise CircuitOpenError(host, breaker.retry_in(now, self.reset_timeout))
+
+    def record_success(self, host):
+        with self._lock:
+            breaker = self._breaker(host)
+            changed = breaker.state != CLOSED or breaker.failures
+            if breaker.state != CLOSED:
+                logger.info(f"Цепь хоста {host} замкнута")
+            breaker.state = CLOSED
+            breaker.failures = 0
+            breaker.probing = False
+            if changed:
+                self._changed.add(host)
+                self._save()
+
+    def record_failure(self, host):
+        with self._lock:
+            breaker = self._breaker(host)
+            breaker.failures += 1
+            breaker.probing = False
+            if breaker.state == HALF_OPEN or (breaker.state == CLOSED and breaker.failures >= self.threshold):
+                breaker.state = OPEN
+                breaker.opened_at = time.time()
+                logger.warning(f"Цепь хоста {host} разомкнута после {breaker.failures} ошибок подряд")
+            # Счетчик ошибок сохраняется, чтобы серия ошибок учитывалась и между вызовами функции
+            self._changed.add(host)
+            self._save()
+
+    def import_state(self, data):
+        """
+        Заменить состояние цепей состоянием из общего хранилища
+
+        Цепи, изменившиеся в этом процессе после последнего export_changes, сохраняются.
+
+        :param data: Словарь {хост: {'state', 'failures', 'opened_at'}} (без записи - цепь замкнута)
+        """
+        with self._lock:
+            if self._breakers is None:
+                self._breakers = self._load()
+            breakers = {host: CircuitBreaker(item['state'], item['failures'], item['opened_at'])
+                        for host, item in data.items()}
+            for host in self._changed:
+                if host in self._breakers:
+                    breakers[host] = self._breakers[host]
+            self._breakers = breakers
+
+    def export_changes(self):
+        """
+        Цепи, изменившиеся после прошлого вызова, для общего хранилища
+
+        :return: Словарь {хост: {'state', 'failures', 'opened_at'} или None, если цепь замкнута без ошибок}
+        """
+        with self._lock:
+            changes = {}
+            for host in self._changed:
+                breaker = self._breakers.get(host)
+                keep = breaker is not None and (breaker.state != CLOSED or breaker.failures)
+                changes[host] = breaker.to_dict() if keep else None
+            self._changed = set()
+            return changes
+
+    def format_status(self):
+        """Краткая сводка для команды /status"""
+        hosts = [
+            f"{host} (повтор через {data['retry_in']} с)"
+            for host, data in self.stats().items()
+            if data['state'] != CLOSED
+        ]
+        return ', '.join(hosts) if hosts else 'нет'
+
+    def stats(self):
+        """Состояние цепей для /status и метрик"""
+        with self._lock:
+            if self._breakers is None:
+                self._breakers = self._load()
+            now = time.time()
+            return {
+                host: dict(breaker.to_dict(), retry_in=round(breaker.retry_in(now, self.reset_timeout)))
+                for host, breaker in self._breakers.items()
+                if breaker.state != CLOSED or breaker.failures
+            }
+
+
+def backoff_delay(attempt, base=FETCH_BACKOFF_BASE, cap=FETCH_BACKOFF_MAX):
+    """Экспоненциальная задержка с полным джиттером: случайная пауза от 0 до min(cap, base * 2^attempt)"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _retry_after(response):
+    """Пауза из заголовка Retry-After (только в секундах) или None"""
+    value = response.headers.get('Retry-After')
+    try:
+        return float(value) if value else None
+    except ValueError:
+        return None
+
+
+def public_get(url, max_redirects=FETCH_MAX_REDIRECTS, **kwargs):
+    """
+    GET-запрос к адресу, который указал пользователь: только к публичным адресам
+
+    Соединение проверяется сессией url_validation.public_session, а перенаправления проходятся
+    вручную, поэтому каждый Location проверяется так же, как исходный URL.
+
+    :param url: URL
+    :param max_redirects: Максимальное число перенаправлений
+    :param kwargs: Дополнительные параметры requests.get
+    :return: Ответ requests.Response (не перенаправление)
+    :raises BlockedAddressError: Если адрес или перенаправление ведет во внутреннюю сеть
+    :raises requests.TooManyRedirects: Если перенаправлений больше max_redirects
+    """
+    import requests
+    from src.url_validation import BlockedAddressError, public_session
+
+    session = public_session()
+    for _ in range(max_redirects + 1):
+        if urlsplit(url).scheme not in ('http', 'https'):
+            raise BlockedAddressError(f"Недопустимый адрес: {url}")
+        response = session.get(url, allow_redirects=False, **kwargs)
+        if not response.is_redirect:
+            return response
+        url = urljoin(url, response.headers['Location'])
+        response.close()
+    raise requests.TooManyRedirects(f"Больше {max_redirects} перенаправлений: {url}")
+
+
+def fetch(url, timeout=10, retries=FETCH_RETRIES, registry=None, public_only=False, **kwargs):
+    """
+    GET-запрос с повторами при временных ошибках и размыканием цепи по хосту
+
+    Повторяются сетевые ошибки, таймауты и ответы 429/5xx; остальные ошибки HTTP
+    (например, 404 отдельной статьи) не повторяются и не считаются отказом хоста.
+
+    :param url: URL
+    :param timeout: Таймаут чтения ответа (в секундах)
+    :param retries: Число повторов
+    :param registry: Размыкатели цепей (по умолчанию общие для процесса)
+    :param public_only: Адрес указал пользователь: загружать только с публичных адресов (см. public_get)
+    :param kwargs: Дополнительные параметры requests.get
+    :return: Успешный ответ requests.Response
+    :raises CircuitOpenError: Если цепь хоста разомкнута
+    :raises BlockedAddressError: Если при public_only адрес ведет во внутреннюю сеть (не повторяется)
+    :raises requests.RequestException: Если все попытки завершились ошибкой
+    """
+    import requests
+    from src.url_validation import BlockedAddressError
+
+    registry = registry or breakers
+    get = public_get if public_only else requests.get
+    host = urlsplit(url).hostname or ''
+    for attempt in range(retries + 1):
+        try:
+            registry.before_request(host)
+        except CircuitOpenError:
+            incr('breaker_rejects')
+            raise
+
+        delay = None
+        try:
+            response = get(url, timeout=(FETCH_CONNECT_TIMEOUT, timeout), **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = e
+        except BlockedAddressError:
+            # Повтор не поможет; отказ учитывается, чтобы пробный запрос разомкнутой цепи не завис
+            registry.record_failure(host)
+            raise
+        else:
+            if response.status_code not in RETRY_STATUSES:
+                registry.record_success(host)
+                response.raise_for_status()
+                return response
+            error = requests.HTTPError(f"{response.status_code} для {url}", response=response)
+            delay = _retry_after(response)
+            response.close()
+
+        registry.record_failure(host)
+        if attempt == retries:
+            raise error
+        incr('retries')
+        delay = min(delay, FETCH_BACKOFF_MAX) if delay is not None else backoff_delay(attempt)
+        logger.info(f"Повтор запроса {url} через {delay:.1f} с: {error}")
+        time.sleep(delay)
+
+
+# Общие размыкатели цепей процесса
+breakers = BreakerRegistry()
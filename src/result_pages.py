@@ -0,0 +1,144 @@
+import logging
+import os
+import threading
+from array import array
+from collections import Counter, OrderedDict
+from itertools import count
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Число URL на странице (страница должна помещаться в одно сообщение Telegram)
+PAGE_SIZE = int(os.getenv('RESULT_PAGE_SIZE', '30'))
+# Сколько кнопок фильтра по префиксу пути показывать
+MAX_PREFIXES = int(os.getenv('RESULT_MAX_PREFIXES', '6'))
+# Максимальный суммарный размер сохраненных результатов (в байтах)
+RESULT_STORE_MAX_BYTES = int(os.getenv('RESULT_STORE_MAX_BYTES', str(32 * 1024 * 1024)))
+
+# Номер фильтра "все URL"
+ALL_URLS = -1
+
+
+def path_prefix(url):
+    """Первый сегмент пути URL ("/news/2024/..." -> "/news/") или "/" для корня"""
+    path = urlsplit(url).path
+    segment = path.lstrip('/').split('/', 1)[0]
+    if not segment or '/' not in path.lstrip('/'):
+        return '/'
+    return f'/{segment}/'
+
+
+class PagedResult:
+    def __init__(self, source_url, urls, page_size=PAGE_SIZE, max_prefixes=MAX_PREFIXES):
+        """
+        Результат разбора sitemap в компактном виде с постраничным доступом за O(1)
+
+        URL хранятся одной строкой через перевод строки вместе с массивом смещений строк,
+        поэтому страница вырезается срезом без обхода всего результата. Для самых частых
+        префиксов пути заранее строятся массивы номеров подходящих URL.
+
+        :param source_url: URL sitemap
+        :param urls: Список URL
+        :param page_size: Число URL на странице
+        :param max_prefixes: Число префиксов пути для фильтров
+        """
+        self.source_url = source_url
+        self.page_size = page_size
+        self.text = '\n'.join(urls) + '\n'
+        self.offsets = array('L', [0])
+        position = 0
+        for url in urls:
+            position += len(url) + 1
+            self.offsets.append(position)
+
+        url_prefixes = [path_prefix(url) for url in urls]
+        counts = Counter(url_prefixes)
+        self.prefixes = []
+        self._filters = []
+        if len(counts) > 1:
+            for prefix, _ in counts.most_common(max_prefixes):
+                self.prefixes.append(prefix)
+                self._filters.append(array('L', (i for i, value in enumerate(url_prefixes) if value == prefix)))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def size(self):
+        """Примерный объем памяти результата в байтах"""
+        return (
+            len(self.text)
+            + self.offsets.itemsize * len(self.offsets)
+            + sum(indexes.itemsize * len(indexes) for indexes in self._filters)
+        )
+
+    def _line(self, index):
+        return self.text[self.offsets[index]:self.offsets[index + 1] - 1]
+
+    def total(self, prefix_index=ALL_URLS):
+        """Число URL с учетом фильтра"""
+        if prefix_index == ALL_URLS:
+            return len(self)
+        return len(self._filters[prefix_index])
+
+    def pages(self, prefix_index=ALL_URLS):
+        """Число страниц с учетом фильтра"""
+        return max(1, -(-self.total(prefix_index) // self.page_size))
+
+    def page(self, number, prefix_index=ALL_URLS):
+        """
+        URL на странице
+
+        :param number: Номер страницы, начиная с 0
+        :param prefix_index: Номер префикса в self.prefixes или ALL_URLS
+        :return: Список URL
+        """
+        start = number * self.page_size
+        end = min(start + self.page_size, self.total(prefix_index))
+        if start >= end:
+            return []
+        if prefix_index == ALL_URLS:
+            return self.text[self.offsets[start]:self.offsets[end] - 1].split('\n')
+        return [self._line(index) for index in self._filters[prefix_index][start:end]]
+
+
+class ResultStore:
+    def __init__(self, max_bytes=RESULT_STORE_MAX_BYTES):
+        """
+        Ограниченное по памяти LRU-хранилище результатов разбора для постраничного просмотра
+
+        :param max_bytes: Максимальный суммарный размер результатов
+        """
+        self.max_bytes = max_bytes
+        self._results = OrderedDict()
+        self._size = 0
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    def add(self, source_url, urls):
+        """
+        Сохранить результат
+
+        :return: Кортеж (короткий идентификатор для callback_data, PagedResult)
+        """
+        result = PagedResult(source_url, urls)
+        with self._lock:
+            result_id = format(next(self._ids), 'x')
+            self._results[result_id] = result
+            self._size += result.size
+            while self._size > self.max_bytes and len(self._results) > 1:
+                _, evicted = self._results.popitem(last=False)
+                self._size -= evicted.size
+        return result_id, result
+
+    def get(self, result_id):
+        """Результат по идентификатору или None, если он уже вытеснен"""
+        with self._lock:
+            result = self._results.get(result_id)
+            if result is not None:
+                self._results.move_to_end(result_id)
+            return result
+
+
+# Общее хранилище процесса
+result_store = ResultStore()
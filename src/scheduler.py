@@ -3,9 +3,15 @@ import schedule
 import time
 import threading
 import asyncio
+from contextlib import nullcontext
 from datetime import datetime
 from telegram import Bot
 from telegram.error import TelegramError
+from src.metrics import track_run, incr
+from src.profiling import profile, should_profile
+from src.subscriptions import DEFAULT_SOURCE, SourceRegistry, deliver_subscriptions
+from src.sharding import SHARDING, SHARD_HEARTBEAT_INTERVAL, ShardMembership
+from api.utils.storage import get_subscriptions, seed_subscription
 
 logger = logging.getLogger(__name__)
 
@@ -14,61 +20,82 @@ class DigestScheduler:
         """
         Инициализация планировщика дайджеста
         
-        :param sitemap_parser: Экземпляр парсера sitemap
-        :param digest_chat_id: ID чата для отправки дайджеста
+        Дайджест рассылается всем чатам по их подпискам: каждый источник собирается
+        один раз за проход, сколько бы чатов на него ни было подписано. При SHARDING=1
+        процесс собирает только свою долю источников (см. src/sharding.py).
+        
+        :param sitemap_parser: Экземпляр парсера sitemap (источник по умолчанию)
+        :param digest_chat_id: ID чата, подписываемого на источник по умолчанию, если подписок еще нет
         :param interval_hours: Интервал отправки дайджеста (в часах)
         :param max_articles: Максимальное число статей в дайджесте
         :param bot_token: Токен бота для отправки сообщений
         """
         self.bot_token = bot_token
         self.sitemap_parser = sitemap_parser
+        self.sources = SourceRegistry(sitemap_parser)
         self.digest_chat_id = digest_chat_id
         self.interval_hours = interval_hours
         self.max_articles = max_articles
+        self.membership = ShardMembership() if SHARDING else None
         self.is_running = False
         self.scheduler_thread = None
+        self.heartbeat_thread = None
     
     async def send_digest_async(self):
         """Отправляет дайджест в Telegram (асинхронная версия)"""
+        with track_run('scheduler'):
+            await self._send_digest()
+    
+    async def _send_digest(self):
+        """Собирает и рассылает дайджесты в рамках отслеживаемого запуска"""
         try:
-            logger.info("Начинаем парсинг sitemap.xml...")
-            articles = self.sitemap_parser.parse_sitemap()
+            if self.digest_chat_id:
+                await seed_subscription(self.digest_chat_id, DEFAULT_SOURCE)
+            subscriptions = await get_subscriptions()
             
-            if not articles:
-                logger.info("Нет новых статей для отправки")
+            if not subscriptions:
+                logger.warning("Нет подписанных чатов для отправки дайджеста")
                 return
             
-            logger.info(f"Найдено {len(articles)} новых статей")
+            owns = None
+            if self.membership:
+                # Доля источников определяется по составу процессов на момент прохода
+                await self.membership.heartbeat()
+                owns = lambda source_id: self.membership.owns(self.sources.url(source_id))
             
-            digest_text = self.sitemap_parser.format_digest(articles, self.max_articles)
-            
-            # Отправляем дайджест в Telegram
-            if self.digest_chat_id and self.bot_token:
-                bot = Bot(token=self.bot_token)
-                await bot.send_message(
-                    chat_id=self.digest_chat_id,
-                    text=f'📰 Свежий дайджест:\n\n{digest_text}',
-                    parse_mode='Markdown',
-                    disable_web_page_preview=True
-                )
-                logger.info(f"Дайджест отправлен в чат {self.digest_chat_id}")
-            else:
-                logger.warning("Не указан ID чата или токен бота для отправки дайджеста")
+            logger.info(f"Начинаем получение новых статей для {len(subscriptions)} чатов...")
+            bot = Bot(token=self.bot_token)
+            await deliver_subscriptions(self.sources, subscriptions, bot.send_message, self.max_articles, owns=owns)
         
         except TelegramError as e:
+            incr('errors')
             logger.error(f"Ошибка Telegram при отправке дайджеста: {e}")
         except Exception as e:
+            incr('errors')
             logger.error(f"Ошибка при формировании и отправке дайджеста: {e}")
     
     def send_digest(self):
         """Запускает асинхронную функцию отправки дайджеста"""
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
+        profiling = profile('scheduler') if should_profile() else nullcontext()
         try:
-            loop.run_until_complete(self.send_digest_async())
+            with profiling:
+                loop.run_until_complete(self.send_digest_async())
         finally:
             loop.close()
     
+    def _run_heartbeats(self):
+        """Периодически отмечает процесс живым, пока планировщик работает"""
+        while True:
+            try:
+                asyncio.run(self.membership.heartbeat())
+            except Exception as e:
+                logger.error(f"Ошибка отметки процесса в хранилище: {e}")
+            time.sleep(SHARD_HEARTBEAT_INTERVAL)
+            if not self.is_running:
+                break
+    
     def start(self):
         """Запускает планировщик"""
         if self.is_running:
@@ -78,10 +105,6 @@ class DigestScheduler:
         if not self.bot_token:
             logger.error("Невозможно запустить планировщик: не указан токен бота")
             return
-            
-        if not self.digest_chat_id:
-            logger.warning("Не указан ID чата для отправки дайджеста")
-            return
         
         logger.info(f"Запуск планировщика дайджеста с интервалом {self.interval_hours} час(ов)")
         
@@ -99,6 +122,11 @@ class DigestScheduler:
         self.scheduler_thread.daemon = True
         self.scheduler_thread.start()
         
+        # Отметки живости идут в своем потоке: долгий проход планировщика не должен их задерживать
+        if self.membership:
+            self.heartbeat_thread = threading.Thread(target=self._run_heartbeats, daemon=True)
+            self.heartbeat_thread.start()
+        
         logger.info(f"Планировщик запущен. Следующий дайджест будет отправлен через {self.interval_hours} час(ов)")
     
     def stop(self):
@@ -112,4 +140,9 @@ class DigestScheduler:
         schedule.clear()
         if self.scheduler_thread:
             self.scheduler_thread.join(timeout=1)
+        if self.membership:
+            try:
+                asyncio.run(self.membership.leave())
+            except Exception as e:
+                logger.error(f"Ошибка выхода процесса из участников: {e}")
         logger.info("Планировщик дайджеста остановлен") 
\ No newline at end of file
@@ -0,0 +1,374 @@
+import heapq
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from urllib.parse import urlsplit
+
+from src.state_snapshot import STATE_DIR
+
+logger = logging.getLogger(__name__)
+
+# Файл поискового индекса статей (на Vercel - в /tmp, поэтому индекс живет до холодного старта)
+SEARCH_INDEX_FILE = os.getenv('SEARCH_INDEX_FILE', os.path.join(STATE_DIR, 'search_index.db'))
+# Вести индекс и отвечать на /search. На Vercel индекс в /tmp теряется при холодном старте и у каждого
+# экземпляра функции свой, поэтому по умолчанию поиск работает только в worker
+SEARCH_ENABLED = os.getenv('SEARCH_ENABLED', '0' if os.environ.get('VERCEL', '0') == '1' else '1') == '1'
+# Сколько статей показывать в результатах /search
+SEARCH_RESULTS = int(os.getenv('SEARCH_RESULTS', '10'))
+
+# Параметры ранжирования BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Средняя длина статьи (в термах), если индекс еще пуст; дальше берется по добавленным статьям
+DEFAULT_AVERAGE_LENGTH = 10.0
+# При каком относительном отклонении фактической средней длины от использованной во вкладах
+# вклады пересчитываются (пересчет читает весь индекс, поэтому выполняется не после каждой статьи)
+AVERAGE_LENGTH_DRIFT = 0.1
+# Вклад терма хранится целым числом с этим множителем
+IMPACT_SCALE = 1000
+# Сколько статей терма читать за один шаг запроса
+_POSTINGS_BATCH = 256
+
+# Слова и числа из заголовков и адресов
+_TOKEN = re.compile(r'[0-9a-zа-я]+')
+# Числа длиннее года в адресе - обычно идентификаторы статей, а не слова
+_MAX_SLUG_NUMBER = 4
+
+# Служебные слова, которые не влияют на поиск
+STOPWORDS = frozenset(
+    'и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было '
+    'вот от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас '
+    'нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их '
+    'чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой '
+    'совсем ним здесь этом один почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при '
+    'наконец два об другой хоть после над больше тот через эти нас про всего них какая много разве три '
+    'эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им более всегда конечно '
+    'всю между html htm php www the of and a an to in on for is'.split()
+)
+
+# Стеммер Портера для русского языка: окончания снимаются только в RV - части слова после первой гласной
+_RV = re.compile(r'^(.*?[аеиоуыэюя])(.*)$')
+_PERFECTIVE_GERUND = re.compile(r'((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$')
+_REFLEXIVE = re.compile(r'(с[яь])$')
+_ADJECTIVE = re.compile(r'(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$')
+_PARTICIPLE = re.compile(r'((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$')
+_VERB = re.compile(
+    r'((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)'
+    r'|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$'
+)
+_NOUN = re.compile(
+    r'(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$'
+)
+_DERIVATIONAL = re.compile(r'.*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$')
+_DERIVATIONAL_SUFFIX = re.compile(r'ость?$')
+_SUPERLATIVE = re.compile(r'(ейше|ейш)$')
+
+
+@lru_cache(maxsize=65536)
+def stem(word):
+    """
+    Основа русского слова по алгоритму Портера ("выборах" -> "выбор", "выборы" -> "выбор")
+
+    Слова без кириллицы (латиница, числа) возвращаются без изменений.
+    """
+    match = _RV.match(word)
+    if not match:
+        return word
+    start, rv = match.groups()
+
+    result = _PERFECTIVE_GERUND.sub('', rv, 1)
+    if result == rv:
+        rv = _REFLEXIVE.sub('', rv, 1)
+        result = _ADJECTIVE.sub('', rv, 1)
+        if result != rv:
+            rv = _PARTICIPLE.sub('', result, 1)
+        else:
+            result = _VERB.sub('', rv, 1)
+            rv = _NOUN.sub('', rv, 1) if result == rv else result
+    else:
+        rv = result
+
+    rv = rv[:-1] if rv.endswith('и') else rv
+    if _DERIVATIONAL.match(rv):
+        rv = _DERIVATIONAL_SUFFIX.sub('', rv, 1)
+    if rv.endswith('ь'):
+        rv = rv[:-1]
+    else:
+        rv = _SUPERLATIVE.sub('', rv, 1)
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+    return start + rv
+
+
+def tokenize(text):
+    """Основы значимых слов текста в порядке следования"""
+    return [
+        stem(word)
+        for word in _TOKEN.findall(text.lower().replace('ё', 'е'))
+        if len(word) > 1 and word not in STOPWORDS
+    ]
+
+
+def slug_tokens(url):
+    """Слова из последнего сегмента адреса статьи ("/news/484110-vybory-v-moldove.html" -> vybory, moldove)"""
+    path = urlsplit(url).path.rstrip('/')
+    slug = path[path.rfind('/') + 1:]
+    return [
+        word for word in tokenize(slug)
+        if not (word.isdigit() and len(word) > _MAX_SLUG_NUMBER)
+    ]
+
+
+def document_terms(article):
+    """Частоты термов статьи: заголовок и адрес"""
+    terms = {}
+    for term in tokenize(article['title']) + slug_tokens(article['url']):
+        terms[term] = terms.get(term, 0) + 1
+    return terms
+
+
+class SearchIndex:
+    def __init__(self, path=SEARCH_INDEX_FILE):
+        """
+        Инвертированный индекс статей в SQLite с ранжированием BM25
+
+        Для каждого терма (основы слова заголовка или адреса) хранится список статей с заранее
+        вычисленным вкладом терма в BM25 (частота терма с поправкой на длину статьи). Средняя длина
+        статьи, по которой вычислены вклады, пересчитывается, когда фактическая отклоняется от нее
+        больше чем на AVERAGE_LENGTH_DRIFT: тогда вклады всех статей вычисляются заново. Второй индекс упорядочивает статьи терма по убыванию
+        вклада, поэтому запрос читает списки термов с самых релевантных статей и останавливается,
+        как только оставшиеся статьи уже не могут попасть в первые k (пороговый алгоритм Фейгина).
+        Частые термы не читаются целиком, и задержка почти не зависит от размера индекса.
+
+        :param path: Файл индекса
+        """
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+        # Число статей в индексе (сбрасывается при добавлении статей)
+        self._total = None
+        # Средняя длина, по которой вычислены вклады, и суммарная длина статей индекса (в термах)
+        self._average_length = None
+        self._total_length = None
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(
+                'CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL NOT NULL);'
+                'CREATE TABLE IF NOT EXISTS docs ('
+                ' id INTEGER PRIMARY KEY, url TEXT NOT NULL UNIQUE, title TEXT NOT NULL, added_at REAL NOT NULL);'
+                'CREATE TABLE IF NOT EXISTS terms (term TEXT PRIMARY KEY, df INTEGER NOT NULL) WITHOUT ROWID;'
+                'CREATE TABLE IF NOT EXISTS postings ('
+                ' term TEXT NOT NULL, doc_id INTEGER NOT NULL, impact INTEGER NOT NULL,'
+                ' PRIMARY KEY (term, doc_id)) WITHOUT ROWID;'
+                'CREATE INDEX IF NOT EXISTS postings_by_impact ON postings (term, impact DESC, doc_id DESC);'
+            )
+            self._load_meta(connection)
+            self._connection = connection
+        return self._connection
+
+    def _load_meta(self, connection):
+        meta = dict(connection.execute('SELECT key, value FROM meta'))
+        self._average_length = meta.get('average_length')
+        self._total_length = meta.get('total_length')
+        if self._total_length is None:
+            # Индекс без суммарной длины (создан до ее учета): длины статей выводятся из заголовка и адреса
+            self._total_length = sum(
+                sum(document_terms({'url': url, 'title': title}).values())
+                for url, title in connection.execute('SELECT url, title FROM docs')
+            )
+
+    def _impact(self, tf, length):
+        """Вклад терма в BM25 без учета IDF, умноженный на IMPACT_SCALE"""
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self._average_length)
+        return round(tf * (BM25_K1 + 1) / (tf + norm) * IMPACT_SCALE)
+
+    def _remove(self, connection, doc_id, url, title):
+        terms = document_terms({'url': url, 'title': title})
+        self._total_length -= sum(terms.values())
+        connection.executemany('DELETE FROM postings WHERE term = ? AND doc_id = ?', [(term, doc_id) for term in terms])
+        connection.executemany('UPDATE terms SET df = df - 1 WHERE term = ?', [(term,) for term in terms])
+        connection.execute('DELETE FROM docs WHERE id = ?', (doc_id,))
+
+    def add_articles(self, articles, added_at=None):
+        """
+        Добавить статьи в индекс (статья с тем же адресом заменяется, если изменился заголовок)
+
+        :param articles: Статьи ({'url', 'title'})
+        :param added_at: Время добавления (time.time()), по умолчанию текущее
+        :return: Число добавленных или обновленных статей
+        """
+        added_at = added_at or time.time()
+        documents = [(article, document_terms(article)) for article in articles]
+        with self._lock:
+            connection = self._connect()
+            try:
+                changed = self._add(connection, documents, added_at)
+            except Exception:
+                # Транзакция отменена: длины возвращаются к сохраненным в индексе
+                self._load_meta(connection)
+                raise
+            if changed:
+                self._total = None
+        return changed
+
+    def _add(self, connection, documents, added_at):
+        """Добавить статьи одной транзакцией (вызывается под блокировкой)"""
+        changed = 0
+        with connection:
+            if self._average_length is None and documents:
+                # Первые статьи: средняя длина по ним, дальше она уточняется в _normalize
+                self._average_length = max(1.0, sum(sum(terms.values()) for _, terms in documents) / len(documents))
+            for article, terms in documents:
+                row = connection.execute('SELECT id, title FROM docs WHERE url = ?', (article['url'],)).fetchone()
+                if row and row[1] == article['title']:
+                    continue
+                if row:
+                    self._remove(connection, row[0], article['url'], row[1])
+
+                length = sum(terms.values())
+                doc_id = connection.execute(
+                    'INSERT INTO docs (url, title, added_at) VALUES (?, ?, ?)',
+                    (article['url'], article['title'], added_at)
+                ).lastrowid
+                connection.executemany(
+                    'INSERT INTO postings (term, doc_id, impact) VALUES (?, ?, ?)',
+                    [(term, doc_id, self._impact(tf, length)) for term, tf in terms.items()]
+                )
+                connection.executemany(
+                    'INSERT INTO terms (term, df) VALUES (?, 1) ON CONFLICT (term) DO UPDATE SET df = df + 1',
+                    [(term,) for term in terms]
+                )
+                self._total_length += length
+                changed += 1
+            if changed:
+                self._normalize(connection)
+        return changed
+
+    def _normalize(self, connection):
+        """
+        Сохранить суммарную длину статей и при заметном отклонении средней длины пересчитать вклады
+
+        Пересчет выполняется, когда средняя длина изменилась больше чем на AVERAGE_LENGTH_DRIFT,
+        поэтому по мере роста индекса он нужен все реже. Термы статьи выводятся из заголовка и адреса.
+        """
+        total = connection.execute('SELECT count(*) FROM docs').fetchone()[0]
+        actual = max(1.0, self._total_length / total) if total else self._average_length
+        if abs(actual - self._average_length) > AVERAGE_LENGTH_DRIFT * self._average_length:
+            logger.info(f"Средняя длина статьи в индексе изменилась ({self._average_length:.1f} -> {actual:.1f}), "
+                        f"пересчитываем вклады термов")
+            self._average_length = actual
+            for doc_id, url, title in connection.execute('SELECT id, url, title FROM docs').fetchall():
+                terms = document_terms({'url': url, 'title': title})
+                length = sum(terms.values())
+                connection.executemany(
+                    'UPDATE postings SET impact = ? WHERE term = ? AND doc_id = ?',
+                    [(self._impact(tf, length), term, doc_id) for term, tf in terms.items()]
+                )
+        connection.executemany(
+            'INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)',
+            [('average_length', self._average_length), ('total_length', self._total_length)]
+        )
+
+    def search(self, query, limit=SEARCH_RESULTS):
+        """
+        Найти статьи по запросу
+
+        :param query: Текст запроса
+        :param limit: Число результатов
+        :return: Статьи ({'url', 'title', 'added_at', 'score'}) в порядке убывания релевантности
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+
+        with self._lock:
+            connection = self._connect()
+            if self._total is None:
+                self._total = connection.execute('SELECT count(*) FROM docs').fetchone()[0]
+            idfs = {}
+            for term in terms:
+                row = connection.execute('SELECT df FROM terms WHERE term = ?', (term,)).fetchone()
+                if row and row[0] > 0:
+                    idfs[term] = math.log(1 + (self._total - row[0] + 0.5) / (row[0] + 0.5))
+            if not idfs:
+                return []
+
+            cursors = {
+                term: connection.execute(
+                    'SELECT doc_id, impact FROM postings WHERE term = ? ORDER BY impact DESC, doc_id DESC', (term,)
+                )
+                for term in idfs
+            }
+            # Верхняя граница вклада каждого терма для еще не прочитанных статей
+            bounds = {term: float('inf') for term in idfs}
+            scores = {}
+            top = []
+            while cursors:
+                for term in list(cursors):
+                    rows = cursors[term].fetchmany(_POSTINGS_BATCH)
+                    if len(rows) < _POSTINGS_BATCH:
+                        del cursors[term]
+                        bounds[term] = 0.0
+                    if not rows:
+                        continue
+                    if term in cursors:
+                        bounds[term] = idfs[term] * rows[-1][1]
+                    new_docs = [doc_id for doc_id, _ in rows if doc_id not in scores]
+                    if new_docs:
+                        self._score(connection, new_docs, idfs, scores)
+
+                # Останавливаемся, когда k-я статья не хуже любой еще не прочитанной
+                top = heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+                if len(top) == limit and top[-1][1] >= sum(bounds.values()):
+                    break
+
+            if not top:
+                return []
+            rows = connection.execute(
+                f'SELECT id, url, title, added_at FROM docs WHERE id IN ({",".join("?" * len(top))})',
+                [doc_id for doc_id, _ in top]
+            ).fetchall()
+
+        found = {doc_id: {'url': url, 'title': title, 'added_at': added_at} for doc_id, url, title, added_at in rows}
+        return [
+            dict(found[doc_id], score=round(score / IMPACT_SCALE, 3))
+            for doc_id, score in top if doc_id in found
+        ]
+
+    def _score(self, connection, doc_ids, idfs, scores):
+        """Полная оценка статей по всем термам запроса (произвольный доступ по первичному ключу)"""
+        for doc_id in doc_ids:
+            scores[doc_id] = 0.0
+        placeholders = ','.join('?' * len(doc_ids))
+        for term, idf in idfs.items():
+            for doc_id, impact in connection.execute(
+                f'SELECT doc_id, impact FROM postings WHERE term = ? AND doc_id IN ({placeholders})',
+                [term, *doc_ids]
+            ):
+                scores[doc_id] += idf * impact
+
+    def __len__(self):
+        with self._lock:
+            return self._connect().execute('SELECT count(*) FROM docs').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+# Общий индекс процесса
+search_index = SearchIndex()
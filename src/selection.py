@@ -0,0 +1,101 @@
+import heapq
+import logging
+import math
+import os
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+# Сколько новых статей обрабатывать за один запуск (загружать заголовки)
+MAX_ARTICLES_TO_PROCESS = int(os.getenv('MAX_ARTICLES_TO_PROCESS', '100'))
+# Вес источника: множитель оценки его статей (пригодится при нескольких источниках)
+SOURCE_WEIGHT = float(os.getenv('SOURCE_WEIGHT', '1.0'))
+# Период полураспада свежести статьи (в часах)
+RECENCY_HALF_LIFE_HOURS = float(os.getenv('RECENCY_HALF_LIFE_HOURS', '24'))
+# Доли приоритета из sitemap и свежести lastmod в оценке
+PRIORITY_WEIGHT = float(os.getenv('PRIORITY_WEIGHT', '0.4'))
+RECENCY_WEIGHT = float(os.getenv('RECENCY_WEIGHT', '0.6'))
+
+# Значение по умолчанию для статей без приоритета или без даты
+DEFAULT_PRIORITY = 0.5
+DEFAULT_RECENCY = 0.5
+
+
+def parse_priority(value):
+    """Приоритет <priority> из sitemap в диапазоне 0..1"""
+    try:
+        return min(max(float(value), 0.0), 1.0)
+    except (TypeError, ValueError):
+        return DEFAULT_PRIORITY
+
+
+def parse_datetime(value):
+    """Разобрать дату ISO 8601 (lastmod, publication_date) в aware datetime или None"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def recency(value, now=None, half_life_hours=RECENCY_HALF_LIFE_HOURS):
+    """Свежесть статьи: 1 для только что измененной, 0.5 через период полураспада и т.д."""
+    modified = parse_datetime(value)
+    if modified is None:
+        return DEFAULT_RECENCY
+    now = now or datetime.now(timezone.utc)
+    age_hours = max((now - modified).total_seconds() / 3600, 0.0)
+    return math.exp(-math.log(2) * age_hours / half_life_hours)
+
+
+def score_entry(entry, now=None, source_weight=SOURCE_WEIGHT):
+    """
+    Оценка важности записи источника
+
+    :param entry: Запись из iter_sitemap_entries или ленты (priority, lastmod, published)
+    :param now: Текущее время (aware datetime); по умолчанию datetime.now(UTC)
+    :param source_weight: Вес источника
+    :return: Оценка (чем больше, тем важнее)
+    """
+    return source_weight * (
+        PRIORITY_WEIGHT * parse_priority(entry.get('priority'))
+        + RECENCY_WEIGHT * recency(entry.get('lastmod') or entry.get('published'), now)
+    )
+
+
+class TopK:
+    def __init__(self, k=MAX_ARTICLES_TO_PROCESS):
+        """
+        Потоковый отбор k элементов с наибольшей оценкой
+
+        Хранит не более k элементов в куче, поэтому отбор из n элементов стоит O(n log k).
+        При равной оценке предпочтение отдается более раннему элементу.
+
+        :param k: Число отбираемых элементов
+        """
+        self.k = k
+        self._heap = []
+        self._count = 0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, score, item):
+        """Предложить элемент с оценкой"""
+        if self.k <= 0:
+            return
+        self._count += 1
+        # Минимальный элемент в корне кучи; -count вытесняет более поздние элементы при равной оценке
+        node = (score, -self._count, item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, node)
+        elif node > self._heap[0]:
+            heapq.heapreplace(self._heap, node)
+
+    def items(self):
+        """Отобранные элементы в порядке убывания оценки"""
+        return [item for _, _, item in sorted(self._heap, reverse=True)]
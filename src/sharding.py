@@ -0,0 +1,110 @@
+import bisect
+import hashlib
+import logging
+import os
+import threading
+
+import api.utils.storage as storage
+from api.utils.storage import NODE_ID, get_members, heartbeat, leave
+
+logger = logging.getLogger(__name__)
+
+# Делить источники между процессами worker (нужно общее хранилище: STORAGE_KV=1)
+SHARDING = os.getenv('SHARDING', '0') == '1'
+# Число виртуальных узлов каждого процесса на кольце (больше - равномернее распределение)
+SHARD_VNODES = int(os.getenv('SHARD_VNODES', '100'))
+# Интервал отметки живости процесса (в секундах)
+SHARD_HEARTBEAT_INTERVAL = float(os.getenv('SHARD_HEARTBEAT_INTERVAL', '30'))
+# Через сколько секунд без отметки процесс считается выбывшим, а его источники переходят другим
+SHARD_HEARTBEAT_TTL = int(os.getenv('SHARD_HEARTBEAT_TTL', '90'))
+
+
+def _hash(text):
+    """64-битный хеш строки (одинаковый во всех процессах, в отличие от hash())"""
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def check_shared_storage():
+    """
+    Проверить, что при SHARDING=1 процессы видят одно хранилище
+
+    В хранилище в памяти каждый worker видит только себя, считает себя единственным участником
+    и собирает все источники, поэтому шардирование без Vercel KV не делит работу, а дублирует ее.
+
+    :return: Текст ошибки или None
+    """
+    if SHARDING and not (storage.USE_KV and storage.kv_available()):
+        return ("SHARDING=1 требует общего хранилища: задайте STORAGE_KV=1 и настройте Vercel KV "
+                "(VERCEL_KV_URL, VERCEL_KV_REST_API_TOKEN) или отключите SHARDING")
+    return None
+
+
+class HashRing:
+    def __init__(self, members, vnodes=SHARD_VNODES):
+        """
+        Кольцо согласованного хеширования
+
+        Каждый участник занимает vnodes точек кольца; ключ принадлежит участнику первой точки
+        по часовой стрелке от хеша ключа. При появлении или выбытии участника переходят
+        только ключи его точек (примерно 1/N ключей), остальные остаются на месте.
+
+        :param members: Идентификаторы участников
+        :param vnodes: Число виртуальных узлов на участника
+        """
+        self.members = sorted(set(members))
+        points = sorted((_hash(f'{member}#{index}'), member) for member in self.members for index in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._owners = [member for _, member in points]
+
+    def owner(self, key):
+        """Участник, которому принадлежит ключ (None, если участников нет)"""
+        if not self._hashes:
+            return None
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._owners[index]
+
+
+class ShardMembership:
+    def __init__(self, node_id=NODE_ID, vnodes=SHARD_VNODES):
+        """
+        Участие процесса в шардировании источников
+
+        Процесс периодически отмечается в хранилище, а кольцо строится по живым участникам
+        при каждой отметке, поэтому источники перераспределяются автоматически, когда worker
+        запускается или выбывает. Пока процесс не получил список участников, он считает
+        себя единственным и собирает все источники.
+
+        :param node_id: Идентификатор процесса
+        :param vnodes: Число виртуальных узлов на участника
+        """
+        self.node_id = node_id
+        self.vnodes = vnodes
+        self.ring = HashRing([node_id], vnodes)
+        self._lock = threading.Lock()
+
+    async def heartbeat(self):
+        """Отметить процесс живым и перестроить кольцо, если состав участников изменился"""
+        await heartbeat(self.node_id, SHARD_HEARTBEAT_TTL)
+        members = await get_members()
+        if self.node_id not in members:
+            members.append(self.node_id)
+        with self._lock:
+            if sorted(members) == self.ring.members:
+                return
+            logger.info(f"Состав процессов изменился: {len(self.ring.members)} -> {len(members)}, "
+                        f"источники перераспределены")
+            self.ring = HashRing(members, self.vnodes)
+
+    async def leave(self):
+        """Выйти из участников, чтобы источники сразу перешли другим процессам"""
+        await leave(self.node_id)
+
+    def owns(self, key):
+        """Принадлежит ли ключ (URL источника) этому процессу"""
+        with self._lock:
+            return self.ring.owner(key) == self.node_id
+
+    def format_status(self, keys=()):
+        """Краткая сводка для команды /status"""
+        owned = sum(1 for key in keys if self.owns(key))
+        return f'процессов {len(self.ring.members)}, источников у этого процесса {owned} из {len(keys)}'
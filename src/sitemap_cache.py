@@ -0,0 +1,155 @@
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+logger = logging.getLogger(__name__)
+
+# Сколько секунд результат разбора sitemap считается свежим
+SITEMAP_CACHE_TTL = int(os.getenv('SITEMAP_CACHE_TTL', '300'))
+# Максимальный суммарный размер сжатых результатов в кеше (в байтах)
+SITEMAP_CACHE_MAX_BYTES = int(os.getenv('SITEMAP_CACHE_MAX_BYTES', str(8 * 1024 * 1024)))
+
+_DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_sitemap_url(url):
+    """Ключ кеша: схема и хост в нижнем регистре, без порта по умолчанию и фрагмента"""
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and parts.port != _DEFAULT_PORTS.get(scheme):
+        host = f'{host}:{parts.port}'
+    return urlunsplit((scheme, host, parts.path or '/', parts.query, ''))
+
+
+class CachedResult:
+    __slots__ = ('blob', 'count', 'etag', 'last_modified', 'expires')
+
+    def __init__(self, urls, etag=None, last_modified=None, ttl=SITEMAP_CACHE_TTL):
+        """
+        Результат разбора sitemap в компактном виде: список URL, соединенный переводами строк и сжатый zlib
+
+        :param urls: Список URL
+        :param etag: Заголовок ETag ответа
+        :param last_modified: Заголовок Last-Modified ответа
+        :param ttl: Срок свежести в секундах
+        """
+        self.blob = zlib.compress('\n'.join(urls).encode('utf-8'))
+        self.count = len(urls)
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires = time.monotonic() + ttl
+
+    @property
+    def fresh(self):
+        return time.monotonic() < self.expires
+
+    @property
+    def size(self):
+        return len(self.blob)
+
+    def urls(self):
+        """Распаковать список URL"""
+        if not self.count:
+            return []
+        return zlib.decompress(self.blob).decode('utf-8').split('\n')
+
+    def validators(self):
+        """Заголовки условного запроса для проверки, изменился ли sitemap"""
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+
+class SitemapResultCache:
+    def __init__(self, max_bytes=SITEMAP_CACHE_MAX_BYTES, ttl=SITEMAP_CACHE_TTL):
+        """
+        Ограниченный по памяти LRU-кеш результатов разбора sitemap
+
+        Устаревшие записи не удаляются сразу: по их ETag/Last-Modified sitemap проверяется
+        условным запросом, и при ответе 304 запись продлевается без повторного разбора.
+
+        :param max_bytes: Максимальный суммарный размер сжатых результатов
+        :param ttl: Срок свежести результата в секундах
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+    def lookup(self, url):
+        """
+        Найти результат по URL sitemap
+
+        :return: CachedResult (возможно, устаревший) или None
+        """
+        key = normalize_sitemap_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            if entry.fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+            return entry
+
+    def is_fresh(self, url):
+        """Есть ли свежий результат для URL (без учета в статистике)"""
+        with self._lock:
+            entry = self._entries.get(normalize_sitemap_url(url))
+            return bool(entry and entry.fresh)
+
+    def put(self, url, urls, etag=None, last_modified=None):
+        """Сохранить результат разбора; самые давно использованные записи вытесняются при превышении лимита"""
+        entry = CachedResult(urls, etag, last_modified, self.ttl)
+        if entry.size > self.max_bytes:
+            logger.info(f"Результат разбора {url} ({entry.size} байт) не помещается в кеш")
+            return entry
+
+        key = normalize_sitemap_url(url)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._size -= previous.size
+            self._entries[key] = entry
+            self._size += entry.size
+            while self._size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= evicted.size
+        return entry
+
+    def refresh(self, entry):
+        """Продлить свежесть записи после ответа 304 Not Modified"""
+        with self._lock:
+            entry.expires = time.monotonic() + self.ttl
+            self.revalidated += 1
+
+    def stats(self):
+        """Состояние кеша"""
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'revalidated': self.revalidated,
+            }
+
+
+# Общий кеш процесса
+sitemap_cache = SitemapResultCache()
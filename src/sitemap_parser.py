@@ -1,166 +1,460 @@
-import requests
 import logging
-from bs4 import BeautifulSoup
-from datetime import datetime
+from datetime import datetime, timezone
+from io import BytesIO
 import os
 import json
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from src.metrics import stage, incr
+from src.digest_renderer import render_digest_chunks
+from src.title_extractor import extract_title
+from src.dedup import Deduplicator
+from src.article_state import ArticleState, format_version
+from src.resilience import fetch
+from src.state_snapshot import (
+    dump_snapshot, load_snapshot, read_snapshot_file, snapshot_path, snapshot_saved_at, write_snapshot_file
+)
+from src.selection import TopK, score_entry, MAX_ARTICLES_TO_PROCESS, SOURCE_WEIGHT
 
 logger = logging.getLogger(__name__)
 
+# Пространства имен расширений Google News и Google Images
+NEWS_NS = '{http://www.google.com/schemas/sitemap-news/0.9}'
+IMAGE_NS = '{http://www.google.com/schemas/sitemap-image/1.1}'
+
+# Стандартные поля записи <url>
+URL_FIELDS = ('loc', 'lastmod', 'changefreq', 'priority')
+# Поля с малым числом различных значений, которые хранятся в одном экземпляре
+INTERNED_FIELDS = ('changefreq', 'priority')
+
+class SitemapEntry:
+    __slots__ = ('loc', 'lastmod', 'changefreq', 'priority', 'title', 'published', 'sitemap')
+    
+    def __init__(self, loc=None, lastmod=None, changefreq=None, priority=None, title=None, published=None,
+                 sitemap=False):
+        """
+        Запись <url> (или <sitemap> индекса) из sitemap
+        
+        Записей в sitemap бывают сотни тысяч, поэтому вместо словаря используется объект со __slots__.
+        Доступ по ключу (entry['loc'], entry.get('title')) сохранен, чтобы записи sitemap
+        и словари записей лент обрабатывались одинаково.
+        """
+        self.loc = loc
+        self.lastmod = lastmod
+        self.changefreq = changefreq
+        self.priority = priority
+        self.title = title
+        self.published = published
+        self.sitemap = sitemap
+    
+    def __getitem__(self, name):
+        return getattr(self, name)
+    
+    def get(self, name, default=None):
+        value = getattr(self, name, None)
+        return default if value is None else value
+
+def iter_sitemap_entries(content, include_index=False):
+    """
+    Потоково разобрать sitemap и вернуть записи <url>
+    
+    Помимо стандартных полей читаются расширения <news:title>, <news:publication_date>
+    и <image:title>, чтобы заголовок статьи можно было взять прямо из sitemap.
+    
+    :param content: Содержимое sitemap.xml в байтах
+    :param include_index: Возвращать также записи <sitemap> индекса sitemap (с ключом sitemap=True)
+    :return: Генератор записей SitemapEntry
+    """
+    record_tags = ('url', 'sitemap') if include_index else ('url',)
+    entry = None
+    image_title = None
+    depth = 0
+    url_depth = None
+    # Открытые элементы: разобранная запись удаляется из родителя, иначе корень хранил бы их все
+    open_elements = []
+    for event, elem in ET.iterparse(BytesIO(content), events=('start', 'end')):
+        local_name = elem.tag.rsplit('}', 1)[-1]
+        if event == 'start':
+            open_elements.append(elem)
+            depth += 1
+            if local_name in record_tags and entry is None:
+                entry = SitemapEntry(sitemap=local_name == 'sitemap')
+                image_title = None
+                url_depth = depth
+            continue
+        
+        if entry is not None:
+            text = (elem.text or '').strip()
+            if depth == url_depth:
+                if entry.loc:
+                    if entry.title is None:
+                        entry.title = image_title
+                    yield entry
+                entry = None
+                elem.clear()
+                if len(open_elements) > 1:
+                    open_elements[-2].remove(elem)
+            elif depth == url_depth + 1 and local_name in URL_FIELDS:
+                # changefreq и priority принимают несколько значений на весь sitemap
+                setattr(entry, local_name, sys.intern(text) if local_name in INTERNED_FIELDS else text)
+            elif elem.tag == NEWS_NS + 'title' and text:
+                entry.title = text
+            elif elem.tag == NEWS_NS + 'publication_date' and text:
+                entry.published = text
+            elif elem.tag == IMAGE_NS + 'title' and text and image_title is None:
+                image_title = text
+        open_elements.pop()
+        depth -= 1
+
 class SitemapParser:
     def __init__(self, sitemap_url, cache_file='last_articles.json'):
         """
         Инициализация парсера sitemap
         
         :param sitemap_url: URL sitemap.xml
-        :param cache_file: Файл для хранения ранее обработанных статей
+        :param cache_file: Файл для хранения ранее обработанных статей (JSON прежнего формата);
+                           состояние сохраняется в двоичный снимок с тем же именем в STATE_DIR
         """
         self.sitemap_url = sitemap_url
+        # Вес источника при отборе самых важных статей
+        self.source_weight = SOURCE_WEIGHT
+        # Последняя загрузка вернула только часть статей источника (например, ленту вместо sitemap):
+        # новое состояние дополняет прежнее, а не заменяет его
+        self.partial_fetch = False
+        # Источник указал пользователь (/subscribe): sitemap, дочерние sitemap и страницы статей
+        # загружаются только с публичных адресов, перенаправления проверяются (см. resilience.public_get)
+        self.public_only = False
         self.cache_file = os.path.join(os.path.dirname(os.path.dirname(__file__)), cache_file)
-        self.last_articles = self._load_last_articles()
+        self.snapshot_file = snapshot_path(cache_file)
+        # Кеш статей загружается при первом обращении, чтобы не замедлять холодный старт
+        self._last_articles = None
+        # Сбор статей может запускаться одновременно из планировщика и обработчиков разных чатов
+        self._lock = threading.Lock()
+    
+    @property
+    def last_articles(self):
+        """Ранее обработанные статьи (загружаются из кеша при первом обращении)"""
+        if self._last_articles is None:
+            self._last_articles = self._load_last_articles()
+        return self._last_articles
+    
+    @last_articles.setter
+    def last_articles(self, articles):
+        self._last_articles = articles
     
     def _load_last_articles(self):
-        """Загрузить ранее обработанные статьи из кеша"""
+        """
+        Загрузить ранее обработанные статьи из снимка состояния
+        
+        Если снимка еще нет, читается JSON-файл кеша прежнего формата; при следующем
+        сохранении состояние будет записано в снимок.
+        """
+        try:
+            if os.path.exists(self.snapshot_file):
+                started = time.perf_counter()
+                state = read_snapshot_file(self.snapshot_file)
+                logger.info(f"Загружено состояние {len(state)} статей за {(time.perf_counter() - started) * 1000:.1f} мс")
+                return state
+        except Exception as e:
+            logger.error(f"Ошибка загрузки снимка состояния статей: {e}")
+        
         try:
             if os.path.exists(self.cache_file):
                 with open(self.cache_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            return {}
+                    return ArticleState.from_json(json.load(f))
+            return ArticleState()
         except Exception as e:
             logger.error(f"Ошибка загрузки кеша статей: {e}")
-            return {}
+            return ArticleState()
     
     def _save_last_articles(self, articles):
-        """Сохранить обработанные статьи в кеш"""
+        """Сохранить обработанные статьи в снимок состояния"""
         try:
-            with open(self.cache_file, 'w', encoding='utf-8') as f:
-                json.dump(articles, f, ensure_ascii=False, indent=2)
+            write_snapshot_file(self.snapshot_file, articles)
         except Exception as e:
-            logger.error(f"Ошибка сохранения кеша статей: {e}")
+            logger.error(f"Ошибка сохранения снимка состояния статей: {e}")
+    
+    def export_state(self):
+        """Снимок текущего состояния для внешнего хранилища (например, Vercel KV)"""
+        state = self.last_articles
+        return dump_snapshot(state, saved_at=state.saved_at or None)
+    
+    def import_state(self, data):
+        """
+        Заменить состояние снимком из внешнего хранилища, если он новее текущего
+        
+        :param data: Снимок из export_state
+        :return: True если состояние заменено
+        """
+        current = self._last_articles
+        if current is not None and snapshot_saved_at(data) <= current.saved_at:
+            return False
+        state = load_snapshot(data)
+        with self._lock:
+            self._last_articles = state
+        return True
+    
+    @property
+    def source_url(self):
+        """URL источника статей"""
+        return self.sitemap_url
+    
+    def _fetch_entries(self):
+        """
+        Загрузить и разобрать sitemap.xml
+        
+        Если sitemap.xml - индекс sitemap, загружаются и разбираются его дочерние sitemap.
+        
+        :return: Список записей (SitemapEntry или словари с теми же ключами)
+        """
+        with stage('download'):
+            response = fetch(self.sitemap_url, timeout=10, public_only=self.public_only)
+        incr('bytes', len(response.content))
+        
+        with stage('parse'):
+            entries = list(iter_sitemap_entries(response.content, include_index=True))
+        children = [entry.loc for entry in entries if entry.sitemap]
+        if children:
+            entries = [entry for entry in entries if not entry.sitemap]
+            logger.info(f"{self.sitemap_url} - индекс из {len(children)} sitemap")
+            entries.extend(self._fetch_child_entries(children))
+        incr('urls', len(entries))
+        
+        logger.info(f"Найдено {len(entries)} URL в sitemap")
+        return entries
+    
+    def _fetch_child_entries(self, children):
+        """
+        Загрузить и разобрать дочерние sitemap индекса
+        
+        Дочерние sitemap загружаются пачками в несколько потоков, а разбираются
+        в пуле процессов (см. src/parallel_parse.py).
+        
+        :param children: URL дочерних sitemap
+        :return: Список записей
+        """
+        from concurrent.futures import ThreadPoolExecutor
+        from src.parallel_parse import (
+            parse_sitemaps, parse_workers, row_to_entry, MAX_CHILD_SITEMAPS, MAX_INDEX_DEPTH, SITEMAP_FETCH_THREADS
+        )
+        
+        # Пачка не меньше числа процессов, чтобы разбор загружал все ядра
+        batch_size = max(SITEMAP_FETCH_THREADS, parse_workers())
+        entries = []
+        seen = set()
+        for _ in range(MAX_INDEX_DEPTH):
+            pending = [url for url in dict.fromkeys(children) if url not in seen]
+            pending = pending[:max(MAX_CHILD_SITEMAPS - len(seen), 0)]
+            if not pending:
+                break
+            seen.update(pending)
+            
+            # Вложенные индексы обрабатываются на следующей итерации
+            children = []
+            for start in range(0, len(pending), batch_size):
+                batch = pending[start:start + batch_size]
+                with stage('download'):
+                    with ThreadPoolExecutor(max_workers=SITEMAP_FETCH_THREADS) as pool:
+                        bodies = [body for body in pool.map(self._download_sitemap, batch) if body]
+                # Метрики привязаны к контексту запуска, поэтому учитываются в основном потоке
+                incr('bytes', sum(len(body) for body in bodies))
+                incr('errors', len(batch) - len(bodies))
+                if not bodies:
+                    continue
+                
+                with stage('parse'):
+                    results = parse_sitemaps(bodies)
+                for nested, rows in results:
+                    children.extend(nested)
+                    entries.extend(row_to_entry(row) for row in rows)
+        return entries
+    
+    def _download_sitemap(self, url):
+        """Загрузить дочерний sitemap; при ошибке вернуть None"""
+        try:
+            return fetch(url, timeout=10, public_only=self.public_only).content
+        except Exception as e:
+            logger.error(f"Ошибка загрузки sitemap {url}: {e}")
+            return None
     
     def parse_sitemap(self):
-        """Парсинг sitemap.xml и получение новых статей"""
+        """Парсинг sitemap.xml и получение новых статей (см. get_new_articles)"""
+        return self.get_new_articles()
+    
+    def get_new_articles(self):
+        """Получение новых статей из источника (одновременные вызовы выполняются по очереди)"""
+        with self._lock:
+            return self._collect_new_articles()
+    
+    def _collect_new_articles(self):
         try:
-            response = requests.get(self.sitemap_url, timeout=10)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'xml')
-            urls = soup.find_all('url')
+            entries = self._fetch_entries()
             
-            logger.info(f"Найдено {len(urls)} URL в sitemap")
-            
-            articles = {}
-            for url in urls:
-                loc = url.find('loc')
-                
-                # Пытаемся найти lastmod, если его нет, то используем changefreq и priority
-                lastmod = url.find('lastmod')
-                changefreq = url.find('changefreq')
-                priority = url.find('priority')
-                
-                if loc:
-                    url_text = loc.text
-                    
-                    # Если есть lastmod, используем его
-                    if lastmod:
-                        modified_text = lastmod.text
-                    # Если нет lastmod, но есть changefreq или priority, используем их комбинацию как идентификатор версии
-                    elif changefreq or priority:
-                        # Создаем уникальный идентификатор для отслеживания изменений
-                        cf_text = changefreq.text if changefreq else "daily"
-                        pr_text = priority.text if priority else "0.5"
-                        modified_text = f"{cf_text}_{pr_text}_{datetime.now().strftime('%Y-%m-%d')}"
-                    else:
-                        # Если нет ни одного из указанных тегов, используем текущую дату
-                        modified_text = datetime.now().strftime("%Y-%m-%d")
-                    
-                    # Пропускаем статьи, которые уже были в предыдущем дайджесте
-                    if url_text in self.last_articles and self.last_articles[url_text] == modified_text:
-                        continue
-                    
-                    articles[url_text] = modified_text
+            with stage('diff'):
+                state, articles, sitemap_titles, candidates = self._diff_urls(entries)
             
             logger.info(f"Найдено {len(articles)} новых или измененных статей")
             
-            # Получаем заголовки статей
+            # Дубликаты сравниваются и между собой, и с последними ранее обработанными статьями
+            deduplicator = Deduplicator(list(self.last_articles.recent))
+            
+            # Получаем заголовки только самых важных статей (в порядке убывания оценки),
+            # чтобы не перегружать ресурсы
             new_articles = []
-            # Ограничиваем количество статей для обработки, чтобы не перегружать ресурсы
-            max_articles_to_process = 100
-            for i, url in enumerate(list(articles.keys())[:max_articles_to_process]):
-                try:
-                    title = self._get_article_title(url)
-                    if title:
+            with stage('titles'):
+                for url in candidates:
+                    try:
+                        # Зеркала, AMP-версии и новые выпуски живых лент не загружаем вовсе;
+                        # они остаются в кеше, поэтому не появятся и в следующем дайджесте
+                        original = deduplicator.url_duplicate_of(url)
+                        if original:
+                            incr('duplicates')
+                            logger.debug(f"Статья {url} - дубликат {original}")
+                            continue
+                        
+                        # Заголовок из источника (расширения sitemap, RSS/Atom) избавляет от загрузки страницы
+                        title = sitemap_titles.get(url)
+                        if title:
+                            incr('sitemap_titles')
+                        else:
+                            title = self._get_article_title(url)
+                        if not title:
+                            # Статья не запоминается и будет загружена снова в следующем запуске
+                            state.discard(url)
+                            continue
+                        
+                        original = deduplicator.title_duplicate_of(url, title)
+                        if original:
+                            incr('duplicates')
+                            logger.debug(f"Статья {url} - дубликат {original} по заголовку")
+                            continue
                         new_articles.append({
                             'url': url,
                             'title': title,
-                            'lastmod': articles[url]
+                            'lastmod': format_version(articles[url])
                         })
-                except Exception as e:
-                    logger.error(f"Ошибка при получении заголовка статьи {url}: {e}")
-            
-            # Сортируем статьи по приоритету даты (если есть числовое значение приоритета)
-            def get_priority(article):
-                try:
-                    if '_' in article['lastmod']:
-                        # Если используем формат cf_pr_date
-                        return float(article['lastmod'].split('_')[1])
-                    return 0.5
-                except:
-                    return 0.5
-                    
-            new_articles.sort(key=get_priority, reverse=True)
+                    except Exception as e:
+                        incr('errors')
+                        logger.error(f"Ошибка при получении заголовка статьи {url}: {e}")
+            incr('new_articles', len(new_articles))
             
             # Обновляем кеш
-            self._save_last_articles(articles)
+            state.recent.extend(articles)
+            self.last_articles = state
+            self._save_last_articles(state)
             
             return new_articles
         
         except Exception as e:
-            logger.error(f"Ошибка при парсинге sitemap: {e}")
+            incr('errors')
+            logger.error(f"Ошибка при получении статей из {self.source_url}: {e}")
             return []
     
+    def _diff_urls(self, entries):
+        """
+        Сравнить записи sitemap с ранее обработанными статьями
+        
+        Одновременно с обходом записей отбираются MAX_ARTICLES_TO_PROCESS самых важных
+        новых статей (по приоритету, свежести lastmod и весу источника) и строится новое
+        состояние - версии всех статей, которые сейчас есть в источнике (при partial_fetch -
+        прежнее состояние, дополненное загруженными статьями).
+        
+        :param entries: Записи <url> из iter_sitemap_entries
+        :return: Новое состояние ArticleState,
+                 словарь новых или измененных статей {url: версия},
+                 словарь заголовков из расширений sitemap {url: заголовок}
+                 и список отобранных URL в порядке убывания важности
+        """
+        if self.partial_fetch:
+            # Статьи, которых нет в неполной загрузке, остаются в состоянии
+            state = self.last_articles.copy()
+        else:
+            state = ArticleState(self.last_articles.recent)
+        articles = {}
+        titles = {}
+        top = TopK(MAX_ARTICLES_TO_PROCESS)
+        now = datetime.now(timezone.utc)
+        today = datetime.now().strftime('%Y-%m-%d')
+        for entry in entries:
+            url_text = entry['loc']
+            
+            # Пытаемся найти lastmod (или дату публикации новости), если их нет, то используем changefreq и priority
+            lastmod = entry.get('lastmod') or entry.get('published')
+            changefreq = entry.get('changefreq')
+            priority = entry.get('priority')
+            
+            # Если есть lastmod, используем его
+            if lastmod:
+                version = state.version(lastmod)
+            # Если нет lastmod, но есть changefreq или priority, используем их комбинацию как идентификатор версии
+            elif changefreq or priority:
+                # Создаем уникальный идентификатор для отслеживания изменений
+                version = state.version(changefreq or "daily", priority or "0.5", today)
+            else:
+                # Если нет ни одного из указанных тегов, используем текущую дату
+                version = state.version(today)
+            state.set(url_text, version)
+            
+            # Пропускаем статьи, которые уже были в предыдущем дайджесте
+            if self.last_articles.get(url_text) == version:
+                incr('cache_hits')
+                continue
+            
+            articles[url_text] = version
+            if entry.get('title'):
+                titles[url_text] = entry['title']
+            top.push(score_entry(entry, now, self.source_weight), url_text)
+        state.compact()
+        return state, articles, titles, top.items()
+    
     def _get_article_title(self, url):
-        """Получить заголовок статьи по URL"""
+        """
+        Получить заголовок статьи по URL
+        
+        :return: Заголовок, "Без заголовка" для страницы без заголовка или None, если страницу не удалось загрузить
+        """
         try:
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            
-            soup = BeautifulSoup(response.content, 'html.parser')
-            title = soup.find('title')
+            response = fetch(url, timeout=10, public_only=self.public_only)
             
+            # Сначала быстрые извлекатели (regex, lxml), BeautifulSoup - только как запасной вариант
+            title = extract_title(response.content, response.encoding)
             if title:
-                return title.text.strip()
-            
-            # Если title не найден, пробуем найти заголовок h1
-            h1 = soup.find('h1')
-            if h1:
-                return h1.text.strip()
+                return title
             
             return "Без заголовка"
         
         except Exception as e:
+            incr('errors')
             logger.error(f"Ошибка при получении заголовка для {url}: {e}")
-            return "Ошибка получения заголовка"
+            return None
     
-    def format_digest(self, articles, max_articles=10):
+    def iter_digest_chunks(self, articles, max_articles=10, header=None):
         """
-        Форматирование дайджеста на основе новых статей
+        Лениво сформировать дайджест частями, не превышающими лимит сообщения Telegram
         
         :param articles: Список статей
         :param max_articles: Максимальное число статей в дайджесте
-        :return: Отформатированный текст дайджеста
+        :param header: Дополнительная строка перед заголовком дайджеста
+        :return: Генератор текстов сообщений в формате MarkdownV2
         """
-        if not articles:
-            return "Нет новых статей"
-        
-        articles = articles[:max_articles]  # Ограничиваем количество статей
-        
-        now = datetime.now().strftime("%d.%m.%Y %H:%M")
-        digest = f"📰 *Дайджест новостей от {now}*\n\n"
-        
-        for i, article in enumerate(articles, 1):
-            digest += f"*{i}. {article['title']}*\n{article['url']}\n\n"
+        chunks = render_digest_chunks(articles, max_articles, header=header)
+        while True:
+            with stage('format'):
+                chunk = next(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    
+    def format_digest(self, articles, max_articles=10):
+        """
+        Форматирование дайджеста на основе новых статей
         
-        digest += "🤖 Бот автоматически собирает новости каждый час"
+        Текст может превышать лимит сообщения Telegram; для отправки используйте iter_digest_chunks.
         
-        return digest 
\ No newline at end of file
+        :param articles: Список статей
+        :param max_articles: Максимальное число статей в дайджесте
+        :return: Отформатированный текст дайджеста в формате MarkdownV2
+        """
+        return '\n\n'.join(self.iter_digest_chunks(articles, max_articles))
@@ -0,0 +1,31 @@
+import logging
+
+from src.sitemap_parser import SitemapParser
+from src.feed_parser import FeedParser, FeedWithSitemapFallback
+
+logger = logging.getLogger(__name__)
+
+# Поддерживаемые типы источников
+SOURCE_SITEMAP = 'sitemap'
+SOURCE_FEED = 'feed'
+SOURCE_FEED_WITH_SITEMAP = 'feed+sitemap'
+SOURCE_TYPES = (SOURCE_SITEMAP, SOURCE_FEED, SOURCE_FEED_WITH_SITEMAP)
+
+
+def create_parser(source_type=SOURCE_SITEMAP, sitemap_url=None, feed_url=None, cache_file='last_articles.json'):
+    """
+    Создать источник статей нужного типа
+
+    :param source_type: sitemap, feed или feed+sitemap (лента с переходом на sitemap)
+    :param sitemap_url: URL sitemap.xml
+    :param feed_url: URL ленты RSS/Atom
+    :param cache_file: Файл для хранения ранее обработанных статей
+    :return: Экземпляр SitemapParser или его наследника
+    """
+    if source_type == SOURCE_FEED:
+        return FeedParser(feed_url, cache_file)
+    if source_type == SOURCE_FEED_WITH_SITEMAP:
+        return FeedWithSitemapFallback(feed_url, sitemap_url, cache_file)
+    if source_type != SOURCE_SITEMAP:
+        logger.warning(f"Неизвестный тип источника {source_type}, используем sitemap")
+    return SitemapParser(sitemap_url, cache_file)
@@ -0,0 +1,110 @@
+"""
+Замер времени импорта для контроля холодного старта функций Vercel
+
+Использование:
+    python -m src.startup api.webhook api.cron.digest --budget 300
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+# Бюджет времени импорта модуля функции (в миллисекундах)
+COLD_START_BUDGET_MS = float(os.getenv('COLD_START_BUDGET_MS', '300'))
+
+# Тяжелые модули, которые должны загружаться только на нужном пути выполнения
+HEAVY_MODULES = ('telegram', 'telegram.ext', 'bs4', 'requests', 'lxml')
+
+# Строка вывода python -X importtime: "import time: self | cumulative | name"
+IMPORTTIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Время импорта модулей текущего процесса (в миллисекундах)
+_import_times = {}
+
+
+def record_import(module_name, started):
+    """
+    Записать время импорта модуля
+
+    :param module_name: Имя модуля
+    :param started: Значение time.perf_counter() в начале модуля
+    """
+    _import_times[module_name] = (time.perf_counter() - started) * 1000
+
+
+def import_report():
+    """Отчет о времени импорта для эндпоинта метрик"""
+    return {
+        'imports_ms': {name: round(ms, 1) for name, ms in _import_times.items()},
+        'budget_ms': COLD_START_BUDGET_MS,
+        'heavy_modules_loaded': [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+
+def measure_import(module_name):
+    """
+    Замерить время импорта модуля в чистом процессе через python -X importtime
+
+    :param module_name: Имя модуля (например, api.webhook)
+    :return: Общее время в мс и список (время в мс, модуль) для прямых импортов
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module_name}'],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Не удалось импортировать {module_name}: {result.stderr.strip().splitlines()[-1:]}")
+
+    total_ms = 0.0
+    direct_imports = []
+    pending = []
+    # Вложенные импорты выводятся перед родительским модулем, поэтому
+    # копим модули первого уровня до строки модуля верхнего уровня
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        cumulative_ms = int(match.group(2)) / 1000
+        indent = len(match.group(3))
+        name = match.group(4)
+        if indent == 3:
+            pending.append((cumulative_ms, name))
+        elif indent <= 1:
+            if name == module_name:
+                total_ms = cumulative_ms
+                direct_imports = pending
+            pending = []
+    direct_imports.sort(reverse=True)
+    return total_ms, direct_imports
+
+
+def main(argv=None):
+    """Вывести отчет о времени импорта и проверить бюджет холодного старта"""
+    parser = argparse.ArgumentParser(description="Замер времени импорта функций Vercel")
+    parser.add_argument('modules', nargs='*', default=['api.webhook', 'api.cron.digest'],
+                        help="Модули для замера")
+    parser.add_argument('--budget', type=float, default=COLD_START_BUDGET_MS,
+                        help="Бюджет времени импорта в мс")
+    parser.add_argument('--top', type=int, default=10, help="Число самых медленных импортов в отчете")
+    args = parser.parse_args(argv)
+
+    over_budget = False
+    for module_name in args.modules:
+        total_ms, direct_imports = measure_import(module_name)
+        status = '✅' if total_ms <= args.budget else '❌'
+        over_budget = over_budget or total_ms > args.budget
+        print(f"{status} {module_name}: {total_ms:.1f} мс (бюджет {args.budget:.0f} мс)")
+        for cumulative_ms, name in direct_imports[:args.top]:
+            print(f"    {cumulative_ms:8.1f} мс  {name}")
+
+    return 1 if over_budget else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
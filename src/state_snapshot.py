@@ -0,0 +1,233 @@
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+import zlib
+from array import array
+
+from src.article_state import ArticleState
+
+logger = logging.getLogger(__name__)
+
+# Сжатие снимка: zlib (по умолчанию), zstd (нужен пакет zstandard) или none
+STATE_SNAPSHOT_CODEC = os.getenv('STATE_SNAPSHOT_CODEC', 'zlib')
+# Загружать снимок с диска через mmap вместо чтения в память
+STATE_SNAPSHOT_MMAP = os.getenv('STATE_SNAPSHOT_MMAP', '1') == '1'
+# Каталог снимков состояния (на Vercel доступен для записи только /tmp)
+STATE_DIR = os.getenv(
+    'STATE_DIR',
+    '/tmp' if os.environ.get('VERCEL', '0') == '1' else os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+SNAPSHOT_SUFFIX = '.snap'
+
+# Заголовок: сигнатура, версия формата, способ сжатия, время сохранения (мс) и размер несжатых данных
+MAGIC = b'NDSS'
+SNAPSHOT_VERSION = 1
+HEADER = struct.Struct('<4sBBQI')
+# Длина секции данных
+SECTION_LENGTH = struct.Struct('<I')
+
+CODECS = {'none': 0, 'zlib': 1, 'zstd': 2}
+
+# Разделители строк внутри секций (в URL и версиях они не встречаются)
+LINE_SEPARATOR = '\n'
+PART_SEPARATOR = '\t'
+
+
+class SnapshotError(Exception):
+    """Снимок поврежден или записан в неподдерживаемом формате"""
+
+
+def _compress(payload, codec):
+    if codec == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            logger.warning("Пакет zstandard не установлен, снимок состояния сжимается zlib")
+            codec = 'zlib'
+        else:
+            return CODECS[codec], zstandard.ZstdCompressor(level=3).compress(payload)
+    if codec == 'zlib':
+        return CODECS[codec], zlib.compress(payload, 6)
+    return CODECS['none'], payload
+
+
+def _decompress(codec_id, payload, size):
+    if codec_id == CODECS['zlib']:
+        return zlib.decompress(payload)
+    if codec_id == CODECS['zstd']:
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(payload, max_output_size=size)
+    if codec_id == CODECS['none']:
+        return payload
+    raise SnapshotError(f"Неизвестный способ сжатия снимка: {codec_id}")
+
+
+def _uint_array(values):
+    """Массив беззнаковых 32-битных чисел в порядке байтов little-endian"""
+    numbers = array('I', values)
+    if sys.byteorder == 'big':
+        numbers.byteswap()
+    return numbers
+
+
+def _join(strings):
+    return LINE_SEPARATOR.join(strings).encode('utf-8')
+
+
+def _split(buffer, count=None):
+    """
+    Строки секции
+
+    Пустой блок - это и ни одной строки, и одна пустая строка (например, пустой последний сегмент URL),
+    поэтому для секций, число строк которых известно из других секций, оно передается в count.
+    """
+    text = str(buffer, 'utf-8')
+    if count is None:
+        return text.split(LINE_SEPARATOR) if text else []
+    strings = text.split(LINE_SEPARATOR) if count else []
+    if len(strings) != count:
+        raise SnapshotError(f"Ожидалось строк в секции снимка: {count}, получено {len(strings)}")
+    return strings
+
+
+def snapshot_path(cache_file):
+    """Путь к снимку состояния для файла кеша статей (last_articles.json -> STATE_DIR/last_articles.snap)"""
+    name = os.path.splitext(os.path.basename(cache_file))[0]
+    return os.path.join(STATE_DIR, name + SNAPSHOT_SUFFIX)
+
+
+def snapshot_saved_at(data):
+    """Время сохранения снимка (мс) по заголовку, без распаковки данных"""
+    if len(data) < HEADER.size:
+        raise SnapshotError("Снимок короче заголовка")
+    magic, _, _, saved_at, _ = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise SnapshotError("Неверная сигнатура снимка")
+    return saved_at
+
+
+def dump_snapshot(state, codec=STATE_SNAPSHOT_CODEC, saved_at=None):
+    """
+    Сериализовать состояние в двоичный снимок
+
+    Данные разложены по столбцам: таблица версий, префиксы URL, число статей каждого префикса,
+    последние сегменты URL и номера их версий. Строки каждого столбца соединены в один блок,
+    а числа записаны массивом, поэтому загрузка не разбирает статьи по одной.
+
+    :param state: ArticleState
+    :param codec: Способ сжатия (zlib, zstd или none)
+    :param saved_at: Время сохранения (мс); по умолчанию текущее, оно же записывается в state.saved_at
+    :return: Снимок в байтах
+    """
+    version_ids = {}
+    prefixes = []
+    counts = []
+    tails = []
+    ids = []
+    for prefix, rows in state.groups():
+        prefixes.append(prefix)
+        counts.append(len(rows))
+        tails.extend(rows)
+        ids.extend(version_ids.setdefault(version, len(version_ids)) for version in rows.values())
+
+    sections = [
+        _join(PART_SEPARATOR.join(version) for version in version_ids),
+        _join(prefixes),
+        _uint_array(counts).tobytes(),
+        _join(tails),
+        _uint_array(ids).tobytes(),
+        _join(state.recent),
+    ]
+    payload = b''.join(SECTION_LENGTH.pack(len(section)) + section for section in sections)
+    codec_id, compressed = _compress(payload, codec)
+    if saved_at is None:
+        saved_at = state.saved_at = int(time.time() * 1000)
+    header = HEADER.pack(MAGIC, SNAPSHOT_VERSION, codec_id, saved_at, len(payload))
+    return header + compressed
+
+
+def load_snapshot(data):
+    """
+    Восстановить состояние из снимка
+
+    :param data: Снимок (bytes, memoryview или mmap)
+    :return: ArticleState; время сохранения снимка - в атрибуте saved_at (мс)
+    """
+    saved_at = snapshot_saved_at(data)
+    _, version, codec_id, _, size = HEADER.unpack_from(data)
+    if version != SNAPSHOT_VERSION:
+        raise SnapshotError(f"Неподдерживаемая версия снимка: {version}")
+
+    payload = memoryview(_decompress(codec_id, memoryview(data)[HEADER.size:], size))
+    if len(payload) != size:
+        raise SnapshotError("Размер данных снимка не совпадает с заголовком")
+
+    sections = []
+    offset = 0
+    while offset < len(payload):
+        (length,) = SECTION_LENGTH.unpack_from(payload, offset)
+        offset += SECTION_LENGTH.size
+        sections.append(payload[offset:offset + length])
+        offset += length
+    if len(sections) != 6:
+        raise SnapshotError("Неверное число секций снимка")
+    versions_section, prefixes_section, counts_section, tails_section, ids_section, recent_section = sections
+
+    counts = array('I')
+    counts.frombytes(counts_section)
+    ids = array('I')
+    ids.frombytes(ids_section)
+    if sys.byteorder == 'big':
+        counts.byteswap()
+        ids.byteswap()
+
+    if sum(counts) != len(ids):
+        raise SnapshotError("Число статей в секциях снимка не совпадает")
+    # Число строк каждой секции известно: номера версий идут подряд с нуля, префиксов столько же,
+    # сколько чисел статей, а последних сегментов - сколько номеров версий
+    state = ArticleState(recent=_split(recent_section))
+    versions = [
+        state.version(*line.split(PART_SEPARATOR))
+        for line in _split(versions_section, max(ids) + 1 if ids else 0)
+    ]
+    tails = _split(tails_section, len(ids))
+
+    start = 0
+    for prefix, count in zip(_split(prefixes_section, len(counts)), counts):
+        end = start + count
+        state.set_group(prefix, dict(zip(tails[start:end], map(versions.__getitem__, ids[start:end]))))
+        start = end
+    state.compact()
+    state.saved_at = saved_at
+    return state
+
+
+def write_snapshot_file(path, state, codec=STATE_SNAPSHOT_CODEC):
+    """Записать снимок атомарно: во временный файл, затем переименовать"""
+    data = dump_snapshot(state, codec)
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    return len(data)
+
+
+def read_snapshot_file(path, use_mmap=STATE_SNAPSHOT_MMAP):
+    """
+    Прочитать снимок с диска
+
+    :param path: Путь к файлу снимка
+    :param use_mmap: Отобразить файл в память вместо чтения
+    :return: ArticleState
+    """
+    with open(path, 'rb') as f:
+        if not use_mmap or os.fstat(f.fileno()).st_size == 0:
+            return load_snapshot(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return load_snapshot(mapped)
@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import logging
+import os
+import threading
+from functools import partial
+from urllib.parse import urlsplit
+
+from src.digest_lease import collect_exclusive
+from src.digest_renderer import send_digest_chunks
+from src.metrics import incr
+from src.sources import SOURCE_FEED, SOURCE_SITEMAP, create_parser
+from src.url_validation import validate_public_host, validate_sitemap_url, validate_url
+
+logger = logging.getLogger(__name__)
+
+# Максимальное число источников, на которые может подписаться один чат
+MAX_SOURCES_PER_CHAT = int(os.getenv('MAX_SOURCES_PER_CHAT', '20'))
+# Максимальное число разных источников у всех чатов (каждый источник собирается на каждом проходе)
+MAX_SOURCES_TOTAL = int(os.getenv('MAX_SOURCES_TOTAL', '200'))
+# Сколько источников собирается одновременно за один проход планировщика
+SOURCE_CONCURRENCY = int(os.getenv('SOURCE_CONCURRENCY', '4'))
+# Сколько чатов получают дайджест одновременно (Telegram ограничивает ~30 сообщений в секунду)
+FANOUT_CONCURRENCY = int(os.getenv('FANOUT_CONCURRENCY', '10'))
+
+# Источник из настроек бота (SOURCE_TYPE, SITEMAP_URL, FEED_URL)
+DEFAULT_SOURCE = 'default'
+# Типы источников, на которые можно подписаться командой /subscribe
+SUBSCRIBE_TYPES = (SOURCE_SITEMAP, SOURCE_FEED)
+
+
+def make_source_id(url, source_type=SOURCE_SITEMAP):
+    """Идентификатор источника: "sitemap:https://..." или "feed:https://...\""""
+    return f'{source_type}:{url.strip()}'
+
+
+def split_source_id(source_id):
+    """Идентификатор источника -> (тип, URL); для источника по умолчанию URL равен None"""
+    if source_id == DEFAULT_SOURCE:
+        return DEFAULT_SOURCE, None
+    source_type, _, url = source_id.partition(':')
+    return source_type, url
+
+
+def parse_subscribe_args(args, validate=True):
+    """
+    Разобрать аргументы /subscribe и /unsubscribe: "<URL>" или "feed <URL>"
+
+    :param args: Аргументы команды (context.args)
+    :param validate: Проверить URL так же, как /parse (sitemap - по validate_sitemap_url). Для отписки
+        не проверяется, чтобы можно было отписаться от источника, добавленного до проверки
+    :return: Кортеж (идентификатор источника или None, текст ошибки или None)
+    """
+    if not args:
+        return DEFAULT_SOURCE, None
+    source_type = SOURCE_SITEMAP
+    if len(args) > 1 and args[0] in SUBSCRIBE_TYPES:
+        source_type, args = args[0], args[1:]
+    url = args[0]
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.netloc:
+        return None, '❌ Укажите URL sitemap.xml или ленты (feed <URL>), начинающийся с http:// или https://'
+    if validate:
+        error = validate_sitemap_url(url) if source_type == SOURCE_SITEMAP else validate_url(url)
+        if error:
+            return None, error
+    return make_source_id(url, source_type), None
+
+
+async def check_source_host(source_id):
+    """
+    Проверить, что источник находится на публичном сайте (запрос DNS выполняется в отдельном потоке)
+
+    :param source_id: Идентификатор источника
+    :return: Текст ошибки или None
+    """
+    _, url = split_source_id(source_id)
+    if url is None:
+        return None
+    return await asyncio.to_thread(validate_public_host, url)
+
+
+def source_label(source_id, default_url=None):
+    """Короткое название источника для сообщений"""
+    source_type, url = split_source_id(source_id)
+    url = url or default_url
+    host = urlsplit(url).netloc if url else ''
+    if source_type == DEFAULT_SOURCE:
+        return f'{host} (по умолчанию)' if host else 'источник по умолчанию'
+    return f'{host} ({source_type})'
+
+
+def format_sources(source_ids, default_url=None):
+    """Список подписок чата для команды /sources"""
+    if not source_ids:
+        return '📭 Чат не подписан ни на один источник. Используйте /subscribe'
+    lines = ['📚 Подписки чата:']
+    for source_id in source_ids:
+        _, url = split_source_id(source_id)
+        lines.append(f'🔹 {source_label(source_id, default_url)}' + (f'\n   {url}' if url else ''))
+    return '\n'.join(lines)
+
+
+def group_by_source(subscriptions):
+    """
+    Сгруппировать подписки по источникам
+
+    :param subscriptions: Словарь {ID чата: [идентификаторы источников]}
+    :return: Словарь {идентификатор источника: [ID чатов]}
+    """
+    followers = {}
+    for chat_id, source_ids in subscriptions.items():
+        for source_id in source_ids:
+            followers.setdefault(source_id, []).append(chat_id)
+    return followers
+
+
+class SourceRegistry:
+    def __init__(self, default_parser):
+        """
+        Парсеры источников, на которые подписаны чаты
+
+        Для каждого источника создается один парсер со своим файлом состояния,
+        поэтому источник собирается один раз независимо от числа подписчиков.
+
+        :param default_parser: Парсер источника из настроек бота
+        """
+        self.default = default_parser
+        self._parsers = {DEFAULT_SOURCE: default_parser}
+        self._lock = threading.Lock()
+
+    def get(self, source_id):
+        """Парсер источника (создается при первом обращении)"""
+        with self._lock:
+            parser = self._parsers.get(source_id)
+            if parser is None:
+                source_type, url = split_source_id(source_id)
+                # Свой файл состояния для каждого источника
+                digest = hashlib.sha1(source_id.encode('utf-8')).hexdigest()[:12]
+                cache_file = f'last_articles-{digest}.json'
+                if source_type == SOURCE_FEED:
+                    parser = create_parser(SOURCE_FEED, feed_url=url, cache_file=cache_file)
+                else:
+                    parser = create_parser(SOURCE_SITEMAP, sitemap_url=url, cache_file=cache_file)
+                # Адрес указал пользователь: проверка при подписке не защищает от перенаправлений,
+                # дочерних sitemap и смены ответа DNS, поэтому проверяется каждое соединение
+                parser.public_only = True
+                self._parsers[source_id] = parser
+            return parser
+
+    def url(self, source_id):
+        """URL источника без создания парсера (ключ шардирования)"""
+        return split_source_id(source_id)[1] or self.default.source_url
+
+    def retain(self, source_ids):
+        """
+        Забыть парсеры источников, на которые больше никто не подписан
+
+        :param source_ids: Источники с подписчиками
+        :return: Число удаленных парсеров
+        """
+        keep = set(source_ids) | {DEFAULT_SOURCE}
+        with self._lock:
+            stale = [source_id for source_id in self._parsers if source_id not in keep]
+            for source_id in stale:
+                del self._parsers[source_id]
+        return len(stale)
+
+    def __len__(self):
+        return len(self._parsers)
+
+
+async def collect_for_delivery(parser):
+    """Собрать новые статьи источника для рассылки (под арендой, см. collect_exclusive)"""
+    return await collect_exclusive(parser, delivers=True)
+
+
+async def deliver_subscriptions(sources, subscriptions, send_message, max_articles, collect=collect_for_delivery,
+                                owns=None):
+    """
+    Собрать каждый источник один раз и разослать дайджест всем его подписчикам
+
+    Источники собираются параллельно (не больше SOURCE_CONCURRENCY), дайджест источника
+    форматируется один раз и отправляется чатам параллельно (не больше FANOUT_CONCURRENCY).
+
+    :param sources: SourceRegistry
+    :param subscriptions: Словарь {ID чата: [идентификаторы источников]}
+    :param send_message: Асинхронная функция отправки (chat_id=..., text=..., **kwargs), например bot.send_message
+    :param max_articles: Максимальное число статей в дайджесте
+    :param collect: Асинхронная функция сбора новых статей парсера (None - источник обработан другим процессом)
+    :param owns: Функция отбора источников этого процесса по идентификатору (при шардировании)
+    :return: Словарь {идентификатор источника: число чатов, получивших дайджест}
+    """
+    followers = group_by_source(subscriptions)
+    sources.retain(followers)
+    if owns is not None:
+        followers = {source_id: chat_ids for source_id, chat_ids in followers.items() if owns(source_id)}
+    incr('sources', len(followers))
+    source_limit = asyncio.Semaphore(SOURCE_CONCURRENCY)
+    send_limit = asyncio.Semaphore(FANOUT_CONCURRENCY)
+
+    async def send_to_chat(chat_id, chunks):
+        async with send_limit:
+            try:
+                await send_digest_chunks(chunks, partial(send_message, chat_id=chat_id))
+                return True
+            except Exception as e:
+                incr('errors')
+                logger.error(f"Ошибка отправки дайджеста в чат {chat_id}: {e}")
+                return False
+
+    async def process_source(source_id, chat_ids):
+        parser = sources.get(source_id)
+        async with source_limit:
+            articles = await collect(parser)
+        if articles is None:
+            logger.info(f"Дайджест {parser.source_url} рассылает другой процесс")
+            return 0
+        if not articles:
+            logger.info(f"Нет новых статей в {parser.source_url}")
+            return 0
+
+        header = f'📰 Свежий дайджест: {source_label(source_id, parser.source_url)}'
+        chunks = list(parser.iter_digest_chunks(articles, max_articles, header=header))
+        delivered = sum(await asyncio.gather(*(send_to_chat(chat_id, chunks) for chat_id in chat_ids)))
+        incr('deliveries', delivered)
+        logger.info(f"Дайджест {parser.source_url} ({len(articles)} статей) отправлен в {delivered} чатов")
+        return delivered
+
+    results = await asyncio.gather(
+        *(process_source(source_id, chat_ids) for source_id, chat_ids in followers.items()),
+        return_exceptions=True
+    )
+    delivered = {}
+    for source_id, result in zip(followers, results):
+        if isinstance(result, Exception):
+            incr('errors')
+            logger.error(f"Ошибка при сборе источника {source_id}: {result}")
+            result = 0
+        delivered[source_id] = result
+    return delivered
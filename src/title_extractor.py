@@ -0,0 +1,159 @@
+import html
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# Размер начала документа, в котором ищутся <title> и og:title
+HEAD_BYTES = 64 * 1024
+
+# Порядок извлекателей заголовка (быстрые первыми, BeautifulSoup - запасной вариант)
+TITLE_EXTRACTORS = [name.strip() for name in os.getenv('TITLE_EXTRACTORS', 'regex,lxml,soup').split(',') if name.strip()]
+
+_CHARSET_RE = re.compile(rb'<meta[^>]+charset\s*=\s*["\']?([\w-]+)', re.IGNORECASE)
+_TITLE_RE = re.compile(r'<title[^>]*>(.*?)</title\s*>', re.IGNORECASE | re.DOTALL)
+_META_RE = re.compile(r'<meta\b[^>]*>', re.IGNORECASE)
+_OG_TITLE_RE = re.compile(r'\bproperty\s*=\s*["\']og:title["\']', re.IGNORECASE)
+_CONTENT_RE = re.compile(r'\bcontent\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.IGNORECASE | re.DOTALL)
+_H1_RE = re.compile(r'<h1\b[^>]*>(.*?)</h1\s*>', re.IGNORECASE | re.DOTALL)
+_TAG_RE = re.compile(r'<[^>]+>')
+# Содержимое, в котором <title> и <h1> не являются заголовком страницы (скрипты, стили, SVG, комментарии)
+_IGNORED_RE = re.compile(r'<!--.*?-->|<(script|style|template|noscript|svg)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+# Элемент, не закрытый до конца прочитанного фрагмента
+_UNCLOSED_RE = re.compile(r'<!--|<(?:script|style|template|noscript|svg)\b', re.IGNORECASE)
+_SPACES_RE = re.compile(r'\s+')
+
+
+def _clean(text):
+    """Убрать теги, HTML-сущности и лишние пробелы"""
+    text = html.unescape(_TAG_RE.sub(' ', text))
+    return _SPACES_RE.sub(' ', text).strip()
+
+
+def _strip_ignored(text):
+    """Удалить скрипты, стили, SVG и комментарии, а также незакрытый элемент в конце фрагмента"""
+    text = _IGNORED_RE.sub(' ', text)
+    match = _UNCLOSED_RE.search(text)
+    return text[:match.start()] if match else text
+
+
+def _detect_encoding(content, encoding=None):
+    """Определить кодировку документа по заголовку ответа или <meta charset>"""
+    if encoding and encoding.lower() != 'iso-8859-1':
+        # requests подставляет ISO-8859-1 для text/html без charset, поэтому ему не доверяем
+        return encoding
+    match = _CHARSET_RE.search(content[:4096])
+    if match:
+        return match.group(1).decode('ascii', 'ignore')
+    return 'utf-8'
+
+
+def _decode(content, encoding):
+    try:
+        return content.decode(encoding, errors='replace')
+    except LookupError:
+        return content.decode('utf-8', errors='replace')
+
+
+def extract_title_regex(content, encoding=None):
+    """
+    Быстрое извлечение заголовка регулярными выражениями
+
+    <title> и og:title ищутся только в начале документа, <h1> - во всем документе. Скрипты, стили,
+    SVG и комментарии пропускаются: строки вида "<title>" в них не являются заголовком страницы.
+    """
+    encoding = _detect_encoding(content, encoding)
+    head = _strip_ignored(_decode(content[:HEAD_BYTES], encoding))
+
+    match = _TITLE_RE.search(head)
+    if match:
+        title = _clean(match.group(1))
+        if title:
+            return title
+
+    for meta in _META_RE.finditer(head):
+        tag = meta.group(0)
+        if _OG_TITLE_RE.search(tag):
+            content_match = _CONTENT_RE.search(tag)
+            if content_match:
+                title = _clean(content_match.group(1) or content_match.group(2) or '')
+                if title:
+                    return title
+
+    text = head if len(content) <= HEAD_BYTES else _strip_ignored(_decode(content, encoding))
+    match = _H1_RE.search(text)
+    if match:
+        title = _clean(match.group(1))
+        if title:
+            return title
+    return None
+
+
+def extract_title_lxml(content, encoding=None):
+    """Извлечение заголовка C-парсером lxml"""
+    try:
+        import lxml.html
+    except ImportError:
+        return None
+
+    parser = lxml.html.HTMLParser(encoding=_detect_encoding(content, encoding))
+    document = lxml.html.document_fromstring(content, parser=parser)
+    for xpath in ('//title[not(ancestor::svg)]', '//meta[@property="og:title"]/@content', '//h1'):
+        for node in document.xpath(xpath):
+            text = node if isinstance(node, str) else node.text_content()
+            title = _clean(text)
+            if title:
+                return title
+    return None
+
+
+def extract_title_soup(content, encoding=None):
+    """Извлечение заголовка с помощью BeautifulSoup (медленный запасной вариант)"""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(content, 'html.parser', from_encoding=encoding)
+    title = soup.find('title')
+    if title and title.text.strip():
+        return title.text.strip()
+
+    og_title = soup.find('meta', attrs={'property': 'og:title'})
+    if og_title and og_title.get('content', '').strip():
+        return og_title['content'].strip()
+
+    h1 = soup.find('h1')
+    if h1 and h1.text.strip():
+        return h1.text.strip()
+    return None
+
+
+# Доступные извлекатели заголовка по имени
+EXTRACTORS = {
+    'regex': extract_title_regex,
+    'lxml': extract_title_lxml,
+    'soup': extract_title_soup,
+}
+
+
+def extract_title(content, encoding=None, extractors=None):
+    """
+    Извлечь заголовок страницы, перебирая извлекатели по порядку
+
+    :param content: HTML-документ в байтах
+    :param encoding: Кодировка из заголовков ответа (если известна)
+    :param extractors: Имена извлекателей (по умолчанию TITLE_EXTRACTORS)
+    :return: Заголовок или None, если он не найден
+    """
+    for name in extractors or TITLE_EXTRACTORS:
+        extractor = EXTRACTORS.get(name)
+        if not extractor:
+            logger.warning(f"Неизвестный извлекатель заголовка: {name}")
+            continue
+        try:
+            title = extractor(content, encoding)
+        except Exception as e:
+            logger.warning(f"Ошибка извлекателя заголовка {name}: {e}")
+            continue
+        if title:
+            return title
+    return None
@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import os
+import time
+
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Максимальное число обновлений, обрабатываемых одновременно
+UPDATE_WORKERS = int(os.getenv('UPDATE_WORKERS', '8'))
+
+
+def _chat_key(update):
+    """Чат обновления или None, если обновление не привязано к чату"""
+    chat = getattr(update, 'effective_chat', None)
+    return chat.id if chat else None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    def __init__(self, max_concurrent_updates=UPDATE_WORKERS):
+        """
+        Параллельная обработка обновлений с сохранением порядка внутри одного чата
+
+        Обновления разных чатов обрабатываются одновременно (не больше max_concurrent_updates),
+        а обновления одного чата - строго по очереди в порядке поступления.
+
+        :param max_concurrent_updates: Максимальное число одновременно обрабатываемых обновлений
+        """
+        super().__init__(max_concurrent_updates)
+        # {id чата: [блокировка, число обновлений чата в обработке или ожидании]}
+        self._chat_locks = {}
+        self.active = 0
+        self.waiting = 0
+        self.processed = 0
+        self.max_wait = 0.0
+
+    async def process_update(self, update, coroutine):
+        """
+        Дождаться очереди своего чата, затем свободного обработчика и обработать обновление
+
+        Блокировка чата берется до общего семафора: обновления чата, ожидающие своей очереди,
+        не занимают обработчики, и серия обновлений одного чата не задерживает другие чаты.
+        """
+        chat_id = _chat_key(update)
+        entry = None
+        queued = True
+        self.waiting += 1
+        started = time.perf_counter()
+        try:
+            if chat_id is not None:
+                entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+                entry[1] += 1
+                # asyncio.Lock пропускает ожидающих в порядке очереди, поэтому порядок обновлений чата сохраняется
+                await entry[0].acquire()
+            try:
+                async with self._semaphore:
+                    self.waiting -= 1
+                    queued = False
+                    self.max_wait = max(self.max_wait, time.perf_counter() - started)
+                    await self.do_process_update(update, coroutine)
+            finally:
+                if entry is not None:
+                    entry[0].release()
+        finally:
+            if queued:
+                self.waiting -= 1
+            if entry is not None:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._chat_locks[chat_id]
+
+    async def do_process_update(self, update, coroutine):
+        self.active += 1
+        try:
+            await coroutine
+        finally:
+            self.active -= 1
+            self.processed += 1
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def stats(self):
+        """Состояние обработки обновлений для /status"""
+        return {
+            'workers': self.max_concurrent_updates,
+            'active': self.active,
+            'waiting': self.waiting,
+            'chats': len(self._chat_locks),
+            'processed': self.processed,
+            'max_wait_ms': round(self.max_wait * 1000, 1),
+        }
+
+    def format_status(self, queued=0):
+        """
+        Краткая сводка для команды /status
+
+        :param queued: Число обновлений, еще не переданных обработчику (application.update_queue)
+        """
+        stats = self.stats()
+        return (
+            f"обработчиков {stats['active']}/{stats['workers']}, в очереди {queued + stats['waiting']}, "
+            f"обработано {stats['processed']}, макс. ожидание {stats['max_wait_ms']} мс"
+        )
@@ -0,0 +1,157 @@
+import ipaddress
+import logging
+import re
+import socket
+import threading
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Регулярное выражение для проверки URL
+URL_PATTERN = re.compile(
+    r'^https?://'  # http:// или https://
+    r'(?:(?:[A-Z0-9](?:[A-Z0-9-]{0,61}[A-Z0-9])?\.)+(?:[A-Z]{2,6}\.?|[A-Z0-9-]{2,}\.?)|'  # домен
+    r'localhost|'  # localhost
+    r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})'  # или IP
+    r'(?::\d+)?'  # опциональный порт
+    r'(?:/?|[/?]\S+)$', re.IGNORECASE
+)
+
+# Регулярное выражение для проверки имени файла sitemap
+SITEMAP_PATTERN = re.compile(r'sitemap.*\.xml$', re.IGNORECASE)
+
+# Сессия requests, которая соединяется только с публичными адресами (создается при первом запросе)
+_public_session = None
+_public_session_lock = threading.Lock()
+
+
+class BlockedAddressError(ValueError):
+    """Запрос к адресу внутренней сети отклонен"""
+
+
+def validate_url(url):
+    """
+    Проверить, что URL корректный (http или https, домен или IP)
+
+    :param url: URL
+    :return: Сообщение об ошибке или None
+    """
+    if not URL_PATTERN.match(url):
+        return f"⚠️ Некорректный URL: {url}"
+    return None
+
+
+def validate_sitemap_url(url):
+    """
+    Проверить, что URL корректный и похож на sitemap
+
+    :param url: URL
+    :return: Сообщение об ошибке или None
+    """
+    error = validate_url(url)
+    if error:
+        return error
+
+    # Проверяем, что URL ведет на sitemap файл
+    path = urlsplit(url).path
+    if not path or not SITEMAP_PATTERN.search(path):
+        return f"⚠️ URL не похож на sitemap файл: {url}"
+    return None
+
+
+def is_public_address(address):
+    """
+    Адрес - публичный адрес в интернете
+
+    Адреса локальной сети, loopback, link-local (в том числе адрес метаданных облака 169.254.169.254),
+    зарезервированные и multicast не считаются публичными.
+
+    :param address: IP-адрес строкой (IPv6 - возможно, с идентификатором зоны)
+    """
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    return ip.is_global and not ip.is_multicast
+
+
+def validate_public_host(url):
+    """
+    Проверить, что хост URL - публичный адрес в интернете
+
+    Адреса внутренней сети отклоняются, чтобы бот не загружал по просьбе пользователя внутренние ресурсы.
+    Проверяются все адреса, в которые разрешается имя хоста. Функция блокирующая (запрос DNS).
+    Ответ DNS может измениться после проверки, поэтому источники пользователей, кроме того,
+    загружаются через public_session.
+
+    :param url: URL
+    :return: Сообщение об ошибке или None
+    """
+    host = urlsplit(url).hostname
+    if not host:
+        return f"⚠️ Некорректный URL: {url}"
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError) as e:
+        logger.info(f"Не удалось разрешить хост {host}: {e}")
+        return f"⚠️ Не удалось найти сайт {host}"
+    for address in addresses:
+        if not is_public_address(address):
+            logger.warning(f"Отклонен URL с внутренним адресом {host} ({address}): {url}")
+            return f"⚠️ Адрес {host} недоступен для подписки: разрешены только публичные сайты"
+    return None
+
+
+def _public_connection(base):
+    """Класс соединения urllib3, который проверяет адрес уже установленного соединения"""
+
+    class PublicConnection(base):
+        def _new_conn(self):
+            sock = super()._new_conn()
+            address = sock.getpeername()[0]
+            if not is_public_address(address):
+                sock.close()
+                logger.warning(f"Отклонено соединение с внутренним адресом {self.host} ({address})")
+                raise BlockedAddressError(f"Адрес {self.host} ({address}) недоступен: разрешены только публичные сайты")
+            return sock
+
+    return PublicConnection
+
+
+def public_session():
+    """
+    Сессия requests для загрузки адресов, которые указал пользователь
+
+    Адрес проверяется после установки соединения, то есть тот, с которым бот действительно
+    соединился, поэтому смена ответа DNS после проверки при подписке (DNS rebinding) не помогает
+    обратиться к внутренней сети. Прокси из переменных окружения не используются: с ними
+    проверялся бы адрес прокси, а не сайта. Перенаправления нужно проверять отдельно
+    (см. resilience.public_get).
+
+    :return: requests.Session
+    """
+    global _public_session
+    with _public_session_lock:
+        if _public_session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+            from urllib3.connection import HTTPConnection, HTTPSConnection
+            from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+            class PublicHTTPConnectionPool(HTTPConnectionPool):
+                ConnectionCls = _public_connection(HTTPConnection)
+
+            class PublicHTTPSConnectionPool(HTTPSConnectionPool):
+                ConnectionCls = _public_connection(HTTPSConnection)
+
+            class PublicAdapter(HTTPAdapter):
+                def init_poolmanager(self, *args, **kwargs):
+                    super().init_poolmanager(*args, **kwargs)
+                    self.poolmanager.pool_classes_by_scheme = {
+                        'http': PublicHTTPConnectionPool,
+                        'https': PublicHTTPSConnectionPool,
+                    }
+
+            session = requests.Session()
+            session.trust_env = False
+            session.mount('http://', PublicAdapter())
+            session.mount('https://', PublicAdapter())
+            _public_session = session
+        return _public_session
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Тесты импортируют модули проекта (src, api) из корня репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Настройки, без которых не импортируются src.config и api.webhook; хранилище - только в памяти
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '1:test')
+os.environ.setdefault('SITEMAP_URL', 'https://news.example/sitemap.xml')
+os.environ.setdefault('STORAGE_FILE', '')
+# Снимки, архив, индекс и состояние размыкателей цепей - во временном каталоге, а не в корне репозитория
+os.environ.setdefault('STATE_DIR', tempfile.mkdtemp(prefix='news-digest-tests-'))
+
+
+class LuaKV:
+    """KV, выполняющий скрипты storage в интерпретаторе Lua с командами Redis над словарем"""
+
+    def __init__(self):
+        lupa = pytest.importorskip('lupa')
+        self.data = {}
+        self.lua = lupa.LuaRuntime()
+        self.lua.globals().redis = self.lua.table_from({'call': self._call})
+        self.lua.globals().cjson = self.lua.table_from({
+            'encode': lambda value: json.dumps(list(value.values())),
+            'decode': lambda raw: self._to_lua(json.loads(raw)),
+        })
+
+    def _to_lua(self, value):
+        if isinstance(value, dict):
+            return self.lua.table_from({key: self._to_lua(item) for key, item in value.items()})
+        if isinstance(value, list):
+            return self.lua.table_from([self._to_lua(item) for item in value])
+        return value
+
+    def _call(self, command, key, *args):
+        value = self.data.get(key)
+        if command == 'GET':
+            return value if value is not None else False
+        if command == 'SET':
+            if 'NX' in args and value is not None:
+                return False
+            self.data[key] = args[0]
+            return 'OK'
+        if command == 'DEL':
+            return int(self.data.pop(key, None) is not None)
+        fields = self.data.setdefault(key, {})
+        if command == 'HGET':
+            return fields.get(args[0], False)
+        if command == 'HSET':
+            fields.update(zip(args[::2], args[1::2]))
+            return len(args) // 2
+        if command == 'HMGET':
+            return self.lua.table_from([fields.get(name, False) for name in args])
+        if command == 'PEXPIRE':
+            return 1
+        if command == 'HDEL':
+            return int(fields.pop(args[0], None) is not None)
+        if command == 'HEXISTS':
+            return int(args[0] in fields)
+        if command == 'HLEN':
+            return len(fields)
+        if command == 'HINCRBY':
+            fields[args[0]] = int(fields.get(args[0], 0)) + int(args[1])
+            return fields[args[0]]
+        if command == 'HGETALL':
+            return self.lua.table_from([item for pair in fields.items() for item in pair])
+        raise ValueError(command)
+
+    async def get(self, key):
+        await asyncio.sleep(0)
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        await asyncio.sleep(0)
+        self.data[key] = value
+        return True
+
+    async def eval(self, script, keys, args):
+        # Переключение задач перед выполнением: скрипт атомарен, а чтение и запись по отдельности - нет
+        await asyncio.sleep(0)
+        self.lua.globals().KEYS = self.lua.table_from(keys)
+        self.lua.globals().ARGV = self.lua.table_from(args)
+        result = self.lua.execute(script)
+        return list(result.values()) if self.lua.eval('type')(result) == 'table' else result
+
+
+
+@pytest.fixture
+def lua_kv():
+    """KV, выполняющий скрипты Lua из api/utils/storage.py (нужен пакет lupa)"""
+    return LuaKV()
@@ -0,0 +1,45 @@
+from datetime import datetime
+
+import pytest
+
+from src.article_archive import ArticleArchive, parse_window
+
+NOW = datetime(2025, 4, 28, 12, 0)
+
+
+def test_parse_window_relative():
+    since, label = parse_window(['6h'], now=NOW)
+    assert since == datetime(2025, 4, 28, 6, 0).timestamp()
+    assert label == 'за 6 ч'
+
+
+def test_parse_window_since_date():
+    since, label = parse_window(['since', '2025-04-27'], now=NOW)
+    assert since == datetime(2025, 4, 27).timestamp()
+    assert label == 'с 27.04.2025 00:00'
+
+
+@pytest.mark.parametrize('args', [
+    ['999999999d'],
+    ['999999999999w'],
+    ['since', '0001-01-01'],
+    ['since', 'вчера'],
+    ['6x'],
+])
+def test_parse_window_rejects_out_of_range(args):
+    since, text = parse_window(args, now=NOW)
+    assert since is None
+    assert text.startswith('❌ Укажите период')
+
+
+def test_window_reports_truncation(tmp_path):
+    archive = ArticleArchive(str(tmp_path / 'articles.db'))
+    archive.add_articles([{'url': f'https://news.example/{number}', 'title': f'Статья {number}'}
+                          for number in range(5)], seen_at=NOW.timestamp())
+    since = NOW.timestamp() - 60
+    articles, truncated = archive.window(since, limit=3)
+    assert len(articles) == 3 and truncated
+    articles, truncated = archive.window(since, limit=5)
+    assert len(articles) == 5 and not truncated
+    assert archive.window(NOW.timestamp() + 60) == ([], False)
+    archive.close()
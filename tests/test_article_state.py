@@ -0,0 +1,30 @@
+from src.article_state import ArticleState, split_url
+
+
+def test_split_url_keeps_trailing_slash_in_tail():
+    assert split_url('https://strana.news/news/1-slug.html') == ('https://strana.news/news/', '1-slug.html')
+    assert split_url('https://strana.news/news/1-slug/') == ('https://strana.news/news/', '1-slug/')
+
+
+def test_directory_urls_share_one_prefix():
+    state = ArticleState()
+    for index in range(100):
+        state.set(f'https://strana.news/news/{index}-slug/', ('daily', '0.8', '2025-04-28'))
+    assert len(dict(state.groups())) == 1
+    assert state.get('https://strana.news/news/5-slug/') == ('daily', '0.8', '2025-04-28')
+    assert 'https://strana.news/news/5-slug' not in state
+
+
+def test_state_saved_with_empty_tails_is_regrouped():
+    data = {
+        'format': 2,
+        'versions': [['daily', '0.8', '2025-04-28']],
+        'prefixes': {
+            'https://strana.news/news/1-slug/': [['', 0]],
+            'https://strana.news/news/': [['2-slug.html', 0]],
+        },
+        'recent': [],
+    }
+    state = ArticleState.from_json(data)
+    assert sorted(state) == ['https://strana.news/news/1-slug/', 'https://strana.news/news/2-slug.html']
+    assert list(dict(state.groups())) == ['https://strana.news/news/']
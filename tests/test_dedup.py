@@ -0,0 +1,46 @@
+from src.dedup import Deduplicator, SimHashIndex, canonicalize_url, minhash, simhash, slug_tokens
+
+
+def test_canonicalize_url():
+    assert canonicalize_url('http://www.news.example/world/12345-old-slug.html?utm_source=tg&id=2#top') == \
+        'https://news.example/world/12345?id=2'
+    assert canonicalize_url('https://m.news.example/amp/world/story.amp') == 'https://news.example/world/story'
+
+
+def test_simhash_index_finds_close_fingerprints():
+    index = SimHashIndex(max_distance=3)
+    index.add(0b1011, 'a')
+    assert index.find(0b1011 ^ 0b111) == 'a'
+    assert index.find(0b1011 ^ (0b1111 << 20)) is None
+
+
+def test_url_duplicates():
+    dedup = Deduplicator(seen_urls=['https://news.example/politics/12345-old-title.html'])
+    # Смена slug и параметры отслеживания - та же статья
+    assert dedup.url_duplicate_of('https://www.news.example/politics/12345-new-title.html?utm_medium=rss') == \
+        'https://news.example/politics/12345-old-title.html'
+    # Обновление уже известной статьи дубликатом не считается
+    assert dedup.url_duplicate_of('https://news.example/politics/12345-old-title.html') is None
+    assert dedup.url_duplicate_of('https://news.example/sport/other-story-here') is None
+
+
+def test_live_blog_slugs_are_near_duplicates():
+    dedup = Deduplicator()
+    first = 'https://news.example/live/online-translyaciya-sobytiy-na-granice-12-maya'
+    assert dedup.url_duplicate_of(first) is None
+    assert simhash(slug_tokens(first)) == simhash(slug_tokens(first.replace('12', '13')))
+    assert dedup.url_duplicate_of(first.replace('12-maya', '13-maya')) == first
+
+
+def test_title_duplicates():
+    dedup = Deduplicator(title_similarity=0.7)
+    assert dedup.title_duplicate_of('a', 'Центробанк сохранил ключевую ставку на уровне шестнадцати процентов') is None
+    assert dedup.title_duplicate_of('b', 'Центробанк сохранил ключевую ставку на уровне шестнадцати процентов!') == 'a'
+    assert dedup.title_duplicate_of('c', 'Сборная выиграла чемпионат мира по хоккею') is None
+    # Короткие заголовки не сравниваются
+    assert dedup.title_duplicate_of('d', 'Главное') is None
+
+
+def test_minhash_is_deterministic():
+    tokens = ['ставка', 'центробанк', 'процент']
+    assert minhash(tokens) == minhash(list(reversed(tokens)))
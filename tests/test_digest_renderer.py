@@ -0,0 +1,52 @@
+import re
+
+from src.digest_renderer import TELEGRAM_MESSAGE_LIMIT, escape_markdown, render_digest_chunks
+
+
+def article(number, url=None, title=None):
+    return {'url': url or f'https://news.example/{number}', 'title': title or f'Статья {number}'}
+
+
+def test_escape_markdown_escapes_every_special_character():
+    special = '_*[]()~`>#+-=|{}.!\\'
+    assert escape_markdown(special) == ''.join('\\' + char for char in special)
+    assert escape_markdown('Цена 1.5% (бета)') == 'Цена 1\\.5% \\(бета\\)'
+
+
+def test_chunks_fit_limit_and_keep_numbering():
+    articles = [article(number, title='Заголовок. ' * 20) for number in range(1, 61)]
+    chunks = list(render_digest_chunks(articles, len(articles), title='Дайджест', limit=1000))
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+    numbers = [int(number) for number in re.findall(r'^\*(\d+)\\\.', '\n'.join(chunks), re.MULTILINE)]
+    assert numbers == list(range(1, 61))
+
+
+def test_long_url_is_dropped_instead_of_overflowing():
+    articles = [article(1), article(2, url='https://news.example/' + 'a' * 5000), article(3)]
+    chunks = list(render_digest_chunks(articles, len(articles), title='Дайджест'))
+    assert all(len(chunk) <= TELEGRAM_MESSAGE_LIMIT for chunk in chunks)
+    text = '\n'.join(chunks)
+    assert 'a' * 100 not in text
+    # Нумерация без пропусков
+    assert '*2\\. Статья 3*' in text
+
+
+def test_long_title_is_truncated_to_fit():
+    articles = [article(1, title='Очень длинный заголовок ' * 500)]
+    chunks = list(render_digest_chunks(articles, 1, title='Дайджест', footer=None))
+    assert len(chunks) == 1
+    assert len(chunks[0]) <= TELEGRAM_MESSAGE_LIMIT
+    assert '…*' in chunks[0]
+
+
+def test_header_is_never_sent_alone():
+    # Первая статья не помещается рядом с длинным заголовком целиком и обрезается
+    articles = [article(1, title='Заголовок ' * 400), article(2)]
+    chunks = list(render_digest_chunks(articles, 2, header='Поиск ' * 1000, title='Найдено ' * 1000))
+    assert all(len(chunk) <= TELEGRAM_MESSAGE_LIMIT for chunk in chunks)
+    assert '*1\\. ' in chunks[0]
+
+
+def test_empty_digest():
+    assert list(render_digest_chunks([], 10)) == ['Нет новых статей']
@@ -0,0 +1,92 @@
+import pytest
+
+from src.feed_parser import FeedWithSitemapFallback, iter_feed_entries
+from src.sitemap_parser import SitemapEntry, SitemapParser
+
+RSS = '''<?xml version="1.0" encoding="UTF-8"?>
+<rss version="2.0"><channel>
+<item><title>Первая новость</title><link>https://news.example/news/1-first.html</link>
+<pubDate>Mon, 28 Apr 2025 10:00:00 +0300</pubDate></item>
+<item><title>Без ссылки</title></item>
+</channel></rss>'''.encode('utf-8')
+
+ATOM = b'''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+<entry><title>Atom</title><link rel="self" href="https://news.example/self"/>
+<link href="https://news.example/news/2-second.html"/><updated>2025-04-28T11:00:00+03:00</updated></entry>
+</feed>'''
+
+LETTERS = 'абвгдежзиклмнопрстуфхцчшэюя'
+
+
+def word(number):
+    """Слово из букв: в заголовках цифры не учитываются при поиске дубликатов"""
+    letters = ''
+    while True:
+        number, digit = divmod(number, len(LETTERS))
+        letters += LETTERS[digit]
+        if not number:
+            return letters + 'ка'
+
+
+def entry(index):
+    return SitemapEntry(
+        loc=f'https://news.example/news/{index}-{word(index)}.html',
+        lastmod=f'2025-04-28T10:{index % 60:02d}:00+03:00',
+        title=f'Статья {word(index)} {word(index * 7 + 3)} {word(index * 13 + 5)}',
+    )
+
+
+def test_rss_and_atom_entries():
+    rss = list(iter_feed_entries([RSS[:100], RSS[100:]]))
+    assert rss == [{'loc': 'https://news.example/news/1-first.html', 'lastmod': '2025-04-28T10:00:00+03:00',
+                    'title': 'Первая новость'}]
+    atom = list(iter_feed_entries([ATOM]))
+    assert [item['loc'] for item in atom] == ['https://news.example/news/2-second.html']
+    assert atom[0]['lastmod'] == '2025-04-28T11:00:00+03:00'
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    source = FeedWithSitemapFallback('https://news.example/rss', 'https://news.example/sitemap.xml')
+    source.snapshot_file = str(tmp_path / 'state.snap')
+    source.cache_file = str(tmp_path / 'missing.json')
+    sitemap = [entry(index) for index in range(60)]
+    feed = {'entries': []}
+
+    def fetch_feed():
+        if not feed['entries']:
+            raise ConnectionError('feed is down')
+        return feed['entries']
+
+    monkeypatch.setattr(source.feed, '_fetch_entries', fetch_feed)
+    monkeypatch.setattr(SitemapParser, '_fetch_entries', lambda self: list(sitemap))
+    return source, sitemap, feed
+
+
+def test_feed_run_does_not_shrink_state_for_sitemap_fallback(source):
+    source, sitemap, feed = source
+
+    # Лента недоступна: статьи берутся из sitemap
+    assert len(source.get_new_articles()) == 60
+
+    # Лента вернулась и содержит последние 10 статей и одну новую
+    feed['entries'] = [{'loc': item.loc, 'lastmod': item.lastmod, 'title': item.title} for item in sitemap[-10:]]
+    fresh = entry(100)
+    feed['entries'].append({'loc': fresh.loc, 'lastmod': fresh.lastmod, 'title': fresh.title})
+    assert [article['url'] for article in source.get_new_articles()] == [fresh.loc]
+    assert len(source.last_articles) == 61
+
+    # Лента снова недоступна: старые статьи sitemap не отправляются повторно
+    feed['entries'] = []
+    sitemap.append(fresh)
+    assert source.get_new_articles() == []
+    assert len(source.last_articles) == 61
+
+
+def test_sitemap_run_forgets_removed_articles(source):
+    source, sitemap, feed = source
+    source.get_new_articles()
+    del sitemap[:50]
+    assert source.get_new_articles() == []
+    assert len(source.last_articles) == 10
@@ -0,0 +1,116 @@
+import asyncio
+import time
+
+import pytest
+
+import api.utils.storage as storage
+
+
+class FakeKV:
+    """KV с семантикой Redis для SET NX PX, INCR и скриптов аренды из storage"""
+
+    def __init__(self):
+        self.data = {}
+        self.expiry = {}
+
+    def _alive(self, key):
+        if key in self.expiry and self.expiry[key] <= time.monotonic():
+            self.data.pop(key, None)
+            del self.expiry[key]
+        return key in self.data
+
+    async def get(self, key):
+        return self.data[key] if self._alive(key) else None
+
+    async def set(self, key, value, ex=None, px=None, nx=False):
+        if nx and self._alive(key):
+            return None
+        self.data[key] = value
+        self.expiry.pop(key, None)
+        if ex or px:
+            self.expiry[key] = time.monotonic() + (ex or px / 1000)
+        return True
+
+    async def incr(self, key):
+        value = int(await self.get(key) or 0) + 1
+        self.data[key] = str(value)
+        return value
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    async def eval(self, script, keys, args):
+        if await self.get(keys[0]) != args[0]:
+            return 0
+        if script == storage._RENEW_LEASE_SCRIPT:
+            self.expiry[keys[0]] = time.monotonic() + int(args[1]) / 1000
+        elif script == storage._RELEASE_LEASE_SCRIPT:
+            self.data.pop(keys[0], None)
+        elif script == storage._FENCED_SET_SCRIPT:
+            await self.set(keys[1], args[1], px=int(args[2]) or None)
+        return 1
+
+
+@pytest.fixture(params=['memory', 'kv'])
+def backend(request, monkeypatch):
+    monkeypatch.setattr(storage, 'STORAGE_FILE', '')
+    monkeypatch.setattr(storage, '_memory_cache', {})
+    monkeypatch.setattr(storage, '_memory_expiry', {})
+    if request.param == 'kv':
+        kv = FakeKV()
+        monkeypatch.setattr(storage, 'USE_KV', True)
+        monkeypatch.setattr(storage, '_get_vercel_kv_api', lambda: kv)
+    else:
+        monkeypatch.setattr(storage, 'USE_KV', False)
+    return request.param
+
+
+def test_lease_is_exclusive_and_tokens_grow(backend):
+    async def scenario():
+        first = await storage.acquire_lease('source', ttl=10, owner='a')
+        assert first is not None
+        assert await storage.acquire_lease('source', ttl=10, owner='b') is None
+        assert await storage.renew_lease(first, ttl=10)
+        assert await storage.release_lease(first)
+        second = await storage.acquire_lease('source', ttl=10, owner='b')
+        assert second['token'] > first['token']
+
+    asyncio.run(scenario())
+
+
+def test_expired_holder_cannot_write(backend):
+    async def scenario():
+        stale = await storage.acquire_lease('source', ttl=0.05, owner='a')
+        await asyncio.sleep(0.1)
+        current = await storage.acquire_lease('source', ttl=10, owner='b')
+        assert current['token'] > stale['token']
+        assert await storage.set_value_fenced('result:source', {'token': current['token']}, current)
+
+        # Приостановленный владелец просыпается после сбора: ни одна его запись не проходит
+        assert not await storage.set_value_fenced('result:source', {'token': stale['token']}, stale)
+        assert not await storage.renew_lease(stale)
+        assert not await storage.release_lease(stale)
+        assert await storage.get_value('result:source') == {'token': current['token']}
+        assert await storage.check_lease(current)
+
+    asyncio.run(scenario())
+
+
+def test_fenced_value_expires(backend):
+    async def scenario():
+        lease = await storage.acquire_lease('source', ttl=10, owner='a')
+        assert await storage.set_value_fenced('result:source', [1], lease, ttl=0.05)
+        await asyncio.sleep(0.1)
+        assert await storage.get_value('result:source') is None
+
+    asyncio.run(scenario())
+
+
+def test_kv_available_requires_configured_kv(monkeypatch):
+    monkeypatch.setattr(storage, 'USE_KV', True)
+    monkeypatch.setattr(storage, '_get_vercel_kv_api', lambda: None)
+    assert not storage.kv_available()
+    monkeypatch.setattr(storage, '_get_vercel_kv_api', lambda: FakeKV())
+    assert storage.kv_available()
+    monkeypatch.setattr(storage, 'USE_KV', False)
+    assert not storage.kv_available()
@@ -0,0 +1,12 @@
+from src import metrics
+
+
+def test_metrics_require_token(monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', None)
+    assert not metrics.metrics_authorized('anything')
+
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', 'secret')
+    assert metrics.metrics_authorized('secret')
+    assert not metrics.metrics_authorized('wrong')
+    assert not metrics.metrics_authorized(None)
+    assert not metrics.metrics_authorized('')
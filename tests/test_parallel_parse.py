@@ -0,0 +1,36 @@
+from src import parallel_parse
+from src.parallel_parse import parse_sitemap_rows, parse_sitemaps, row_to_entry
+
+
+def sitemap(prefix, count):
+    urls = ''.join(f'<url><loc>https://{prefix}.example/{number}</loc><priority>0.5</priority></url>'
+                   for number in range(count))
+    return f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'.encode('utf-8')
+
+
+def test_rows_from_bytes_and_file(tmp_path):
+    index = (b'<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+             b'<sitemap><loc>https://a.example/child.xml</loc></sitemap></sitemapindex>')
+    assert parse_sitemap_rows(index) == (['https://a.example/child.xml'], [])
+
+    path = tmp_path / 'sitemap.xml'
+    path.write_bytes(sitemap('a', 3))
+    children, rows = parse_sitemap_rows(str(path))
+    assert children == [] and rows[0] == ('https://a.example/0', None, None, '0.5', None)
+    assert row_to_entry(rows[0]).priority == '0.5'
+
+
+def test_process_pool_matches_sequential_parse():
+    sources = [sitemap(prefix, 200) for prefix in 'abcd']
+    try:
+        assert parse_sitemaps(sources, workers=2) == parse_sitemaps(sources, workers=1)
+    finally:
+        parallel_parse.shutdown()
+
+
+def test_vercel_parses_in_process(monkeypatch):
+    monkeypatch.setenv('VERCEL', '1')
+    assert parallel_parse.parse_workers() == 1
+    monkeypatch.setenv('VERCEL', '0')
+    monkeypatch.setattr(parallel_parse, 'SITEMAP_PARSE_WORKERS', 3)
+    assert parallel_parse.parse_workers() == 3
@@ -0,0 +1,118 @@
+import asyncio
+from contextlib import contextmanager
+
+import requests
+
+import main
+from src.result_pages import PAGE_SIZE
+from src.sitemap_cache import sitemap_cache
+
+SITEMAP = 'https://stream.example/sitemap.xml'
+
+
+def urlset(count):
+    urls = ''.join(f'<url><loc>https://stream.example/{number}</loc></url>' for number in range(count))
+    return f'<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{urls}</urlset>'.encode('utf-8')
+
+
+class FakeResponse:
+    def __init__(self, content, status_code=200, headers=None, fail_after=None):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {'Content-Type': 'application/xml', **(headers or {})}
+        self.fail_after = fail_after
+
+    def raise_for_status(self):
+        pass
+
+    def iter_content(self, chunk_size):
+        for start in range(0, len(self.content), chunk_size):
+            if self.fail_after is not None and start >= self.fail_after:
+                raise requests.ConnectionError('connection reset')
+            yield self.content[start:start + chunk_size]
+
+
+def serve(monkeypatch, *responses):
+    """public_get по очереди возвращает ответы и запоминает заголовки запросов"""
+    requests_headers = []
+
+    @contextmanager
+    def public_get(url, **kwargs):
+        requests_headers.append(kwargs.get('headers'))
+        yield responses[len(requests_headers) - 1]
+
+    monkeypatch.setattr(main, 'public_get', public_get)
+    return requests_headers
+
+
+class FakeMessage:
+    def __init__(self, text=None):
+        self.text = text
+        self.edits = []
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        reply = FakeMessage(text)
+        self.replies.append(reply)
+        return reply
+
+    async def edit_text(self, text, **kwargs):
+        self.edits.append(text)
+        self.text = text
+
+
+class FakeUpdate:
+    def __init__(self, user_id):
+        self.message = FakeMessage()
+        self.effective_user = type('User', (), {'id': user_id})()
+
+
+def test_stream_yields_urls_while_downloading(monkeypatch):
+    serve(monkeypatch, FakeResponse(urlset(500)))
+    stream = main.SitemapStream(SITEMAP)
+    urls = list(stream)
+    assert urls == [f'https://stream.example/{number}' for number in range(500)]
+    assert stream.bytes_received == len(urlset(500))
+
+
+def test_stream_releases_urls_from_root():
+    parser = main.ET.XMLPullParser(events=('start', 'end'))
+    open_elements = []
+    parser.feed(urlset(50)[:-len('</urlset>')])
+    assert len(list(main.SitemapStream._read_urls(parser, open_elements))) == 50
+    # Корень <urlset> еще открыт, а разобранные <url> уже удалены из него
+    assert len(open_elements) == 1 and len(open_elements[0]) == 0
+
+
+def test_failed_stream_marks_first_page_as_incomplete(monkeypatch):
+    content = urlset(PAGE_SIZE * 20)
+    serve(monkeypatch, FakeResponse(content, fail_after=len(content) // 2))
+    update = FakeUpdate(user_id=9001)
+    asyncio.run(main.handle_url(update, SITEMAP))
+
+    progress, first_page = update.message.replies
+    assert progress.edits[-1].startswith('⚠️ Ошибка при загрузке sitemap')
+    # Первая страница больше не обещает продолжения разбора
+    assert 'разбор продолжается' not in first_page.text
+    assert 'Разбор прерван' in first_page.text
+    assert 'https://stream.example/0' in first_page.text
+
+
+def test_unchanged_sitemap_is_revalidated_with_etag(monkeypatch):
+    url = 'https://etag.example/sitemap.xml'
+    headers = serve(
+        monkeypatch,
+        FakeResponse(urlset(3), headers={'ETag': '"v1"'}),
+        FakeResponse(b'', status_code=304),
+    )
+    asyncio.run(main.handle_url(FakeUpdate(user_id=9002), url))
+    assert sitemap_cache.lookup(url).etag == '"v1"'
+
+    # Устаревшая запись проверяется условным запросом и продлевается без повторного разбора
+    sitemap_cache.lookup(url).expires = 0
+    update = FakeUpdate(user_id=9003)
+    asyncio.run(main.handle_url(update, url))
+    assert headers == [None, {'If-None-Match': '"v1"'}]
+    assert sitemap_cache.is_fresh(url)
+    assert update.message.replies[0].edits[0] == f'✅ Sitemap не изменился: {url}'
+    assert 'https://stream.example/2' in update.message.replies[1].text
@@ -0,0 +1,57 @@
+import asyncio
+
+from src import profiling
+from src.profiling import profile, to_thread
+
+
+def crawl_in_worker():
+    return sum(i * i for i in range(1000))
+
+
+def test_profile_includes_worker_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+
+    async def run():
+        with profile('digest') as report:
+            result = await to_thread(crawl_in_worker)
+        return result, report
+
+    result, report = asyncio.run(run())
+    assert result == sum(i * i for i in range(1000))
+    assert 'crawl_in_worker' in report.hotspots
+
+
+def test_to_thread_without_profile():
+    assert asyncio.run(to_thread(crawl_in_worker)) == sum(i * i for i in range(1000))
+    assert profiling._thread_profilers.get() is None
+
+
+def test_nested_profile_is_skipped(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+
+    async def run():
+        with profile('webhook') as outer:
+            with profile('digest') as inner:
+                result = await to_thread(crawl_in_worker)
+        return result, outer, inner
+
+    result, outer, inner = asyncio.run(run())
+    assert result == sum(i * i for i in range(1000))
+    assert inner.skipped and 'не собран' in inner.to_text()
+    assert not outer.skipped and 'crawl_in_worker' in outer.hotspots
+    assert len(list(tmp_path.iterdir())) == 1
+
+
+def test_profile_skipped_when_another_profiler_is_active(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+
+    class BusyProfile:
+        def enable(self):
+            raise ValueError('Another profiling tool is already active')
+
+    monkeypatch.setattr('cProfile.Profile', BusyProfile)
+    with profile('cron') as report:
+        crawl_in_worker()
+    assert report.skipped
+    assert report.to_dict()['skipped']
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,97 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src import url_validation
+from src.resilience import BreakerRegistry, fetch, public_get
+from src.sitemap_parser import SitemapParser
+from src.url_validation import BlockedAddressError
+
+# 127.0.0.1 считается публичным адресом, 127.0.0.2 - внутренним (оба - адреса одного сервера)
+PUBLIC = '127.0.0.1'
+INTERNAL = '127.0.0.2'
+
+
+class Server:
+    def __init__(self):
+        self.requests = []
+        self.routes = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append((self.headers['Host'].split(':')[0], self.path))
+                status, headers, body = server.routes.get(self.path, (404, {}, b''))
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('', 0), Handler)
+        self.port = self.httpd.server_port
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def url(self, host, path):
+        return f'http://{host}:{self.port}{path}'
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(url_validation, 'is_public_address', lambda address: address == PUBLIC)
+    server = Server()
+    yield server
+    server.httpd.shutdown()
+
+
+def test_internal_address_is_refused_after_connect(server):
+    server.routes['/secret'] = (200, {}, b'secret')
+    with pytest.raises(BlockedAddressError):
+        public_get(server.url(INTERNAL, '/secret'), timeout=5)
+    assert server.requests == []
+
+
+def test_redirect_to_internal_address_is_refused(server):
+    server.routes['/sitemap.xml'] = (302, {'Location': server.url(INTERNAL, '/secret')}, b'')
+    server.routes['/secret'] = (200, {}, b'secret')
+    with pytest.raises(BlockedAddressError):
+        public_get(server.url(PUBLIC, '/sitemap.xml'), timeout=5)
+    assert server.requests == [(PUBLIC, '/sitemap.xml')]
+
+
+def test_public_redirect_is_followed(server):
+    server.routes['/old.xml'] = (301, {'Location': '/sitemap.xml'}, b'')
+    server.routes['/sitemap.xml'] = (200, {}, b'<urlset/>')
+    assert public_get(server.url(PUBLIC, '/old.xml'), timeout=5).content == b'<urlset/>'
+
+
+def test_blocked_fetch_is_not_retried(server):
+    registry = BreakerRegistry(path=None)
+    with pytest.raises(BlockedAddressError):
+        fetch(server.url(INTERNAL, '/secret'), timeout=5, retries=2, registry=registry, public_only=True)
+    assert registry.stats()[INTERNAL]['failures'] == 1
+
+
+def test_sitemap_index_children_are_checked(server, tmp_path):
+    child_public = server.url(PUBLIC, '/child.xml')
+    child_internal = server.url(INTERNAL, '/latest/meta-data.xml')
+    server.routes['/sitemap.xml'] = (200, {}, (
+        '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        f'<sitemap><loc>{child_public}</loc></sitemap><sitemap><loc>{child_internal}</loc></sitemap>'
+        '</sitemapindex>'
+    ).encode('utf-8'))
+    server.routes['/child.xml'] = (200, {}, (
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        '<url><loc>https://news.example/news/1.html</loc></url></urlset>'
+    ).encode('utf-8'))
+
+    parser = SitemapParser(server.url(PUBLIC, '/sitemap.xml'))
+    parser.public_only = True
+    entries = parser._fetch_entries()
+    assert [entry['loc'] for entry in entries] == ['https://news.example/news/1.html']
+    assert (INTERNAL, '/latest/meta-data.xml') not in server.requests
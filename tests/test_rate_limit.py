@@ -0,0 +1,96 @@
+import asyncio
+import math
+import time
+
+import pytest
+
+import api.utils.storage as storage
+from src.rate_limit import RateLimiter, TokenBucket, format_retry_message
+
+# Общее ведро создается с текущим временем, поэтому время в тестах отсчитывается от него
+START = time.monotonic() + 1
+
+
+def make_limiter(**kwargs):
+    options = dict(user_capacity=3, user_per_minute=6, global_capacity=100, global_per_minute=60,
+                   costs={'digest': 1, 'parse': 3, 'huge': 10})
+    options.update(kwargs)
+    return RateLimiter(**options)
+
+
+def test_burst_then_refill():
+    limiter = make_limiter()
+    assert [limiter.check(1, 'digest', now=START) for _ in range(3)] == [0, 0, 0]
+    # 6 жетонов в минуту - один жетон за 10 секунд
+    assert limiter.check(1, 'digest', now=START) == pytest.approx(10)
+    assert limiter.check(1, 'digest', now=START + 5) == pytest.approx(5)
+    assert limiter.check(1, 'digest', now=START + 10) == 0
+    assert limiter.limited == 2
+
+
+def test_refill_does_not_exceed_capacity():
+    bucket = TokenBucket(3, 6, now=0)
+    bucket.take(3)
+    assert bucket.wait_time(3, now=3600) == 0
+    assert bucket.tokens == 3
+
+
+def test_limited_request_does_not_spend_tokens():
+    limiter = make_limiter()
+    assert limiter.check(1, 'digest', now=START) == 0
+    assert limiter.check(1, 'parse', now=START) == pytest.approx(10)
+    assert limiter.check(1, 'digest', now=START) == 0
+    assert limiter.check(1, 'digest', now=START) == 0
+
+
+def test_users_have_separate_buckets_and_share_global():
+    limiter = make_limiter(global_capacity=4, global_per_minute=0)
+    assert limiter.check(1, 'parse', now=START) == 0
+    assert limiter.check(2, 'digest', now=START) == 0
+    assert math.isinf(limiter.check(3, 'digest', now=START))
+
+
+def test_cost_above_capacity_spends_whole_bucket():
+    limiter = make_limiter()
+    assert limiter.check(1, 'huge', now=START) == 0
+    # Ведро пустое: следующая команда ждет восстановления, а не бесконечно
+    assert limiter.check(1, 'huge', now=START) == pytest.approx(30)
+    assert limiter.check(1, 'huge', now=START + 30) == 0
+
+
+def test_retry_message():
+    assert format_retry_message(0.2).endswith('через 1 с.')
+    assert format_retry_message(math.inf) == '⏳ Слишком много запросов. Попробуйте позже.'
+
+
+def test_buckets_are_shared_through_kv(monkeypatch, lua_kv):
+    monkeypatch.setattr(storage, 'USE_KV', True)
+    monkeypatch.setattr(storage, '_get_vercel_kv_api', lambda: lua_kv)
+    # Два экземпляра функции: у каждого свой ограничитель, но ведра общие
+    first = make_limiter(global_capacity=4, global_per_minute=0)
+    second = make_limiter(global_capacity=4, global_per_minute=0)
+
+    async def scenario():
+        assert await first.acquire(1, 'digest') == 0
+        assert await second.acquire(1, 'digest') == 0
+        assert await first.acquire(1, 'digest') == 0
+        # Ведро пользователя (3 жетона) исчерпано в сумме по экземплярам
+        assert await second.acquire(1, 'digest') == pytest.approx(10, abs=0.1)
+        assert await second.acquire(2, 'digest') == 0
+        # Общее ведро (4 жетона) тоже исчерпано
+        assert math.isinf(await first.acquire(3, 'digest'))
+
+    asyncio.run(scenario())
+    assert first.limited == 1 and second.limited == 1
+
+
+def test_acquire_falls_back_to_process_buckets(monkeypatch):
+    monkeypatch.setattr(storage, 'USE_KV', True)
+    monkeypatch.setattr(storage, '_get_vercel_kv_api', lambda: None)
+    limiter = make_limiter()
+
+    async def scenario():
+        return [await limiter.acquire(1, 'digest') for _ in range(4)]
+
+    waits = asyncio.run(scenario())
+    assert waits[:3] == [0, 0, 0] and waits[3] > 0
@@ -0,0 +1,170 @@
+import asyncio
+import json
+
+import pytest
+import requests
+
+import api.utils.storage as storage
+from src import resilience
+from src.resilience import (
+    CLOSED, HALF_OPEN, OPEN, BreakerRegistry, CircuitOpenError, backoff_delay, fetch
+)
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code}', response=self)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(resilience.time, 'sleep', delays.append)
+    return delays
+
+
+def respond(monkeypatch, *responses):
+    """requests.get по очереди возвращает ответы (исключения выбрасываются)"""
+    calls = []
+
+    def get(url, **kwargs):
+        calls.append(url)
+        result = responses[len(calls) - 1]
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    monkeypatch.setattr(requests, 'get', get)
+    return calls
+
+
+def test_backoff_delay_is_bounded():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, base=0.5, cap=4) <= min(4, 0.5 * 2 ** attempt)
+
+
+def test_fetch_retries_transient_errors(monkeypatch, sleeps):
+    calls = respond(monkeypatch, requests.ConnectionError('reset'), FakeResponse(503), FakeResponse(200))
+    registry = BreakerRegistry(path=None, threshold=5)
+    response = fetch('https://news.example/sitemap.xml', retries=2, registry=registry)
+    assert response.status_code == 200
+    assert len(calls) == 3 and len(sleeps) == 2
+    # Успех сбрасывает серию ошибок
+    assert registry.stats() == {}
+
+
+def test_fetch_respects_retry_after(monkeypatch, sleeps):
+    respond(monkeypatch, FakeResponse(429, {'Retry-After': '2'}), FakeResponse(200))
+    fetch('https://news.example/sitemap.xml', retries=1, registry=BreakerRegistry(path=None))
+    assert sleeps == [2.0]
+
+
+def test_fetch_does_not_retry_client_errors(monkeypatch, sleeps):
+    calls = respond(monkeypatch, FakeResponse(404), FakeResponse(200))
+    registry = BreakerRegistry(path=None)
+    with pytest.raises(requests.HTTPError):
+        fetch('https://news.example/missing', retries=2, registry=registry)
+    assert len(calls) == 1 and not sleeps
+    # 404 отдельной статьи - не отказ хоста
+    assert registry.stats() == {}
+
+
+def test_fetch_gives_up_after_retries(monkeypatch, sleeps):
+    calls = respond(monkeypatch, *[FakeResponse(502)] * 3)
+    with pytest.raises(requests.HTTPError):
+        fetch('https://news.example/sitemap.xml', retries=2, registry=BreakerRegistry(path=None))
+    assert len(calls) == 3 and len(sleeps) == 2
+
+
+def test_breaker_closed_open_half_open(clock):
+    registry = BreakerRegistry(path=None, threshold=2, reset_timeout=60)
+    host = 'news.example'
+    registry.before_request(host)
+    registry.record_failure(host)
+    assert registry.stats()[host]['state'] == CLOSED
+    registry.record_failure(host)
+    assert registry.stats()[host]['state'] == OPEN
+    with pytest.raises(CircuitOpenError):
+        registry.before_request(host)
+
+    # После reset_timeout пропускается один пробный запрос
+    clock[0] += 60
+    registry.before_request(host)
+    assert registry.stats()[host]['state'] == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        registry.before_request(host)
+
+    # Неудачная проба снова размыкает цепь, удачная - замыкает
+    registry.record_failure(host)
+    assert registry.stats()[host]['state'] == OPEN
+    clock[0] += 60
+    registry.before_request(host)
+    registry.record_success(host)
+    assert registry.stats() == {}
+    registry.before_request(host)
+
+
+def test_open_breaker_rejects_fetch_without_request(monkeypatch, clock, sleeps):
+    calls = respond(monkeypatch, *[requests.ConnectionError('down')] * 2)
+    registry = BreakerRegistry(path=None, threshold=2)
+    with pytest.raises(requests.ConnectionError):
+        fetch('https://news.example/sitemap.xml', retries=1, registry=registry)
+    with pytest.raises(CircuitOpenError):
+        fetch('https://news.example/sitemap.xml', retries=1, registry=registry)
+    assert len(calls) == 2
+
+
+def test_breaker_state_survives_restart(tmp_path, clock):
+    path = str(tmp_path / 'breakers.json')
+    registry = BreakerRegistry(path=path, threshold=1)
+    registry.record_failure('news.example')
+    restarted = BreakerRegistry(path=path, threshold=1)
+    with pytest.raises(CircuitOpenError):
+        restarted.before_request('news.example')
+
+
+def test_breaker_state_is_shared_through_kv(monkeypatch, lua_kv, clock):
+    monkeypatch.setattr(storage, 'USE_KV', True)
+    monkeypatch.setattr(storage, '_get_vercel_kv_api', lambda: lua_kv)
+    first = BreakerRegistry(path=None, threshold=1)
+    second = BreakerRegistry(path=None, threshold=1)
+
+    async def scenario():
+        await storage.restore_breakers(first)
+        first.record_failure('a.example')
+        await storage.restore_breakers(second)
+        second.record_failure('b.example')
+        await storage.save_breakers(first)
+        await storage.save_breakers(second)
+
+        # Новый вызов функции (пустой /tmp) видит цепи обоих вызовов
+        cold = BreakerRegistry(path=None, threshold=1)
+        await storage.restore_breakers(cold)
+        for host in ('a.example', 'b.example'):
+            with pytest.raises(CircuitOpenError):
+                cold.before_request(host)
+
+        # Замкнутая цепь удаляется из хранилища
+        clock[0] += resilience.BREAKER_RESET_TIMEOUT
+        cold.before_request('a.example')
+        cold.record_success('a.example')
+        await storage.save_breakers(cold)
+
+    asyncio.run(scenario())
+    assert set(lua_kv.data[storage.BREAKERS_KEY]) == {'b.example'}
+    assert json.loads(lua_kv.data[storage.BREAKERS_KEY]['b.example'])['state'] == OPEN
@@ -0,0 +1,47 @@
+from src.result_pages import ALL_URLS, PagedResult, ResultStore, path_prefix
+
+URLS = [f'https://site.example/news/{number}' for number in range(25)] + \
+       [f'https://site.example/blog/{number}' for number in range(10)] + ['https://site.example/about']
+
+
+def test_path_prefix():
+    assert path_prefix('https://site.example/news/2024/a') == '/news/'
+    assert path_prefix('https://site.example/about') == '/'
+    assert path_prefix('https://site.example') == '/'
+
+
+def test_pages_cover_all_urls_in_order():
+    result = PagedResult('https://site.example/sitemap.xml', URLS, page_size=10)
+    assert len(result) == 36 and result.pages() == 4
+    pages = [result.page(number) for number in range(result.pages())]
+    assert [len(page) for page in pages] == [10, 10, 10, 6]
+    assert sum(pages, []) == URLS
+    assert result.page(4) == []
+
+
+def test_prefix_filters():
+    result = PagedResult('https://site.example/sitemap.xml', URLS, page_size=10)
+    assert result.prefixes == ['/news/', '/blog/', '/']
+    blog = result.prefixes.index('/blog/')
+    assert result.total(blog) == 10 and result.pages(blog) == 1
+    assert result.page(0, blog) == URLS[25:35]
+    news = result.prefixes.index('/news/')
+    assert result.page(2, news) == URLS[20:25]
+    assert result.total(ALL_URLS) == 36
+
+
+def test_single_prefix_has_no_filters():
+    result = PagedResult('https://site.example/sitemap.xml', URLS[:25])
+    assert result.prefixes == []
+    assert PagedResult('https://site.example/sitemap.xml', []).pages() == 1
+
+
+def test_store_evicts_least_recently_used():
+    store = ResultStore(max_bytes=PagedResult('', URLS).size * 2)
+    first, _ = store.add('a', URLS)
+    second, _ = store.add('b', URLS)
+    assert store.get(first) is not None
+    third, _ = store.add('c', URLS)
+    # Вытесняется давно использованный результат, а не последний прочитанный
+    assert store.get(second) is None
+    assert store.get(first) is not None and store.get(third) is not None
@@ -0,0 +1,93 @@
+import pytest
+
+from src import search_index as search_module
+from src.search_index import SearchIndex, stem, tokenize
+
+
+@pytest.fixture
+def index(tmp_path):
+    index = SearchIndex(str(tmp_path / 'search.db'))
+    yield index
+    index.close()
+
+
+def article(number, title):
+    return {'url': f'https://news.example/news/{number}.html', 'title': title}
+
+
+@pytest.mark.parametrize('word, base', [
+    ('выборах', 'выбор'),
+    ('выборы', 'выбор'),
+    ('выборами', 'выбор'),
+    ('президента', 'президент'),
+    ('moldova', 'moldova'),
+])
+def test_stem(word, base):
+    assert stem(word) == base
+
+
+def test_tokenize_drops_stopwords_and_normalizes():
+    assert tokenize('Ёлки и выборы в Молдове') == [stem('елки'), 'выбор', stem('молдове')]
+
+
+def test_bm25_ranking_order(index):
+    index.add_articles([
+        article(1, 'Выборы'),
+        article(2, 'Выборы президента Молдовы прошли без нарушений на всех участках страны'),
+        article(3, 'Погода в Киеве'),
+        article(4, 'Выборы в Молдове и выборы в Румынии'),
+    ])
+    urls = [result['url'] for result in index.search('выборах')]
+    # Короткий заголовок с термом выше длинного, второе вхождение терма поднимает статью
+    # над той, где терм встречается один раз; статья без терма не найдена
+    assert urls == [article(1, '')['url'], article(4, '')['url'], article(2, '')['url']]
+    # Редкий терм весит больше частого
+    assert index.search('выборы Молдове')[0]['url'] == article(4, '')['url']
+    assert index.search('погода выборы')[0]['url'] == article(3, '')['url']
+
+
+def test_search_stops_early(index, monkeypatch):
+    monkeypatch.setattr(search_module, '_POSTINGS_BATCH', 4)
+    index.add_articles([article(number, 'Выборы ' + 'новость ' * (number % 7)) for number in range(200)])
+    scored = []
+    original = index._score
+
+    def counting_score(connection, doc_ids, idfs, scores):
+        scored.extend(doc_ids)
+        original(connection, doc_ids, idfs, scores)
+
+    monkeypatch.setattr(index, '_score', counting_score)
+    results = index.search('выборы', limit=3)
+    # Пороговый алгоритм: прочитан один блок списка терма, а не все 200 статей
+    assert len(scored) == 4
+    assert [result['score'] for result in results] == sorted((result['score'] for result in results), reverse=True)
+    assert all('новость' not in result['title'] for result in results)
+
+
+def test_average_length_follows_added_articles(tmp_path):
+    short = [article(number, 'Выборы') for number in range(20)]
+    long = [article(100 + number, 'Выборы президента Молдовы прошли на всех участках страны') for number in range(60)]
+
+    incremental = SearchIndex(str(tmp_path / 'incremental.db'))
+    incremental.add_articles(short)
+    first_average = incremental._average_length
+    incremental.add_articles(long)
+    assert incremental._average_length > first_average * 1.5
+
+    # Вклады пересчитаны: результат тот же, что у индекса, построенного сразу по всем статьям
+    batch = SearchIndex(str(tmp_path / 'batch.db'))
+    batch.add_articles(short + long)
+    assert incremental._average_length == pytest.approx(batch._average_length)
+    ranking = [[(result['url'], result['score']) for result in index.search('выборы молдовы', limit=30)]
+               for index in (incremental, batch)]
+    assert ranking[0] == ranking[1]
+
+    # Суммарная длина сохраняется в индексе и переживает перезапуск
+    incremental.close()
+    reopened = SearchIndex(str(tmp_path / 'incremental.db'))
+    assert len(reopened) == 80
+    reopened._connect()
+    assert reopened._average_length == pytest.approx(batch._average_length)
+    assert reopened._total_length == batch._total_length
+    for index in (reopened, batch):
+        index.close()
@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from src.selection import TopK, parse_datetime, parse_priority, recency, score_entry
+
+NOW = datetime(2024, 5, 1, 12, tzinfo=timezone.utc)
+
+
+def test_parse_priority_and_datetime():
+    assert parse_priority('0.8') == 0.8
+    assert parse_priority('7') == 1.0 and parse_priority('bad') == 0.5 and parse_priority(None) == 0.5
+    assert parse_datetime('2024-05-01T12:00:00Z') == NOW
+    assert parse_datetime('2024-05-01') == datetime(2024, 5, 1, tzinfo=timezone.utc)
+    assert parse_datetime('вчера') is None
+
+
+def test_recency_halves_every_half_life():
+    assert recency(NOW.isoformat(), NOW) == pytest.approx(1.0)
+    assert recency((NOW - timedelta(hours=24)).isoformat(), NOW, half_life_hours=24) == pytest.approx(0.5)
+    assert recency(None, NOW) == 0.5
+
+
+def test_fresh_important_articles_score_higher():
+    fresh = {'priority': '0.9', 'lastmod': NOW.isoformat()}
+    old = {'priority': '0.9', 'lastmod': (NOW - timedelta(days=3)).isoformat()}
+    minor = {'priority': '0.1', 'lastmod': NOW.isoformat()}
+    assert score_entry(fresh, NOW) > score_entry(minor, NOW) > score_entry(old, NOW)
+    assert score_entry(fresh, NOW, source_weight=2) == pytest.approx(2 * score_entry(fresh, NOW))
+
+
+def test_top_k_keeps_best_items_in_order():
+    top = TopK(3)
+    for score, item in [(0.1, 'a'), (0.9, 'b'), (0.5, 'c'), (0.7, 'd'), (0.2, 'e')]:
+        top.push(score, item)
+    assert len(top) == 3
+    assert top.items() == ['b', 'd', 'c']
+
+
+def test_top_k_prefers_earlier_items_on_ties():
+    top = TopK(2)
+    for item in 'abc':
+        top.push(1.0, item)
+    assert top.items() == ['a', 'b']
+    empty = TopK(0)
+    empty.push(1.0, 'a')
+    assert empty.items() == []
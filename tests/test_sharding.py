@@ -0,0 +1,57 @@
+import api.utils.storage as storage
+from src import sharding
+from src.sharding import HashRing, check_shared_storage
+
+KEYS = [f'https://site{number}.example/sitemap.xml' for number in range(2000)]
+
+
+def owners(ring):
+    return {key: ring.owner(key) for key in KEYS}
+
+
+def test_owner_is_stable():
+    ring = HashRing(['a', 'b', 'c'])
+    # Порядок участников не влияет на распределение
+    assert owners(ring) == owners(HashRing(['c', 'a', 'b']))
+    assert HashRing([]).owner(KEYS[0]) is None
+
+
+def test_keys_are_spread_between_members():
+    counts = {}
+    for owner in owners(HashRing(['a', 'b', 'c', 'd'])).values():
+        counts[owner] = counts.get(owner, 0) + 1
+    assert set(counts) == {'a', 'b', 'c', 'd'}
+    assert all(300 < count < 700 for count in counts.values())
+
+
+def test_joining_member_takes_about_one_nth():
+    before = owners(HashRing(['a', 'b', 'c', 'd']))
+    after = owners(HashRing(['a', 'b', 'c', 'd', 'e']))
+    moved = [key for key in KEYS if before[key] != after[key]]
+    # Переходят только ключи нового участника, примерно 1/5
+    assert all(after[key] == 'e' for key in moved)
+    assert 0.1 < len(moved) / len(KEYS) < 0.3
+
+
+def test_leaving_member_keys_move_to_others():
+    before = owners(HashRing(['a', 'b', 'c', 'd']))
+    after = owners(HashRing(['a', 'b', 'c']))
+    for key in KEYS:
+        if before[key] != 'd':
+            assert after[key] == before[key]
+        else:
+            assert after[key] in {'a', 'b', 'c'}
+
+
+def test_sharding_requires_shared_storage(monkeypatch):
+    monkeypatch.setattr(sharding, 'SHARDING', True)
+    monkeypatch.setattr(storage, 'USE_KV', False)
+    assert check_shared_storage()
+    monkeypatch.setattr(storage, 'USE_KV', True)
+    monkeypatch.setattr(storage, 'kv_available', lambda: False)
+    assert check_shared_storage()
+    monkeypatch.setattr(storage, 'kv_available', lambda: True)
+    assert check_shared_storage() is None
+    monkeypatch.setattr(sharding, 'SHARDING', False)
+    monkeypatch.setattr(storage, 'USE_KV', False)
+    assert check_shared_storage() is None
@@ -0,0 +1,45 @@
+from src.sitemap_cache import CachedResult, SitemapResultCache, normalize_sitemap_url
+
+URLS = [f'https://site.example/{number}' for number in range(100)]
+
+
+def test_normalize_sitemap_url():
+    assert normalize_sitemap_url(' HTTPS://Site.Example:443/sitemap.xml#top ') == 'https://site.example/sitemap.xml'
+    assert normalize_sitemap_url('http://site.example:8080') == 'http://site.example:8080/'
+
+
+def test_cached_result_round_trip_and_validators():
+    entry = CachedResult(URLS, etag='"v1"', last_modified='Mon, 01 Jan 2024 00:00:00 GMT')
+    assert entry.urls() == URLS and entry.count == 100
+    assert entry.validators() == {'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+    assert CachedResult([]).urls() == [] and CachedResult([]).validators() == {}
+
+
+def test_stale_entry_is_kept_for_revalidation():
+    cache = SitemapResultCache(ttl=300)
+    cache.put('https://site.example/sitemap.xml', URLS, etag='"v1"')
+    assert cache.is_fresh('https://SITE.example/sitemap.xml')
+
+    entry = cache.lookup('https://site.example/sitemap.xml')
+    entry.expires = 0
+    stale = cache.lookup('https://site.example/sitemap.xml')
+    assert stale is entry and not stale.fresh and stale.etag == '"v1"'
+
+    # Ответ 304 продлевает запись без повторного разбора
+    cache.refresh(stale)
+    assert cache.is_fresh('https://site.example/sitemap.xml')
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1 and cache.stats()['revalidated'] == 1
+
+
+def test_cache_is_bounded_by_size():
+    size = CachedResult(URLS).size
+    cache = SitemapResultCache(max_bytes=size * 2)
+    for name in 'abc':
+        cache.put(f'https://{name}.example/sitemap.xml', URLS)
+    assert cache.lookup('https://a.example/sitemap.xml') is None
+    assert cache.stats()['entries'] == 2 and cache.stats()['bytes'] <= size * 2
+
+    # Результат больше всего кеша не сохраняется
+    tiny = SitemapResultCache(max_bytes=1)
+    tiny.put('https://a.example/sitemap.xml', URLS)
+    assert tiny.stats()['entries'] == 0
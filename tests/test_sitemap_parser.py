@@ -0,0 +1,68 @@
+import xml.etree.ElementTree as ET
+
+from src import sitemap_parser
+from src.sitemap_parser import iter_sitemap_entries
+
+SITEMAP = '''<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9"
+        xmlns:news="http://www.google.com/schemas/sitemap-news/0.9"
+        xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">
+  <url>
+    <loc> https://news.example/a </loc>
+    <lastmod>2024-05-01T10:00:00Z</lastmod>
+    <changefreq>hourly</changefreq>
+    <priority>0.8</priority>
+    <news:news>
+      <news:publication_date>2024-05-01T09:00:00Z</news:publication_date>
+      <news:title>Новость из news</news:title>
+    </news:news>
+    <image:image><image:title>Подпись к фото</image:title></image:image>
+  </url>
+  <url>
+    <loc>https://news.example/b</loc>
+    <image:image><image:title>Первая подпись</image:title></image:image>
+    <image:image><image:title>Вторая подпись</image:title></image:image>
+  </url>
+  <url><lastmod>2024-05-01</lastmod></url>
+</urlset>'''.encode('utf-8')
+
+INDEX = b'''<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>https://news.example/sitemap-1.xml</loc></sitemap>
+  <sitemap><loc>https://news.example/sitemap-2.xml</loc></sitemap>
+</sitemapindex>'''
+
+
+def test_entries_with_news_and_image_titles():
+    first, second = iter_sitemap_entries(SITEMAP)
+    assert (first.loc, first.lastmod, first.changefreq, first.priority) == \
+        ('https://news.example/a', '2024-05-01T10:00:00Z', 'hourly', '0.8')
+    # <news:title> важнее подписи к изображению
+    assert first.title == 'Новость из news' and first.published == '2024-05-01T09:00:00Z'
+    assert second.title == 'Первая подпись'
+    assert second['loc'] == 'https://news.example/b' and second.get('priority', '0.5') == '0.5'
+
+
+def test_index_entries_are_returned_on_request():
+    assert list(iter_sitemap_entries(INDEX)) == []
+    entries = list(iter_sitemap_entries(INDEX, include_index=True))
+    assert [entry.loc for entry in entries] == ['https://news.example/sitemap-1.xml',
+                                                'https://news.example/sitemap-2.xml']
+    assert all(entry.sitemap for entry in entries)
+
+
+def test_parsed_records_are_removed_from_root(monkeypatch):
+    roots = []
+    original = ET.iterparse
+
+    def iterparse(source, events):
+        for event, elem in original(source, events=events):
+            if not roots:
+                roots.append(elem)
+            yield event, elem
+
+    monkeypatch.setattr(sitemap_parser.ET, 'iterparse', iterparse)
+    content = b'<urlset>' + b''.join(b'<url><loc>https://news.example/%d</loc></url>' % number
+                                     for number in range(1000)) + b'</urlset>'
+    assert len(list(iter_sitemap_entries(content))) == 1000
+    # Корень не накапливает разобранные записи
+    assert len(roots[0]) == 0
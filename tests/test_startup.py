@@ -0,0 +1,17 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_webhook_import_is_lazy():
+    # Отдельный процесс: в этом модули уже могли быть импортированы другими тестами
+    code = (
+        "import sys, api.webhook; "
+        "print(','.join(m for m in ('telegram', 'bs4', 'src.sources', 'src.search_index', "
+        "'src.article_archive', 'src.digest_lease', 'src.subscriptions') if m in sys.modules))"
+    )
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, env=os.environ.copy(),
+                            capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ''
@@ -0,0 +1,50 @@
+import pytest
+
+from src.article_state import ArticleState
+from src.state_snapshot import dump_snapshot, load_snapshot
+
+VERSION = ('daily', '0.8', '2025-04-28')
+
+
+def round_trip(state, codec='zlib'):
+    return load_snapshot(dump_snapshot(state, codec))
+
+
+@pytest.mark.parametrize('codec', ['zlib', 'none'])
+def test_round_trip(codec):
+    state = ArticleState(recent=['https://strana.news/news/2-slug/'])
+    state.set('https://strana.news/news/1-slug.html', VERSION)
+    state.set('https://strana.news/news/2-slug/', ('2025-04-28T10:00:00+03:00',))
+    state.set('https://strana.news/articles/3-slug/', VERSION)
+
+    loaded = round_trip(state, codec)
+    assert sorted(loaded) == sorted(state)
+    assert all(loaded.get(url) == state.get(url) for url in state)
+    assert list(loaded.recent) == list(state.recent)
+    assert loaded.saved_at == state.saved_at
+
+
+def test_round_trip_empty_state():
+    assert len(round_trip(ArticleState())) == 0
+
+
+def test_round_trip_with_empty_tails():
+    state = ArticleState()
+    state.set('', VERSION)
+    state.set('https://strana.news/news/1-slug', VERSION)
+    # Группа с единственным пустым сегментом, как в состоянии до переноса "/" в последний сегмент
+    state._prefixes['https://strana.news/news/2-slug/'] = {'': VERSION}
+
+    loaded = round_trip(state)
+    assert sorted(loaded) == ['', 'https://strana.news/news/1-slug', 'https://strana.news/news/2-slug/']
+    assert loaded.get('https://strana.news/news/2-slug/') == VERSION
+    assert loaded.get('') == VERSION
+
+
+def test_round_trip_with_single_empty_tail():
+    state = ArticleState()
+    state._prefixes['https://strana.news/news/1-slug/'] = {'': VERSION}
+
+    loaded = round_trip(state)
+    assert list(loaded) == ['https://strana.news/news/1-slug/']
+    assert loaded.get('https://strana.news/news/1-slug/') == VERSION
@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+import api.utils.storage as storage
+
+
+class FailingKV:
+    """KV, каждый запрос к которому завершается ошибкой (например, при сбое сети)"""
+
+    async def _fail(self, *args, **kwargs):
+        raise ConnectionError('kv is down')
+
+    get = set = delete = incr = eval = _fail
+
+
+@pytest.fixture
+def failing_kv(monkeypatch):
+    monkeypatch.setattr(storage, 'USE_KV', True)
+    monkeypatch.setattr(storage, '_get_vercel_kv_api', lambda: FailingKV())
+
+
+def test_basic_operations_report_errors(failing_kv):
+    assert asyncio.run(storage.get_value('key', 'default')) == 'default'
+    assert asyncio.run(storage.set_value('key', 1)) is False
+    # None - ошибка, а не "ключ уже существует"
+    assert asyncio.run(storage.add_value('key', 1)) is None
+
+
+def test_updates_are_processed_when_dedup_is_unavailable(failing_kv):
+    assert asyncio.run(storage.claim_update(42)) is True
+
+
+def test_lease_is_not_acquired_when_kv_fails(failing_kv):
+    assert asyncio.run(storage.acquire_lease('digest')) is None
+
+
+def test_subscriptions_fail_closed(failing_kv):
+    assert asyncio.run(storage.subscribe(1, 'default')) is False
+    assert asyncio.run(storage.get_subscriptions()) == {}
@@ -0,0 +1,105 @@
+import asyncio
+import json
+import socket
+
+import pytest
+
+import api.utils.storage as storage
+from src import url_validation
+from src.subscriptions import DEFAULT_SOURCE, parse_subscribe_args
+
+
+def resolve_to(address):
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (address, 0))]
+    return getaddrinfo
+
+
+def test_parse_subscribe_args():
+    assert parse_subscribe_args([]) == (DEFAULT_SOURCE, None)
+    assert parse_subscribe_args(['https://strana.news/sitemap.xml']) == ('sitemap:https://strana.news/sitemap.xml', None)
+    assert parse_subscribe_args(['feed', 'https://strana.news/rss']) == ('feed:https://strana.news/rss', None)
+    assert parse_subscribe_args(['https://strana.news/news'])[0] is None
+    assert parse_subscribe_args(['ftp://strana.news/sitemap.xml'])[0] is None
+    # Отписаться можно и от источника, добавленного до проверки URL
+    assert parse_subscribe_args(['https://strana.news/news'], validate=False)[0] == 'sitemap:https://strana.news/news'
+
+
+@pytest.mark.parametrize('address', ['127.0.0.1', '10.0.0.5', '192.168.1.1', '169.254.169.254', '::1', '100.64.0.1'])
+def test_internal_hosts_are_rejected(monkeypatch, address):
+    monkeypatch.setattr(url_validation.socket, 'getaddrinfo', resolve_to(address))
+    assert url_validation.validate_public_host('https://news.example/sitemap.xml')
+
+
+def test_public_host_is_accepted(monkeypatch):
+    monkeypatch.setattr(url_validation.socket, 'getaddrinfo', resolve_to('93.184.216.34'))
+    assert url_validation.validate_public_host('https://news.example/sitemap.xml') is None
+
+
+def test_subscription_limits(monkeypatch):
+    monkeypatch.setattr(storage, 'USE_KV', False)
+    monkeypatch.setattr(storage, 'STORAGE_FILE', '')
+    monkeypatch.setattr(storage, '_memory_cache', {})
+    monkeypatch.setattr(storage, '_memory_expiry', {})
+
+    async def scenario():
+        assert await storage.subscribe(1, 'sitemap:https://a/sitemap.xml', limit=2, total_limit=2)
+        assert await storage.subscribe(1, 'sitemap:https://b/sitemap.xml', limit=2, total_limit=2)
+        # Лимит чата
+        assert not await storage.subscribe(1, 'sitemap:https://c/sitemap.xml', limit=2, total_limit=3)
+        # Общий лимит: новый источник нельзя, уже известный - можно
+        assert not await storage.subscribe(2, 'sitemap:https://c/sitemap.xml', limit=2, total_limit=2)
+        assert await storage.subscribe(2, 'sitemap:https://a/sitemap.xml', limit=2, total_limit=2)
+
+    asyncio.run(scenario())
+
+
+@pytest.fixture
+def kv_storage(monkeypatch, lua_kv):
+    kv = lua_kv
+    monkeypatch.setattr(storage, 'USE_KV', True)
+    monkeypatch.setattr(storage, '_get_vercel_kv_api', lambda: kv)
+    return kv
+
+
+def test_concurrent_subscriptions_are_kept(kv_storage):
+    async def scenario():
+        await asyncio.gather(*(storage.subscribe(chat_id, 'sitemap:https://a/sitemap.xml') for chat_id in range(20)))
+        await asyncio.gather(*(storage.subscribe(chat_id, f'feed:https://{chat_id}/rss') for chat_id in range(20)))
+        assert len(await storage.get_subscriptions()) == 20
+        await asyncio.gather(*(storage.unsubscribe(chat_id, 'sitemap:https://a/sitemap.xml') for chat_id in range(10)))
+        subscriptions = await storage.get_subscriptions()
+        assert subscriptions['0'] == ['feed:https://0/rss']
+        assert subscriptions['15'] == ['sitemap:https://a/sitemap.xml', 'feed:https://15/rss']
+
+    asyncio.run(scenario())
+    # Счетчик подписчиков источника согласован с подписками чатов
+    assert kv_storage.data[storage.SUBSCRIPTION_SOURCES_KEY]['sitemap:https://a/sitemap.xml'] == 10
+
+
+def test_kv_subscription_limits_and_migration(kv_storage):
+    kv_storage.data[storage.SUBSCRIPTIONS_KEY] = json.dumps({'1': ['sitemap:https://a/sitemap.xml']})
+
+    async def scenario():
+        # Подписки из прежнего ключа переносятся и учитываются в лимитах
+        assert not await storage.subscribe(2, 'sitemap:https://b/sitemap.xml', limit=2, total_limit=1)
+        assert await storage.subscribe(2, 'sitemap:https://a/sitemap.xml', limit=2, total_limit=1)
+        assert not await storage.subscribe(2, 'sitemap:https://a/sitemap.xml')
+        assert not await storage.seed_subscription(3, 'default')
+        assert await storage.unsubscribe(1)
+        assert not await storage.unsubscribe(1)
+        assert await storage.get_subscriptions() == {'2': ['sitemap:https://a/sitemap.xml']}
+
+    asyncio.run(scenario())
+    assert storage.SUBSCRIPTIONS_KEY not in kv_storage.data
+
+
+def test_seed_subscription_runs_once(kv_storage):
+    async def scenario():
+        assert await storage.seed_subscription(1, 'default')
+        assert await storage.unsubscribe(1)
+        # Чат отписался сам: подписка по умолчанию не создается снова
+        assert not await storage.seed_subscription(1, 'default')
+        assert await storage.get_subscriptions() == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,40 @@
+import pytest
+
+from src.title_extractor import HEAD_BYTES, extract_title, extract_title_lxml, extract_title_regex
+
+PAGE = '''<html><head>
+<!-- <title>Закомментированный</title> -->
+<script>document.write("<title>Из скрипта</title>")</script>
+<style>/* <title>Из стиля</title> */</style>
+<title>Настоящий заголовок &amp; подзаголовок</title>
+</head><body>
+<svg><title>Иконка</title></svg>
+<h1>Заголовок статьи</h1>
+</body></html>'''.encode('utf-8')
+
+
+@pytest.mark.parametrize('extractor', [extract_title_regex, extract_title_lxml])
+def test_title_inside_script_style_and_comments_is_ignored(extractor):
+    assert extractor(PAGE) == 'Настоящий заголовок & подзаголовок'
+
+
+def test_svg_title_is_not_page_title():
+    page = '<html><body><svg><title>Иконка</title></svg><h1>Заголовок статьи</h1></body></html>'.encode('utf-8')
+    assert extract_title_regex(page) == 'Заголовок статьи'
+
+
+def test_unclosed_script_at_head_boundary_is_ignored():
+    page = (b'<html><head><script>var s = "' + b'x' * HEAD_BYTES + b'<title>Not a title</title>";</script>'
+            b'</head><body><h1>Heading</h1></body></html>')
+    assert extract_title_regex(page) == 'Heading'
+
+
+def test_og_title_and_encoding():
+    page = ('<html><head><meta charset="windows-1251">'
+            '<meta property="og:title" content="Новости дня"></head></html>').encode('windows-1251')
+    assert extract_title_regex(page) == 'Новости дня'
+
+
+def test_extract_title_falls_back_to_next_extractor():
+    assert extract_title(b'<html><body><p>Nothing</p></body></html>', extractors=['regex', 'soup']) is None
+    assert extract_title('<h1>Только h1</h1>'.encode('utf-8'), extractors=['unknown', 'regex']) == 'Только h1'
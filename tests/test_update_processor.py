@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+from src.update_processor import ChatOrderedUpdateProcessor
+
+
+def make_update(chat_id):
+    return SimpleNamespace(effective_chat=SimpleNamespace(id=chat_id))
+
+
+def test_burst_in_one_chat_does_not_delay_other_chat():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(2)
+        release_a = asyncio.Event()
+        order = []
+
+        async def handle_a(index):
+            order.append(('a', index))
+            await release_a.wait()
+
+        async def handle_b():
+            order.append(('b', 0))
+
+        # Серия обновлений чата A: первое занимает обработчик, остальные ждут своей очереди
+        burst = [asyncio.create_task(processor.process_update(make_update(1), handle_a(index))) for index in range(5)]
+        await asyncio.sleep(0)
+        other = asyncio.create_task(processor.process_update(make_update(2), handle_b()))
+
+        await asyncio.wait_for(other, timeout=1)
+        assert ('b', 0) in order
+        assert processor.active == 1
+        assert processor.waiting == 4
+
+        release_a.set()
+        await asyncio.gather(*burst)
+        assert [item for item in order if item[0] == 'a'] == [('a', index) for index in range(5)]
+        assert processor.waiting == 0
+        assert processor.stats()['chats'] == 0
+
+    asyncio.run(scenario())
+
+
+def test_updates_of_one_chat_run_one_at_a_time():
+    async def scenario():
+        processor = ChatOrderedUpdateProcessor(4)
+        running = []
+        peak = []
+
+        async def handle(index):
+            running.append(index)
+            peak.append(len(running))
+            await asyncio.sleep(0.01)
+            running.remove(index)
+
+        await asyncio.gather(*(processor.process_update(make_update(1), handle(index)) for index in range(4)))
+        assert max(peak) == 1
+        assert processor.processed == 4
+
+    asyncio.run(scenario())
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+import api.utils.storage as storage
+from api.utils import update_queue
+
+
+@pytest.fixture(autouse=True)
+def memory_storage(monkeypatch):
+    monkeypatch.setattr(storage, 'USE_KV', False)
+    monkeypatch.setattr(storage, 'STORAGE_FILE', '')
+    monkeypatch.setattr(storage, '_memory_cache', {})
+    monkeypatch.setattr(storage, '_memory_expiry', {})
+
+
+def test_drain_processes_queue_in_order():
+    processed = []
+
+    async def process(update_data):
+        processed.append(update_data['update_id'])
+
+    async def scenario():
+        for update_id in (1, 2, 3):
+            assert await update_queue.enqueue_update({'update_id': update_id})
+        return await update_queue.drain_updates(process)
+
+    assert asyncio.run(scenario()) == (3, False)
+    assert processed == [1, 2, 3]
+    assert asyncio.run(storage.queue_length(update_queue.UPDATE_QUEUE_KEY)) == 0
+
+
+def test_full_queue_rejects_update(monkeypatch):
+    monkeypatch.setattr(update_queue, 'WEBHOOK_QUEUE_SIZE', 2)
+
+    async def scenario():
+        return [await update_queue.enqueue_update({'update_id': update_id}) for update_id in (1, 2, 3)]
+
+    assert asyncio.run(scenario()) == [True, True, False]
+
+
+def test_failed_update_does_not_stop_drain():
+    processed = []
+
+    async def process(update_data):
+        if update_data['update_id'] == 1:
+            raise RuntimeError('boom')
+        processed.append(update_data['update_id'])
+
+    async def scenario():
+        for update_id in (1, 2):
+            await update_queue.enqueue_update({'update_id': update_id})
+        return await update_queue.drain_updates(process)
+
+    assert asyncio.run(scenario()) == (1, False)
+    assert processed == [2]
+
+
+def test_second_drain_leaves_queue_to_lease_holder():
+    async def scenario():
+        await update_queue.enqueue_update({'update_id': 1})
+        lease = await storage.acquire_lease(update_queue.DRAIN_LEASE, 10)
+        result = await update_queue.drain_updates(lambda update_data: asyncio.sleep(0))
+        await storage.release_lease(lease)
+        return result, await storage.queue_length(update_queue.UPDATE_QUEUE_KEY)
+
+    assert asyncio.run(scenario()) == ((0, False), 1)
+
+
+def test_drain_reports_remaining_after_budget():
+    async def scenario():
+        for update_id in (1, 2):
+            await update_queue.enqueue_update({'update_id': update_id})
+        return await update_queue.drain_updates(lambda update_data: asyncio.sleep(0), budget=0)
+
+    assert asyncio.run(scenario()) == (0, True)
+
+
+def test_drain_token():
+    assert update_queue.check_drain_token(update_queue.WEBHOOK_DRAIN_TOKEN)
+    assert not update_queue.check_drain_token('wrong')
+    assert not update_queue.check_drain_token(None)